@@ -1,6 +1,6 @@
+import logging
 from flask import Flask
 from flask_migrate import Migrate
-from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import MetaData
 from flask_praetorian import Praetorian
 from flask_cors import CORS
@@ -8,6 +8,13 @@ from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 
 from config import config
+from .cache import ForecastCache, IdentityCache, RepertoireCache
+from .masters import MastersIndex
+from .metrics import Metrics
+from .replica import RoutingSQLAlchemy
+from .sqlite import SQLitePerformance
+# registers the sqlite:// rate limit storage
+from . import ratelimit
 
 
 migrate = Migrate()
@@ -24,21 +31,40 @@ convention = {
     "pk": "pk_%(table_name)s"
 }
 metadata = MetaData(naming_convention=convention)
-db = SQLAlchemy(metadata=metadata)
+# selects go to the replica database when there is one, see app/replica.py
+db = RoutingSQLAlchemy(metadata=metadata)
 guard = Praetorian()
 cors = CORS()
 limiter = Limiter(key_func=get_remote_address)
+repertoire_cache = RepertoireCache()
+identity_cache = IdentityCache()
+forecast_cache = ForecastCache()
+masters_index = MastersIndex()
+sqlite_performance = SQLitePerformance()
+metrics = Metrics()
 
 def create_app(config_name):
     app = Flask(__name__)
     app.config.from_object(config[config_name])
 
     db.init_app(app)
+    sqlite_performance.init_app(app, db)
+    metrics.init_app(app, db)
+
+    # loggers of the app's modules are children of app.logger
+    if app.config['LOG_LEVEL'] == 'OFF':
+        app.logger.setLevel(logging.CRITICAL + 1)
+    else:
+        app.logger.setLevel(app.config['LOG_LEVEL'])
  
     from .models import User
     guard.init_app(app, User)
     cors.init_app(app)
     limiter.init_app(app)
+    repertoire_cache.init_app(app)
+    identity_cache.init_app(app)
+    forecast_cache.init_app(app)
+    masters_index.init_app(app)
 
     # set render_as_batch=True to fix sqlite migration issues
     # as per Miguel: https://youtu.be/wpRVZFwsD70
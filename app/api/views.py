@@ -1,8 +1,23 @@
-from flask import request, abort, jsonify
-from flask_praetorian import auth_required, current_user
+import logging
+from flask import request, abort, jsonify, Response, stream_with_context
+from flask_praetorian import auth_required, roles_required, current_user
 from . import api
-from .. import guard, db, limiter
-from ..models import User, Move
+from .. import guard, db, limiter, masters_index, metrics as app_metrics, repertoire_cache
+from ..models import MoveNotFoundError, User, Move
+from ..utils.constants import (
+    COLOR_CHOICES,
+    EXPLORE_MAX_DEPTH,
+    EXPLORE_MAX_NODES,
+    FORECAST_DAYS,
+    FORECAST_MAX_DAYS,
+    STUDY_DECK_MAX_SIZE,
+    STUDY_DECK_SIZE,
+    STARTING_POSITION_FEN
+)
+from ..utils.export import moves_to_ndjson, moves_to_pgn
+from ..utils.pgn import pgn_to_tree
+
+logger = logging.getLogger(__name__)
 
 
 @api.route('/login', methods=['POST'])
@@ -58,17 +73,115 @@ def add_move():
     #return {'message': f'protected endpoint (allowed user {current_user().username})'}
 
 
+@api.route('/import', methods=['POST'])
+@auth_required
+def import_moves():
+    """
+    adds many moves to the user's book at once
+    expects a json with the following keys:
+    perspective: 'w' or 'b' (not needed with parent_id)
+    pgn: PGN text, variations are imported too
+        or
+    moves: list of {san, fen, children} objects
+    parent_id: optional move to add the moves under
+
+    returns a json with the number of moves created and already existing
+    """
+    user_id = current_user().id
+    r = request.get_json(force=True)
+    perspective = r.get('perspective', None)
+    parent_id = r.get('parent_id', None)
+    pgn = r.get('pgn', None)
+    moves = r.get('moves', None)
+    if not parent_id and perspective not in COLOR_CHOICES:
+        abort(400, 'Missing value perspective in POST json')
+    if pgn:
+        fen = None
+        if parent_id:
+            parent = Move.query \
+                        .filter_by(id=parent_id, user_id=user_id) \
+                        .first_or_404()
+            fen = parent.fen
+        try:
+            moves = pgn_to_tree(pgn, fen)
+        except ValueError as e:
+            abort(400, str(e))
+    if moves is None:
+        abort(400, 'Missing value pgn or moves in POST json')
+
+    try:
+        counts = Move.import_tree(user_id, perspective, moves, parent_id)
+    except ValueError as e:
+        abort(400, str(e))
+    except MoveNotFoundError:
+        abort(404, 'parent_id is not one of your moves')
+    return counts, 200
+
+
+@api.route('/export', methods=['POST'])
+@auth_required
+def export():
+    """
+    streams a whole subtree, or the user's whole book for a color
+    expects a json with either of the following keys:
+    color: 'w' or 'b'
+        exports the user's book from given color's perspective
+    move_id: int
+        exports the move and all moves following from it
+    and optionally:
+    format: 'ndjson' (default), one json object per line, or 'pgn'
+    sm2: bool, add the supermemo2 values of each move (ndjson only)
+    """
+    user_id = current_user().id
+    r = request.get_json(force=True)
+    color = r.get('color', None)
+    move_id = r.get('move_id', None)
+    export_format = r.get('format', 'ndjson')
+    if not move_id and color not in COLOR_CHOICES:
+        abort(400, 'missing color or move_id parameters')
+    if export_format not in ('ndjson', 'pgn'):
+        abort(400, 'format must be ndjson or pgn')
+
+    fen = STARTING_POSITION_FEN
+    if move_id:
+        move = Move.query.filter_by(id=move_id, user_id=user_id).first_or_404()
+        if move.parent_id:
+            fen = move.parent.fen
+    rows = Move.export_moves(user_id, move_id, color)
+    if export_format == 'pgn':
+        body = moves_to_pgn(rows, fen)
+        mimetype = 'application/x-chess-pgn'
+    else:
+        body = moves_to_ndjson(rows, bool(r.get('sm2', False)))
+        mimetype = 'application/x-ndjson'
+    return Response(stream_with_context(body), mimetype=mimetype)
+
+
 @api.route('/del-move', methods=['POST'])
 @auth_required
 def del_move():
+    """
+    expects a json with the following keys:
+    move_id: int
+    recursive: bool, optional
+        also delete the moves following move_id, which otherwise
+        must not have any
+
+    returns a json with keys message and deleted, the number of moves
+    deleted
+    """
     r = request.get_json(force=True)
     move_id = r.get('move_id', None)
     if not move_id:
         abort(400)
     user_id = current_user().id
 
-    Move.delete_move(user_id, move_id)
-    return {'message': 'success'}, 200
+    if r.get('recursive', False):
+        deleted = Move.delete_subtree(user_id, move_id)
+    else:
+        Move.delete_move(user_id, move_id)
+        deleted = 1
+    return {'message': 'success', 'deleted': deleted}, 200
 
 
 @api.route('/play', methods=['POST'])
@@ -81,8 +194,12 @@ def play():
     last_move_id: parent move
     score: int between 0-5 (inclusive)
         represents supermemo2 score
+    line: bool, optional
+        plan the whole line down to the end of the book, the scores of
+        its moves are then sent to /scores in a single request
 
-    returns a json with keys move and next
+    returns a json with keys move and next, with line each move of next
+    has a key then, holding the same dict for the position after it
     """
     # get values from json and coerce into correct types
     user_id = current_user().id
@@ -90,33 +207,39 @@ def play():
     color = r.get('color', None)
 
     first_move = bool(r.get('first_move', None))
+    line = bool(r.get('line', None))
     last_move_list = r.get('last_move_id', [])
-    score = r.get('score', None)
-    if score:
-        score = int(score)
+    score = _score(r.get('score', None))
 
-    print(f'Got a request to play: first move: {first_move} color: {color} last move id: {last_move_list} score: {score}')
+    logger.debug('play: first move %s, color %s, last move ids %s, score %s',
+                 first_move, color, last_move_list, score)
 
     if first_move:
         if not color:
             abort(400, 'Missing argument color')
+        if line and color in ('white', 'black'):
+            return Move.get_line(user_id, color=color)
         if color == 'white':
             return Move.get_whites_first_book_moves(user_id)
         elif color == 'black':
             return Move.get_blacks_first_book_move(user_id)
 
-    # did player miss a move with a list of options? set them all to 0
-    if len(last_move_list) > 1:
-        for move_id in last_move_list:
-            Move.add_study_session(move_id, score)
+    if not last_move_list:
+        abort(400, 'missing last_move_id')
     # now take first value and call it a day
     last_move_id = last_move_list[0]
 
     # check for valid move id
     if not last_move_id > 0:
         abort(400, 'invalid move id')
-    #TODO:  in case of fail, this is currently adding the score twice
-    return Move.get_next_moves(last_move_id, score)
+    # did player miss a move with a list of options? set them all to 0
+    if score is not None:
+        _add_scores(user_id, [(move_id, score) for move_id in last_move_list])
+        # the score is recorded, don't add it again
+        score = None
+    if line:
+        return Move.get_line(user_id, last_move_id, score=score)
+    return Move.get_next_moves(last_move_id, score, user_id)
 
 
 @api.route('/study', methods=['POST'])
@@ -124,7 +247,7 @@ def play():
 def study():
     """
     expects a json with the following keys:
-    color: 'white' or 'black'
+    color: 'white' or 'black' (optional, defaults to both colors)
     last_move_id: id of last move (if any)
     score: int between 0-5 (inclusive)
         represents supermemo2 score to associate with last move
@@ -133,53 +256,279 @@ def study():
     """
     user_id = current_user().id
     r = request.get_json(force=True)
-    print('got a request to STUDY with the following args: ', r)
+    logger.debug('study: %s', r)
 
-    #color = r.get('color', None)
+    color = r.get('color', None)
     last_move_id = r.get('last_move_id', [])
-    print('got last move id ', last_move_id)
-    score = r.get('score', -1)
-
+    score = r.get('score', None)
+    # a negative score stands for no score
+    if isinstance(score, int) and score < 0:
+        score = None
+    score = _score(score)
 
     # check for a list of moves to update SMTwo score
-    if len(last_move_id) and score >= 0:
-        print(f'got a list of length {len(last_move_id)}')
-        for move_id in last_move_id:
-            Move.add_study_session(move_id, score)
-            print(f"just added score {score} for move {move_id}")
-    else:
-        print(f"couldn't use {last_move_id} or {score}")
-    return Move.get_move_by_next_review(user_id)
+    if len(last_move_id) and score is not None:
+        _add_scores(user_id, [(move_id, score) for move_id in last_move_id])
+        logger.debug('added score %s for moves %s', score, last_move_id)
+    return Move.get_move_by_next_review(user_id, color)
+
+
+def _score(score):
+    """returns score as an int between 0 and 5, None if missing"""
+    if score is None:
+        return None
+    try:
+        score = int(score)
+    except (TypeError, ValueError):
+        abort(400, 'invalid score')
+    if not 0 <= score <= 5:
+        abort(400, 'score must be between 0 and 5')
+    return score
+
+
+def _add_scores(user_id, pairs):
+    """records scores, aborting when a move isn't the user's"""
+    try:
+        Move.add_study_sessions(user_id, pairs)
+    except MoveNotFoundError:
+        abort(404, 'move not found')
+
+
+@api.route('/study-deck', methods=['POST'])
+@auth_required
+def study_deck():
+    """
+    returns the next positions due for study, for a whole session
+    expects a json with the following keys, all optional:
+    color: 'white' or 'black', defaults to both colors
+    size: int, number of due moves to fetch, at most 100
+    cursor: the cursor returned with the previous deck, to continue it
+
+    returns a json with keys cards, a list of dicts with keys goal_id,
+    move and next like /study, and cursor, null when no more are due.
+    scores are sent to /scores
+    """
+    user_id = current_user().id
+    r = request.get_json(force=True)
+    color = r.get('color', None)
+    cursor = r.get('cursor', None)
+    try:
+        size = int(r.get('size', STUDY_DECK_SIZE))
+        if cursor is not None:
+            cursor = {'next_review': cursor.get('next_review'),
+                      'id': int(cursor['id'])}
+    except (TypeError, ValueError, KeyError, AttributeError):
+        abort(400, 'invalid size or cursor')
+    size = min(max(size, 1), STUDY_DECK_MAX_SIZE)
+    try:
+        return Move.get_study_deck(user_id, color, size, cursor)
+    except ValueError:
+        abort(400, 'invalid cursor')
+
+
+@api.route('/forecast', methods=['POST'])
+@auth_required
+def forecast():
+    """
+    returns how many reviews fall due on each of the coming days
+    expects a json with the following keys, all optional:
+    days: int, length of the forecast, defaults to a year
+    color: 'white' or 'black', defaults to both colors
+
+    returns a json with keys start, the date of the first day, days, a
+    list of counts, overdue, later (due after the last day) and new
+    (never reviewed)
+    """
+    user_id = current_user().id
+    r = request.get_json(force=True)
+    try:
+        days = int(r.get('days', FORECAST_DAYS))
+    except (TypeError, ValueError):
+        abort(400, 'invalid days')
+    days = min(max(days, 1), FORECAST_MAX_DAYS)
+    return Move.get_review_forecast(user_id, days, r.get('color', None))
+
+
+@api.route('/scores', methods=['POST'])
+@auth_required
+def scores():
+    """
+    records supermemo2 scores for several moves in one transaction
+    expects a json with the following key:
+    scores: list of [move_id, score] pairs, score being an int
+        between 0-5 (inclusive)
+
+    returns a json with the number of scores recorded
+    """
+    user_id = current_user().id
+    r = request.get_json(force=True)
+    try:
+        pairs = [(int(move_id), int(score))
+                    for move_id, score in r.get('scores', [])]
+    except (TypeError, ValueError):
+        abort(400, 'scores must be a list of [move_id, score] pairs')
+    if not all(0 <= score <= 5 for _, score in pairs):
+        abort(400, 'score must be between 0 and 5')
+
+    _add_scores(user_id, pairs)
+    return {'message': 'success', 'count': len(pairs)}, 200
+
+
+@api.route('/position', methods=['POST'])
+@auth_required
+def position():
+    """
+    finds where a position occurs in the user's book
+    expects a json with the following key:
+    fen: the position to look for
+
+    returns a list of the moves leading to the position, each with
+    its line from the start of the book
+    """
+    user_id = current_user().id
+    r = request.get_json(force=True)
+    fen = r.get('fen', None)
+    if not fen or len(fen.split(' ')) < 4:
+        abort(400, 'missing or invalid fen parameter')
+    return jsonify(Move.find_position(user_id, fen))
 
-    
+
+@api.route('/transpositions', methods=['POST'])
+@auth_required
+def transpositions():
+    """
+    finds the other lines of the user's book reaching the same position
+    expects a json with the following key:
+    move_id: int
+
+    returns a list of moves, each with its line from the start of the book
+    """
+    user_id = current_user().id
+    r = request.get_json(force=True)
+    move_id = r.get('move_id', None)
+    if not move_id:
+        abort(400, 'missing move_id parameter')
+    return jsonify(Move.get_transpositions(user_id, move_id))
 
 
-@api.route('/explore', methods=['POST'])
+@api.route('/explore', methods=['GET', 'POST'])
 @auth_required
 def explore():
     """Returns all moves for a given position
-    expects to be passed a json with either of the following keys:
+    expects to be passed a json, or for GET the query string, with either
+    of the following keys:
     color: 'w' or 'b'
         starts from beginning of user's database from given color's perspective
     last_move_id: int
         gives all the database moves following from given move
+    and optionally:
+    depth: int, number of plies to return as a nested tree, each move
+        having a child_count and, unless cut off, a list of children
+    max_nodes: int, largest number of moves to return with depth
+
+    GET responses carry an etag, which only changes when the user adds or
+    deletes moves: sent back with If-None-Match, the moves aren't loaded
+    again and the response is a 304
+    """
+    user_id = current_user().id
+    if request.method == 'POST':
+        return jsonify(_explore(user_id, request.get_json(force=True)))
+
+    etag = f'{user_id}-{User.get_repertoire_version(user_id)}'
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = jsonify(_explore(user_id, request.args))
+    response.set_etag(etag)
+    # may be cached by the browser, as long as it checks the etag
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def _int(r, key, default=0):
+    """returns r[key] as an int, default if missing"""
+    value = r.get(key)
+    if value is None or value == '':
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        abort(400, f'{key} must be an integer')
+
+
+def _explore(user_id, r):
+    color = r.get('color', None)
+    last_move_id = _int(r, 'last_move_id')
+    if not color and not last_move_id:
+        abort(400, 'missing color or last_move_id parameters')
+
+    #NOTE: these are lists, so must be jsonified
+    depth = _int(r, 'depth')
+    if depth:
+        depth = min(max(depth, 1), EXPLORE_MAX_DEPTH)
+        max_nodes = min(max(_int(r, 'max_nodes', EXPLORE_MAX_NODES), 1),
+                        EXPLORE_MAX_NODES)
+        return Move.get_subtree(user_id, last_move_id, color, depth, max_nodes)
+    elif last_move_id:
+        logger.debug('explore: children of move %s', last_move_id)
+        return Move.get_descendent_moves(last_move_id)
+    else:
+        logger.debug('explore: start of book for %s', color)
+        return Move.get_book_start(user_id, color)
+
+
+@api.route('/masters', methods=['POST'])
+@auth_required
+def masters():
+    """Returns the moves played in masters games from a position
+    expects to be passed a json with either of the following keys:
+    color: 'w' or 'b'
+        the starting position
+    last_move_id: int
+        the position after one of the user's moves
+
+    returns a dict with keys fen and moves, a list of moves most played
+    first with keys uci, san, fen, white, draws, black and total
     """
-    print('entering explore')
     user_id = current_user().id
     r = request.get_json(force=True)
 
     color = r.get('color', None)
     last_move_id = int(r.get('last_move_id', 0))
     if not color and not last_move_id:
-        print(f'missing something: {color} {last_move_id}')
         abort(400, 'missing color or last_move_id parameters')
+    if not masters_index.available:
+        abort(503, 'masters index not available')
 
-    #NOTE: these are lists, so must be jsonified
     if last_move_id:
-        print('getting response in Explore view based on move id')
-        response = Move.get_descendent_moves(last_move_id)
+        move = Move.query.filter_by(id=last_move_id).first()
+        if not move or move.user_id != user_id:
+            abort(400, 'move not found')
+        fen = move.fen
     else:
-        print(f'getting response in Explore view based on color {color}')
-        response = Move.get_book_start(user_id, color)
-    return jsonify(response)
-    
\ No newline at end of file
+        fen = STARTING_POSITION_FEN
+    return jsonify({'fen': fen, 'moves': masters_index.continuations(fen)})
+
+
+@api.route('/cache-stats', methods=['GET'])
+@roles_required('admin')
+def cache_stats():
+    """Returns the hit and miss counters of this worker's repertoire cache"""
+    return repertoire_cache.stats()
+
+
+@api.route('/metrics', methods=['GET'])
+@roles_required('admin')
+def metrics():
+    """Returns this worker's request and query metrics for Prometheus"""
+    cache = repertoire_cache.stats()
+    extra = {
+        'repertoire_cache_hits_total': ('counter', 'Cached tree lookups.', cache['hits']),
+        'repertoire_cache_misses_total': ('counter', 'Trees loaded from the database.', cache['misses']),
+        'repertoire_cache_evictions_total': ('counter', 'Trees evicted from the cache.', cache['evictions']),
+        'repertoire_cache_users': ('gauge', 'Users with a cached tree.', cache['users']),
+        'repertoire_cache_nodes': ('gauge', 'Moves in cached trees.', cache['nodes']),
+    }
+    return Response(app_metrics.render(extra),
+                    mimetype='text/plain; version=0.0.4')
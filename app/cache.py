@@ -0,0 +1,261 @@
+"""
+In-process caches, shared by all requests a worker serves.
+
+Each worker process keeps its own copy: writes update the cache of the
+worker handling them, other workers only catch up when their copy
+expires. Enable them on single worker deployments, or set a TTL to
+bound how stale another worker's copy can get.
+"""
+from collections import OrderedDict
+from threading import RLock
+from time import monotonic
+
+
+class Generations:
+    """
+    Counts the writes to each key, so that a value loaded outside of a
+    cache's lock is only stored when no write happened while loading.
+    Not thread safe on its own, used under the cache's lock.
+    """
+
+    def __init__(self):
+        self._epoch = 0
+        self._counts = {}
+
+    def snapshot(self, key):
+        return self._epoch, self._counts.get(key, 0)
+
+    def bump(self, key):
+        self._counts[key] = self._counts.get(key, 0) + 1
+
+    def clear(self):
+        self._epoch += 1
+        self._counts.clear()
+
+
+class RepertoireCache:
+    """
+    Repertoire trees of recently active users, bounded by their total
+    number of moves. The least recently used trees are evicted first.
+    Move writes go through to the cached trees, see Move.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.max_nodes = 0
+        self.ttl = None
+        self._trees = OrderedDict()
+        self._size = 0
+        self._lock = RLock()
+        self._generations = Generations()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('REPERTOIRE_CACHE_ENABLED', False)
+        self.max_nodes = app.config.get('REPERTOIRE_CACHE_MAX_NODES', 200000)
+        self.ttl = app.config.get('REPERTOIRE_CACHE_TTL', None)
+        self.clear()
+
+    def get(self, user_id, loader):
+        """returns the user's tree, calling loader(user_id) on a miss"""
+        with self._lock:
+            entry = self._trees.get(user_id)
+            if entry is not None and not self._expired(entry):
+                self._trees.move_to_end(user_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self._generations.snapshot(user_id)
+        # load outside of the lock, so other users aren't kept waiting
+        tree = loader(user_id)
+        with self._lock:
+            # a write while loading, the tree may predate it
+            if self._generations.snapshot(user_id) != generation:
+                return tree
+            self._discard(user_id)
+            if len(tree) <= self.max_nodes:
+                self._trees[user_id] = (tree, monotonic())
+                self._size += len(tree)
+                self._evict()
+        return tree
+
+    def update(self, user_id, change):
+        """
+        applies change(tree) to the user's cached tree, if there is one.
+        a tree that can't be changed is dropped, to be loaded again,
+        whatever the error
+        """
+        with self._lock:
+            self._generations.bump(user_id)
+            entry = self._trees.get(user_id)
+            if entry is None:
+                return
+            size = len(entry[0])
+            try:
+                change(entry[0])
+            except Exception:
+                self._discard(user_id)
+                return
+            self._size += len(entry[0]) - size
+            self._evict()
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._generations.bump(user_id)
+            self._discard(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._generations.clear()
+            self._trees.clear()
+            self._size = 0
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'users': len(self._trees),
+            'nodes': self._size,
+            'max_nodes': self.max_nodes,
+        }
+
+    def _expired(self, entry):
+        return self.ttl is not None and monotonic() - entry[1] > self.ttl
+
+    def _discard(self, user_id):
+        entry = self._trees.pop(user_id, None)
+        if entry is not None:
+            self._size -= len(entry[0])
+
+    def _evict(self):
+        while self._size > self.max_nodes and self._trees:
+            _, (tree, _) = self._trees.popitem(last=False)
+            self._size -= len(tree)
+            self.evictions += 1
+
+
+class IdentityCache:
+    """
+    Identities of recently authenticated users, resolved from the
+    identity in their JWT, so that a request doesn't need to load its
+    user. Entries expire after a TTL, the least recently used are
+    evicted first. User.deactivate invalidates the user's entry.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.max_users = 0
+        self.ttl = 0
+        self._identities = OrderedDict()
+        self._lock = RLock()
+        self._generations = Generations()
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('IDENTITY_CACHE_ENABLED', False)
+        self.max_users = app.config.get('IDENTITY_CACHE_MAX_USERS', 10000)
+        self.ttl = app.config.get('IDENTITY_CACHE_TTL', 60)
+        self.clear()
+
+    def get(self, identity, loader):
+        """returns the cached identity, calling loader(identity) on a miss"""
+        with self._lock:
+            entry = self._identities.get(identity)
+            if entry is not None and monotonic() - entry[1] <= self.ttl:
+                self._identities.move_to_end(identity)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self._generations.snapshot(identity)
+        value = loader(identity)
+        # unknown users aren't cached, they may yet be created
+        if value is not None:
+            with self._lock:
+                # invalidated while loading, eg. deactivated
+                if self._generations.snapshot(identity) != generation:
+                    return value
+                self._identities[identity] = (value, monotonic())
+                self._identities.move_to_end(identity)
+                while len(self._identities) > self.max_users:
+                    self._identities.popitem(last=False)
+        return value
+
+    def invalidate(self, identity):
+        with self._lock:
+            self._generations.bump(identity)
+            self._identities.pop(identity, None)
+
+    def clear(self):
+        with self._lock:
+            self._generations.clear()
+            self._identities.clear()
+
+
+class ForecastCache:
+    """
+    Review forecasts of recently active users, keyed by their
+    arguments. Every write to a user's moves invalidates the user's
+    forecasts, see Move. The least recently used users are evicted first.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.max_users = 0
+        self.ttl = None
+        self._forecasts = OrderedDict()
+        self._lock = RLock()
+        self._generations = Generations()
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('FORECAST_CACHE_ENABLED', False)
+        self.max_users = app.config.get('FORECAST_CACHE_MAX_USERS', 10000)
+        self.ttl = app.config.get('FORECAST_CACHE_TTL', None)
+        self.clear()
+
+    def get(self, user_id, key, loader):
+        """
+        returns the user's forecast for key, calling loader() on a miss
+        """
+        with self._lock:
+            forecasts = self._forecasts.get(user_id)
+            entry = forecasts.get(key) if forecasts else None
+            if entry is not None and (
+                    self.ttl is None or monotonic() - entry[1] <= self.ttl):
+                self._forecasts.move_to_end(user_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self._generations.snapshot(user_id)
+        value = loader()
+        with self._lock:
+            # the moves changed while loading, the value may predate it
+            if self._generations.snapshot(user_id) != generation:
+                return value
+            self._forecasts.setdefault(user_id, {})[key] = (value, monotonic())
+            self._forecasts.move_to_end(user_id)
+            while len(self._forecasts) > self.max_users:
+                self._forecasts.popitem(last=False)
+        return value
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._generations.bump(user_id)
+            self._forecasts.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._generations.clear()
+            self._forecasts.clear()
@@ -0,0 +1,144 @@
+"""
+Read only index of the moves played from each position in masters games.
+
+The index is a file of fixed width records sorted by position key and
+move, see RECORD. It is memory mapped: opening it reads nothing, lookups
+binary search the records and only touch the pages they need, and the
+pages are shared by every worker reading the same file. Build it with
+`flask build-masters-index`.
+"""
+import mmap
+import os
+import struct
+from threading import Lock
+
+import chess
+
+from .utils.zobrist import position_key
+
+# position key, encoded move, padding, white wins, draws, black wins
+RECORD = struct.Struct('<QH2xIII')
+# a counter saturates instead of overflowing
+MAX_COUNT = 2 ** 32 - 1
+
+
+def encode_move(move):
+    """packs a chess.Move into 15 bits: from and to squares, promotion"""
+    return move.from_square | move.to_square << 6 | (move.promotion or 0) << 12
+
+
+def decode_move(code):
+    return chess.Move(code & 63, code >> 6 & 63, (code >> 12) or None)
+
+
+def write_index(path, records):
+    """
+    writes records of (key, move, white, draws, black) to path, which
+    must already be sorted by key and move. the file is replaced once
+    it is complete, so readers never see a partial index
+    """
+    temporary = path + '.tmp'
+    count = 0
+    with open(temporary, 'wb') as f:
+        for record in records:
+            f.write(RECORD.pack(*record))
+            count += 1
+    os.replace(temporary, path)
+    return count
+
+
+class MastersIndex:
+    """The masters index at MASTERS_INDEX_PATH, opened on first use"""
+
+    def __init__(self, app=None):
+        self.path = None
+        self._map = None
+        self._size = 0
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.close()
+        self.path = app.config.get('MASTERS_INDEX_PATH', None)
+
+    @property
+    def available(self):
+        return bool(self.path) and os.path.exists(self.path)
+
+    def __len__(self):
+        self._open()
+        return self._size
+
+    def _open(self):
+        if self._map is not None:
+            return
+        with self._lock:
+            if self._map is not None:
+                return
+            if not self.available:
+                raise Exception("Masters index not available")
+            with open(self.path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size < RECORD.size:
+                    self._size = 0
+                    self._map = b''
+                    return
+                # the mapping stays valid once the file is closed
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._size = len(self._map) // RECORD.size
+
+    def close(self):
+        with self._lock:
+            if isinstance(self._map, mmap.mmap):
+                self._map.close()
+            self._map = None
+            self._size = 0
+
+    def _key(self, i):
+        return RECORD.unpack_from(self._map, i * RECORD.size)[0]
+
+    def lookup(self, key):
+        """returns (move, white, draws, black) for each move from position key"""
+        self._open()
+        low, high = 0, self._size
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        moves = []
+        while low < self._size:
+            record_key, move, white, draws, black = \
+                RECORD.unpack_from(self._map, low * RECORD.size)
+            if record_key != key:
+                break
+            moves.append((decode_move(move), white, draws, black))
+            low += 1
+        return moves
+
+    def continuations(self, fen):
+        """
+        returns the moves played from fen in masters games, most played
+        first, as dicts with keys uci, san, fen, white, draws, black and total
+        """
+        board = chess.Board(fen)
+        results = []
+        for move, white, draws, black in self.lookup(position_key(fen)):
+            # a key collision could give moves which are illegal here
+            if not board.is_legal(move):
+                continue
+            san = board.san(move)
+            board.push(move)
+            results.append({
+                'uci': move.uci(),
+                'san': san,
+                'fen': board.fen(),
+                'white': white,
+                'draws': draws,
+                'black': black,
+                'total': white + draws + black,
+            })
+            board.pop()
+        results.sort(key=lambda m: -m['total'])
+        return results
@@ -0,0 +1,166 @@
+"""
+Request latency and SQL query metrics, in Prometheus text format.
+
+Request hooks time every request, cursor events count and time the
+queries it runs. Queries slower than SLOW_DB_QUERY_TIME are logged with
+their statement and endpoint. Like the caches, metrics are kept per
+worker process: scrape each worker, or run a single worker.
+"""
+import logging
+from bisect import bisect_left
+from threading import Lock
+from time import perf_counter
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# upper bounds of the histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+
+class Histogram:
+    """Counts of observations per bucket, along with their sum"""
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_sum{{{labels}}} {self.sum}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+
+class Metrics:
+    """Collects the metrics of an app and renders them for Prometheus"""
+
+    def __init__(self, app=None, db=None):
+        self.enabled = False
+        self.slow_query_time = None
+        self._lock = Lock()
+        self.reset()
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        self.enabled = app.config.get('METRICS_ENABLED', True)
+        self.slow_query_time = app.config.get('SLOW_DB_QUERY_TIME', None)
+        if not self.enabled:
+            return
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        binds = [None] + list(app.config.get('SQLALCHEMY_BINDS') or {})
+        for bind in binds:
+            engine = db.get_engine(app, bind)
+            event.listen(engine, 'before_cursor_execute', self._before_execute)
+            event.listen(engine, 'after_cursor_execute', self._after_execute)
+
+    def reset(self):
+        with self._lock:
+            # keyed by (endpoint, method, status)
+            self.requests = {}
+            # keyed by endpoint
+            self.latency = {}
+            self.queries = {}
+            self.query_seconds = {}
+            self.slow_queries = {}
+
+    def _before_request(self):
+        g.metrics_start = perf_counter()
+        g.metrics_queries = 0
+        g.metrics_query_seconds = 0.0
+
+    def _after_request(self, response):
+        start = g.get('metrics_start')
+        if start is None:
+            return response
+        seconds = perf_counter() - start
+        endpoint = request.endpoint or 'none'
+        key = (endpoint, request.method, str(response.status_code))
+        with self._lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+            if endpoint not in self.latency:
+                self.latency[endpoint] = Histogram(LATENCY_BUCKETS)
+                self.queries[endpoint] = Histogram(QUERY_COUNT_BUCKETS)
+                self.query_seconds[endpoint] = 0.0
+            self.latency[endpoint].observe(seconds)
+            self.queries[endpoint].observe(g.metrics_queries)
+            self.query_seconds[endpoint] += g.metrics_query_seconds
+        return response
+
+    def _before_execute(self, conn, cursor, statement, parameters, context,
+                        executemany):
+        conn.info.setdefault('metrics_start', []).append(perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context,
+                       executemany):
+        seconds = perf_counter() - conn.info['metrics_start'].pop()
+        endpoint = None
+        if has_request_context() and 'metrics_start' in g:
+            g.metrics_queries += 1
+            g.metrics_query_seconds += seconds
+            endpoint = request.endpoint
+        if self.slow_query_time is not None and seconds >= self.slow_query_time:
+            logger.warning('slow query on %s: %.3fs\n%s',
+                           endpoint, seconds, statement)
+            with self._lock:
+                self.slow_queries[endpoint or 'none'] = \
+                    self.slow_queries.get(endpoint or 'none', 0) + 1
+
+    def render(self, extra=None):
+        """
+        returns the metrics in Prometheus text format
+
+        params:
+            extra: optional dict of name to (type, help, value) of other
+                metrics to include
+        """
+        lines = []
+
+        def header(name, kind, description):
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        with self._lock:
+            header('http_requests_total', 'counter', 'Requests handled.')
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{{endpoint="{endpoint}",'
+                             f'method="{method}",status="{status}"}} {count}')
+            header('http_request_duration_seconds', 'histogram',
+                   'Time taken to handle requests.')
+            for endpoint, histogram in sorted(self.latency.items()):
+                lines.extend(histogram.lines('http_request_duration_seconds',
+                                             f'endpoint="{endpoint}"'))
+            header('db_queries_per_request', 'histogram',
+                   'SQL queries run per request.')
+            for endpoint, histogram in sorted(self.queries.items()):
+                lines.extend(histogram.lines('db_queries_per_request',
+                                             f'endpoint="{endpoint}"'))
+            header('db_query_seconds_total', 'counter',
+                   'Time spent running SQL queries.')
+            for endpoint, seconds in sorted(self.query_seconds.items()):
+                lines.append(f'db_query_seconds_total{{endpoint="{endpoint}"}} '
+                             f'{seconds}')
+            header('db_slow_queries_total', 'counter',
+                   'SQL queries slower than SLOW_DB_QUERY_TIME.')
+            for endpoint, count in sorted(self.slow_queries.items()):
+                lines.append(f'db_slow_queries_total{{endpoint="{endpoint}"}} '
+                             f'{count}')
+        for name, (kind, description, value) in (extra or {}).items():
+            header(name, kind, description)
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
@@ -1,15 +1,72 @@
-from datetime import datetime
+import logging
+import struct
+from datetime import date, datetime, time, timedelta
+from functools import partial
 from random import choice
-from supermemo2 import SMTwo
-from . import db, guard
-from .utils.sort_funcs import average_descendent_easiness, sort_by_date
+import numpy as np
+from flask import current_app
+from sqlalchemy.ext.hybrid import hybrid_property
+from . import db, forecast_cache, guard, identity_cache, repertoire_cache, sqlite_performance
+from .utils.sort_funcs import average_descendent_easiness
+from .utils.sm_two import sm_two_arrays, next_reviews
+from .utils.chunks import chunked
+from .utils.tree import RepertoireTree
+from .utils.zobrist import position_key, signed
 from .utils.constants import (
+    BULK_CHUNK_SIZE,
+    EXPLORE_MAX_NODES,
+    MAX_INTERVAL,
     NO_MOVES_ERROR,
+    PLAY_LINE_MAX_NODES,
     STARTING_POSITION_FEN,
     FIRST_MOVE,
-    COLOR_CHOICES
+    COLOR_CHOICES,
+    STUDY_CANDIDATES,
+    STUDY_DECK_SIZE,
+    STUDY_QUEUE_MAX_SKIPS,
+    FORECAST_DAYS
 )
 
+logger = logging.getLogger(__name__)
+
+
+def max_interval():
+    """the longest interval in days between two reviews of a move"""
+    return current_app.config.get('SM_TWO_MAX_INTERVAL', MAX_INTERVAL)
+
+
+class MoveNotFoundError(Exception):
+    """a move which doesn't exist, or belongs to another user"""
+
+
+def _segment(number):
+    """sql for a number zero padded to six digits, used in sort keys"""
+    return f"substr(CAST(1000000 + {number} AS TEXT), 2)"
+
+
+class UserIdentity:
+    """
+    The parts of a user needed to authenticate a request, as kept by
+    the identity cache. Views only read the id of the current user.
+    """
+    __slots__ = ('id', 'roles', 'is_active')
+
+    def __init__(self, id, roles, is_active):
+        self.id = id
+        self.roles = roles
+        self.is_active = is_active
+
+    @property
+    def rolenames(self):
+        return self.roles.split(',') if self.roles else []
+
+    @property
+    def identity(self):
+        return self.id
+
+    def is_valid(self):
+        return self.is_active
+
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -18,6 +75,9 @@ class User(db.Model):
     hashed_password = db.Column(db.Text)
     roles = db.Column(db.Text) # need this for flask_praetorian
     is_active = db.Column(db.Boolean, default=True, server_default='true')
+    # bumped whenever moves are added or deleted, see /explore's etags
+    repertoire_version = db.Column(db.Integer, nullable=False, default=0,
+                                   server_default='0')
     moves = db.relationship('Move', backref='user')
 
     @property
@@ -41,8 +101,43 @@ class User(db.Model):
 
     @classmethod
     def identify(cls, id):
+        """
+        returns the user with identity id, as a UserIdentity from the
+        identity cache when it is enabled
+        """
+        if identity_cache.enabled:
+            return identity_cache.get(id, cls._load_identity)
         return cls.query.get(id)
 
+    @classmethod
+    def _load_identity(cls, id):
+        row = db.session.query(cls.id, cls.roles, cls.is_active) \
+                    .filter_by(id=id) \
+                    .first()
+        return UserIdentity(*row) if row else None
+
+    @classmethod
+    def get_repertoire_version(cls, id):
+        return db.session.query(cls.repertoire_version) \
+                    .filter_by(id=id) \
+                    .scalar()
+
+    @classmethod
+    def bump_repertoire_version(cls, id):
+        """
+        marks the user's moves as changed, in the current transaction
+        """
+        cls.query \
+            .filter_by(id=id) \
+            .update({cls.repertoire_version: cls.repertoire_version + 1},
+                    synchronize_session=False)
+
+    def deactivate(self):
+        """stops the user from logging in or refreshing a token"""
+        self.is_active = False
+        db.session.commit()
+        identity_cache.invalidate(self.id)
+
     @property
     def identity(self):
         return self.id
@@ -53,14 +148,29 @@ class User(db.Model):
 
 class Move(db.Model):
     __tablename__ = 'moves'
+    __table_args__ = (
+        # study candidate selection, with and without a color filter
+        db.Index('ix_moves_user_id_book_move_next_review',
+                 'user_id', 'book_move', 'next_review'),
+        db.Index('ix_moves_user_id_book_move_side_to_move_next_review',
+                 'user_id', 'book_move', 'side_to_move', 'next_review'),
+        # first moves of a user's book
+        db.Index('ix_moves_user_id_perspective_parent_id',
+                 'user_id', 'perspective', 'parent_id'),
+        # finding positions, whatever move order reached them
+        db.Index('ix_moves_user_id_position_key', 'user_id', 'position_key'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey(User.id))
-    parent_id = db.Column(db.Integer, db.ForeignKey('moves.id'))
+    parent_id = db.Column(db.Integer, db.ForeignKey('moves.id'), index=True)
     fen = db.Column(db.String(128))
     children = db.relationship('Move',
                     backref=db.backref('parent', remote_side=[id]))
     san = db.Column(db.String(8))
     perspective = db.Column(db.String(1)) # w or b
+    side_to_move = db.Column(db.String(1)) # w or b, taken from the fen
+    # zobrist hash of the position after the move, see utils.zobrist
+    position_key = db.Column(db.BigInteger)
     # is this a move i'm trying to memorize, or a possible opponent response?
     book_move = db.Column(db.Boolean)
 
@@ -73,6 +183,37 @@ class Move(db.Model):
     easiness = db.Column(db.Float, nullable=True)
     interval = db.Column(db.Integer, nullable=True)
 
+    # aggregates over this move's children, kept up to date on every write
+    # so that ordering by easiness doesn't have to load the children
+    child_count = db.Column(db.Integer, nullable=False,
+                            default=0, server_default='0')
+    child_easiness_sum = db.Column(db.Float, nullable=False,
+                                   default=0.0, server_default='0')
+    rated_child_count = db.Column(db.Integer, nullable=False,
+                                  default=0, server_default='0')
+
+    @hybrid_property
+    def descendent_easiness(self):
+        return average_descendent_easiness(self)
+
+    @descendent_easiness.expression
+    def descendent_easiness(cls):
+        return db.case(
+            [(cls.child_count == 0, 10.0)],
+            else_=cls.child_easiness_sum / cls.child_count
+        )
+
+    @classmethod
+    def _update_child_aggregates(cls, move_id, children=0, easiness=0.0, rated=0):
+        """adds the given deltas to the child aggregates of a move"""
+        if move_id is None:
+            return
+        cls.query.filter_by(id=move_id).update({
+            cls.child_count: cls.child_count + children,
+            cls.child_easiness_sum: cls.child_easiness_sum + easiness,
+            cls.rated_child_count: cls.rated_child_count + rated,
+        }, synchronize_session=False)
+
     # supermemo two methods
     @property
     def sm2(self):
@@ -84,44 +225,171 @@ class Move(db.Model):
         """
 
     @classmethod
-    def add_study_session(cls, move_id, quality):
-        """update SMTwo stats for a move"""
-        move = cls.query.filter_by(id=move_id).first()
-        move._add_study_session(quality)
-
-    def _add_study_session(self, quality):
+    @sqlite_performance.write_transaction
+    def add_study_sessions(cls, user_id, scores):
         """
-        internal function to updates database values related to supermemo two
+        update SMTwo stats for many moves in a single transaction
+
+        loads all moves with one query, checks that they belong to the user
+        and writes the new values back with one bulk update and one commit.
+        raises MoveNotFoundError for a move of another user, ValueError
+        for a score out of range
 
         params:
-            quality: int between 0 and 5 (inclusive)
+            user_id: id of the user submitting the scores
+            scores: list of (move_id, quality) pairs, quality being an
+                int between 0 and 5 (inclusive)
         """
-        print(f'adding study session for {self.id} - {self.san}')
-        print(f'adding score {quality}')
-        if self.easiness == None:
-            sm_two = SMTwo(quality=quality, first_visit=True)
-        else:
-            sm_two = SMTwo(
-                quality=quality,
-                interval=self.interval,
-                repetitions=self.repetitions,
-                easiness=self.easiness,
-                #last review defaults to now
+        if not all(0 <= quality <= 5 for _, quality in scores):
+            raise ValueError("score must be between 0 and 5")
+        move_ids = {move_id for move_id, _ in scores}
+        if not move_ids:
+            return
+        rows = db.session.query(
+                        cls.id,
+                        cls.user_id,
+                        cls.parent_id,
+                        cls.interval,
+                        cls.repetitions,
+                        cls.easiness
+                    ) \
+                    .filter(cls.id.in_(move_ids)) \
+                    .all()
+        if len(rows) != len(move_ids):
+            raise MoveNotFoundError("Move not found")
+        if any(row.user_id != user_id for row in rows):
+            raise MoveNotFoundError("User id doesnt match move\'s user id")
+
+        moves = {row.id: dict(row._asdict()) for row in rows}
+        old_easiness = {row.id: row.easiness for row in rows}
+        # scores are applied in order, so a move scored twice is updated
+        # twice: every round of the kernel scores each move at most once
+        rounds = []
+        for move_id, quality in scores:
+            for round in rounds:
+                if move_id not in round:
+                    round[move_id] = quality
+                    break
+            else:
+                rounds.append({move_id: quality})
+        now = datetime.now()
+        cap = max_interval()
+        for round in rounds:
+            batch = [moves[move_id] for move_id in round]
+            interval, repetitions, easiness = sm_two_arrays(
+                list(round.values()),
+                [m['interval'] or 0 for m in batch],
+                [m['repetitions'] or 1 for m in batch],
+                [float('nan') if m['easiness'] is None else m['easiness']
+                    for m in batch],
+                cap
             )
-        sm_two.new_sm_two()
-        # seems like a hack, but have to avoid interval getting too large
-        if sm_two.new_interval > 365:
-            self.interval = 365
-        else:
-            self.interval = sm_two.new_interval
-        self.easiness = sm_two.new_easiness
-        self.repetitions = sm_two.new_repetitions
-        self.next_review = datetime.strptime(sm_two.next_review, '%Y-%m-%d')
-        self.last_review = datetime.now()
+            next_review = next_reviews(date.today(), interval, cap)
+            for i, move in enumerate(batch):
+                move.update(
+                    interval=int(interval[i]),
+                    repetitions=int(repetitions[i]),
+                    easiness=float(easiness[i]),
+                    next_review=next_review[i],
+                    last_review=now
+                )
+        db.session.bulk_update_mappings(cls, [
+            {key: value for key, value in move.items()
+                if key not in ('user_id', 'parent_id')}
+            for move in moves.values()
+        ])
 
-        db.session.add(self)
+        # gather the changes to each parent's child aggregates
+        parents = {}
+        for move in moves.values():
+            if move['parent_id'] is None:
+                continue
+            old = old_easiness[move['id']]
+            delta = parents.setdefault(move['parent_id'], [0.0, 0])
+            delta[0] += move['easiness'] - (old or 0.0)
+            delta[1] += int(old is None)
+        if parents:
+            table = cls.__table__
+            db.session.execute(
+                table.update()
+                    .where(table.c.id == db.bindparam('b_parent'))
+                    .values(
+                        child_easiness_sum=table.c.child_easiness_sum
+                            + db.bindparam('b_easiness'),
+                        rated_child_count=table.c.rated_child_count
+                            + db.bindparam('b_rated')
+                    ),
+                [
+                    {'b_parent': parent, 'b_easiness': easiness, 'b_rated': rated}
+                    for parent, (easiness, rated) in parents.items()
+                ]
+            )
         db.session.commit()
 
+        def update_tree(tree):
+            for move in moves.values():
+                tree.update(
+                    move['id'],
+                    easiness=move['easiness'],
+                    next_review=move['next_review']
+                )
+        forecast_cache.invalidate(user_id)
+        repertoire_cache.update(user_id, update_tree)
+
+    @classmethod
+    @sqlite_performance.write_transaction
+    def reschedule(cls, user_id=None, chunk_size=10000):
+        """
+        recomputes interval and next review of every studied move from
+        their last review, like scores do, eg. after lowering the interval
+        cap SM_TWO_MAX_INTERVAL. a move already scheduled with the current
+        cap keeps its values. a raised cap only lengthens intervals as
+        moves are scored again, the intervals before it aren't stored.
+        works through the moves in chunks of chunk_size, committing each
+        chunk
+
+        params:
+            user_id: only reschedule this user's moves, defaults to everyone
+
+        returns the number of moves rescheduled
+        """
+        cap = max_interval()
+        count = 0
+        last_id = 0
+        queues = StudyQueue.query
+        if user_id is not None:
+            queues = queues.filter_by(user_id=user_id)
+        queues.update({StudyQueue.stale: True}, synchronize_session=False)
+        while True:
+            query = db.session.query(cls.id, cls.last_review, cls.interval) \
+                        .filter(cls.id > last_id) \
+                        .filter(cls.last_review != None)
+            if user_id is not None:
+                query = query.filter_by(user_id=user_id)
+            rows = query.order_by(cls.id).limit(chunk_size).all()
+            if not rows:
+                return count
+            interval = np.minimum([row.interval for row in rows], cap)
+            next_review = next_reviews(
+                [row.last_review.date() for row in rows], interval, cap)
+            db.session.bulk_update_mappings(cls, [
+                {
+                    'id': row.id,
+                    'interval': int(interval[i]),
+                    'next_review': next_review[i]
+                }
+                for i, row in enumerate(rows)
+            ])
+            db.session.commit()
+            count += len(rows)
+            last_id = rows[-1].id
+            if user_id is None:
+                repertoire_cache.clear()
+                forecast_cache.clear()
+            else:
+                repertoire_cache.invalidate(user_id)
+                forecast_cache.invalidate(user_id)
+
 
     # util methods
     def to_json(self):
@@ -133,6 +401,165 @@ class Move(db.Model):
         }
 
 
+    # export methods
+    @classmethod
+    def export_moves(cls, user_id, move_id=None, perspective=None):
+        """
+        returns all moves of a subtree, or of the user's whole book for
+        perspective, fetched with a single recursive query
+
+        rows come in the order PGN prints them: a move, then the
+        alternatives to it (each followed by its own continuation), then
+        the continuation of the move. so parents always precede children
+        and nothing has to be held in memory to write the tree out.
+
+        each row has the move columns along with rank, the position of
+        the move among its siblings (1 being the main line, and the move
+        a subtree starts from), and key, the sort key of the row
+        """
+        if move_id is not None:
+            anchor = 'id = :move_id'
+            start = 'user_id = :user_id AND id = :move_id'
+        else:
+            anchor = 'parent_id IS NULL'
+            start = 'user_id = :user_id AND perspective = :perspective ' \
+                'AND parent_id IS NULL'
+        # siblings are ranked among the moves of the subtree only, so the
+        # cost follows the size of the subtree and not of the book. every
+        # node then gets a key to sort on, and a prefix under which the
+        # continuation of its main line is sorted. keys are made of fixed
+        # width segments: the main line move sorts first, its alternatives
+        # next (each with its continuation) and the main line continues last
+        query = db.text(f"""
+            WITH RECURSIVE subtree(id) AS (
+                SELECT id FROM moves WHERE {start}
+                UNION ALL
+                SELECT moves.id
+                FROM moves
+                JOIN subtree ON moves.parent_id = subtree.id
+            ), ranked AS (
+                SELECT *,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY parent_id ORDER BY id
+                    ) AS rank
+                FROM moves
+                WHERE id IN (SELECT id FROM subtree)
+            ), tree AS (
+                SELECT ranked.*,
+                    CASE WHEN rank = 1
+                        THEN '000000'
+                        ELSE {_segment('rank - 1')} || '000000'
+                    END AS key,
+                    CASE WHEN rank = 1
+                        THEN '999999'
+                        ELSE {_segment('rank - 1')} || '000001'
+                    END AS line
+                FROM ranked
+                WHERE {anchor}
+                UNION ALL
+                SELECT child.*,
+                    CASE WHEN child.rank = 1
+                        THEN tree.line || '000000'
+                        ELSE tree.line || {_segment('child.rank - 1')}
+                            || '000000'
+                    END,
+                    CASE WHEN child.rank = 1
+                        THEN tree.line || '999999'
+                        ELSE tree.line || {_segment('child.rank - 1')}
+                            || '000001'
+                    END
+                FROM ranked AS child
+                JOIN tree ON child.parent_id = tree.id
+            )
+            SELECT id, parent_id, fen, san, perspective, book_move,
+                last_review, next_review, repetitions, easiness, "interval",
+                rank, key
+            FROM tree
+            ORDER BY key
+        """).columns(
+            book_move=db.Boolean,
+            last_review=db.DateTime,
+            next_review=db.DateTime,
+        )
+        return db.session.execute(query, {
+            'user_id': user_id,
+            'move_id': move_id,
+            'perspective': perspective and perspective[0],
+        })
+
+
+    # position methods
+    @classmethod
+    def get_lines(cls, move_ids):
+        """
+        returns a dict mapping each move id to the list of sans leading
+        from the start of the book up to and including that move
+        """
+        if not move_ids:
+            return {}
+        query = db.text("""
+            WITH RECURSIVE line AS (
+                SELECT id AS start, parent_id, san, 0 AS depth
+                FROM moves
+                WHERE id IN :move_ids
+                UNION ALL
+                SELECT line.start, moves.parent_id, moves.san, line.depth + 1
+                FROM moves
+                JOIN line ON moves.id = line.parent_id
+            )
+            SELECT start, san FROM line ORDER BY start, depth DESC
+        """).bindparams(db.bindparam('move_ids', expanding=True))
+        lines = {}
+        for row in db.session.execute(query, {'move_ids': list(move_ids)}):
+            lines.setdefault(row.start, []).append(row.san)
+        return lines
+
+    @classmethod
+    def _with_lines(cls, moves):
+        """serializes moves along with the line leading to each of them"""
+        lines = cls.get_lines([m.id for m in moves])
+        return [
+            dict(m.to_json(), perspective=m.perspective, line=lines[m.id])
+            for m in moves
+        ]
+
+    @classmethod
+    def find_position(cls, user_id, fen):
+        """
+        returns every move of the user's book leading to the position of
+        fen, whatever the move order, along with the line of each move
+        """
+        moves = cls.query \
+                    .filter_by(user_id=user_id) \
+                    .filter_by(position_key=signed(position_key(fen))) \
+                    .order_by(cls.id) \
+                    .all()
+        if not moves:
+            return NO_MOVES_ERROR
+        return cls._with_lines(moves)
+
+    @classmethod
+    def get_transpositions(cls, user_id, move_id):
+        """
+        returns the other moves of the user's book which reach the same
+        position as move_id, along with the line of each move
+        """
+        move = cls.query.filter_by(id=move_id).first()
+        if not move:
+            raise Exception("Move not found")
+        if not move.user_id == user_id:
+            raise Exception("User id doesnt match move\'s user id")
+        moves = cls.query \
+                    .filter_by(user_id=user_id) \
+                    .filter_by(position_key=move.position_key) \
+                    .filter(cls.id != move.id) \
+                    .order_by(cls.id) \
+                    .all()
+        if not moves:
+            return NO_MOVES_ERROR
+        return cls._with_lines(moves)
+
+
     # explore methods
     @classmethod
     def get_descendent_moves(cls, move_id):
@@ -145,7 +572,6 @@ class Move(db.Model):
 
     @classmethod
     def get_book_start(cls, user_id, color):
-        print(f'getting start of book for color {color} by searching for {color[0]}')
         moves = cls.query \
                     .filter_by(user_id=user_id) \
                     .filter_by(perspective=color[0]) \
@@ -155,25 +581,114 @@ class Move(db.Model):
             return NO_MOVES_ERROR
         return [m.to_json() for m in moves]
 
+    @classmethod
+    def get_subtree(cls, user_id, move_id=None, color=None, depth=1,
+                    max_nodes=EXPLORE_MAX_NODES):
+        """
+        returns the moves following move_id, or the start of the user's
+        book for color, down to depth plies as a list of nested dicts
+
+        fetches one ply per query. every move has a child_count, and a
+        children list when its children were fetched: plies are only
+        added whole, stopping before max_nodes would be exceeded, so a
+        client can cache any move with children as complete
+        """
+        columns = (cls.id, cls.parent_id, cls.fen, cls.san, cls.child_count)
+        query = db.session.query(*columns).filter_by(user_id=user_id)
+        if move_id:
+            queries = [query.filter_by(parent_id=move_id)]
+        else:
+            queries = [query.filter_by(perspective=color[0])
+                            .filter_by(parent_id=None)]
+
+        roots = []
+        nodes = {}
+        for ply in range(depth):
+            rows = []
+            for q in queries:
+                q = q.order_by(cls.id)
+                if ply:
+                    # one row more than fits tells the ply is too big
+                    q = q.limit(max_nodes - len(nodes) - len(rows) + 1)
+                rows.extend(q)
+                if ply and len(nodes) + len(rows) > max_nodes:
+                    break
+            if ply and len(nodes) + len(rows) > max_nodes:
+                break
+            for row in rows:
+                node = {
+                    'id': row.id,
+                    'fen': row.fen,
+                    'san': row.san,
+                    'child_count': row.child_count,
+                }
+                # a move without children is complete as it is
+                if not row.child_count:
+                    node['children'] = []
+                nodes[row.id] = node
+                if ply:
+                    nodes[row.parent_id].setdefault('children', []).append(node)
+                else:
+                    roots.append(node)
+            parents = [row.id for row in rows if row.child_count]
+            queries = [
+                query.filter(cls.parent_id.in_(chunk))
+                for chunk in chunked(parents, BULK_CHUNK_SIZE)
+            ]
+            if not queries:
+                break
+        if not roots:
+            return NO_MOVES_ERROR
+        return roots
+
 
     # play methods
     @classmethod
-    def get_next_moves(cls, move_id, score):
+    def load_tree(cls, user_id):
+        """returns all of the user's moves as a RepertoireTree"""
+        return RepertoireTree(
+            db.session.query(
+                    cls.id,
+                    cls.parent_id,
+                    cls.fen,
+                    cls.san,
+                    cls.perspective,
+                    cls.book_move,
+                    cls.side_to_move,
+                    cls.easiness,
+                    cls.next_review
+                ) \
+                .filter_by(user_id=user_id) \
+                .order_by(cls.id)
+        )
+
+    @classmethod
+    def get_next_moves(cls, move_id, score, user_id=None):
         """updates last move score and
         returns a dict with keys move and next
+
+        with user_id, the user's cached tree is used when the
+        repertoire cache is enabled. a score is recorded like
+        add_study_sessions, the move must belong to user_id
         """
-        last_move = cls.query.filter_by(id=move_id).first()
-        if score:
-            last_move._add_study_session(score)
-        possible_moves = last_move.children
-        print(f'possible moves are {possible_moves}')
-        possible_moves.sort(key=average_descendent_easiness)
-        
-        if len(possible_moves):
-            move = possible_moves[0]
+        if score is not None:
+            cls.add_study_sessions(user_id, [(move_id, score)])
+        if repertoire_cache.enabled and user_id is not None:
+            tree = repertoire_cache.get(user_id, cls.load_tree)
+            if move_id not in tree or not tree.children(move_id):
+                return NO_MOVES_ERROR
+            # children are in id order, min keeps the first of equals
+            move = min(tree.children(move_id), key=tree.descendent_easiness)
+            next_moves = move.children
         else:
-            return NO_MOVES_ERROR
-        next_moves = move.children
+            # opponent plays the reply leading to the positions we know least
+            move = cls.query \
+                        .filter_by(parent_id=move_id) \
+                        .order_by(cls.descendent_easiness, cls.id) \
+                        .first()
+            if not move:
+                return NO_MOVES_ERROR
+            next_moves = cls.query.filter_by(parent_id=move.id).all()
         return {
             'move': move.to_json(),
             'next': [m.to_json() for m in next_moves]
@@ -182,13 +697,16 @@ class Move(db.Model):
     @classmethod
     def get_whites_first_book_moves(cls, user_id):
         """returns a dict with keys move and next"""
-        moves = cls.query \
-                .filter_by(user_id=user_id) \
-                .filter_by(parent_id=None) \
-                .filter_by(perspective='w') \
-                .all()
+        if repertoire_cache.enabled:
+            tree = repertoire_cache.get(user_id, cls.load_tree)
+            moves = tree.first_moves('w')
+        else:
+            moves = cls.query \
+                    .filter_by(user_id=user_id) \
+                    .filter_by(parent_id=None) \
+                    .filter_by(perspective='w') \
+                    .all()
         if not moves:
-            print(f'no moves: {moves}')
             return NO_MOVES_ERROR
         return {
             'move': FIRST_MOVE,
@@ -198,81 +716,568 @@ class Move(db.Model):
     @classmethod
     def get_blacks_first_book_move(cls, user_id):
         """returns dict with keys move and next"""
-        white_moves = cls.query \
-                    .filter_by(user_id=user_id) \
-                    .filter_by(parent_id=None) \
-                    .filter_by(perspective='b') \
-                    .all()
-        white_moves.sort(key=average_descendent_easiness, reverse=True)
-        if not white_moves:
-            return NO_MOVES_ERROR
+        if repertoire_cache.enabled:
+            tree = repertoire_cache.get(user_id, cls.load_tree)
+            white_moves = tree.first_moves('b')
+            if not white_moves:
+                return NO_MOVES_ERROR
+            # max keeps the first of equals, like the ordering by id below
+            white_move = max(white_moves, key=tree.descendent_easiness)
+            next_moves = white_move.children
+        else:
+            white_move = cls.query \
+                        .filter_by(user_id=user_id) \
+                        .filter_by(parent_id=None) \
+                        .filter_by(perspective='b') \
+                        .order_by(cls.descendent_easiness.desc(), cls.id) \
+                        .first()
+            if not white_move:
+                return NO_MOVES_ERROR
+            next_moves = cls.query.filter_by(parent_id=white_move.id).all()
         return {
-            'move': white_moves[0].to_json(),
-            'next': [m.to_json() for m in white_moves[0].children]
+            'move': white_move.to_json(),
+            'next': [m.to_json() for m in next_moves]
         }
     
 
+    @classmethod
+    def get_line(cls, user_id, move_id=None, color=None, score=None,
+                 max_nodes=PLAY_LINE_MAX_NODES):
+        """
+        plans play mode down to the end of the book in one go: for each
+        book move the user may play, the opponent's reply is chosen like
+        get_next_moves would, and so on
+
+        params:
+            move_id: the user's last move, or None to start with color
+            color: 'white' or 'black', where to start without move_id
+            score: optional score of move_id, recorded first like
+                add_study_sessions
+            max_nodes: largest number of moves to plan
+
+        returns a dict with keys move and next like get_next_moves, each
+        move of next having a key then: the same dict for the position
+        after it, or None at the end of the book. moves past max_nodes
+        have no key then, and the dict has truncated set
+        """
+        if score is not None and move_id:
+            cls.add_study_sessions(user_id, [(move_id, score)])
+        if repertoire_cache.enabled:
+            tree = repertoire_cache.get(user_id, cls.load_tree)
+            first_moves = tree.first_moves
+            easiness = tree.descendent_easiness
+
+            def children_of(move_ids):
+                return [tree.children(i) if i in tree else []
+                        for i in move_ids]
+        else:
+            # only the moves of the plan and the replies it chooses from
+            # are loaded, two queries per ply
+            first_moves = partial(cls._first_moves, user_id)
+            children_of = partial(cls._children_of, user_id)
+            easiness = average_descendent_easiness
+
+        # the first reply, chosen like get_next_moves and the first moves
+        if move_id is not None:
+            replies = children_of([move_id])[0]
+            if not replies:
+                return NO_MOVES_ERROR
+            reply = min(replies, key=easiness)
+        elif color == 'white':
+            reply = None
+        else:
+            white_moves = first_moves('b')
+            if not white_moves:
+                return NO_MOVES_ERROR
+            reply = max(white_moves, key=easiness)
+        options = children_of([reply.id])[0] if reply else first_moves('w')
+        if not options and reply is None:
+            return NO_MOVES_ERROR
+
+        def position(reply, options):
+            return {
+                'move': reply.to_json() if reply else FIRST_MOVE,
+                'next': [m.to_json() for m in options]
+            }
+
+        line = position(reply, options)
+        nodes = 1 + len(options)
+        # breadth first, a ply at a time, so a truncated line is cut at
+        # its deepest moves
+        level = [(line, options)]
+        while level:
+            entries = [(entry, option) for node, options in level
+                       for entry, option in zip(node['next'], options)]
+            chosen = []
+            for (entry, option), replies in zip(
+                    entries, children_of([option.id for _, option in entries])):
+                if not replies:
+                    entry['then'] = None
+                    continue
+                chosen.append((entry, min(replies, key=easiness)))
+            if chosen and nodes + 1 > max_nodes:
+                # not even a reply fits, its options needn't be loaded
+                line['truncated'] = True
+                break
+            level = []
+            for (entry, reply), options in zip(
+                    chosen, children_of([reply.id for _, reply in chosen])):
+                if nodes + 1 + len(options) > max_nodes:
+                    line['truncated'] = True
+                    continue
+                entry['then'] = position(reply, options)
+                nodes += 1 + len(options)
+                level.append((entry['then'], options))
+        return line
+
+    @classmethod
+    def _first_moves(cls, user_id, perspective):
+        return cls.query \
+                    .filter_by(user_id=user_id) \
+                    .filter_by(parent_id=None) \
+                    .filter_by(perspective=perspective) \
+                    .order_by(cls.id) \
+                    .all()
+
+    @classmethod
+    def _children_of(cls, user_id, move_ids):
+        """returns the children of each of move_ids, in id order"""
+        children = {move_id: [] for move_id in move_ids}
+        for chunk in chunked(list(children), BULK_CHUNK_SIZE):
+            for move in cls.query \
+                            .filter_by(user_id=user_id) \
+                            .filter(cls.parent_id.in_(chunk)) \
+                            .order_by(cls.id):
+                children[move.parent_id].append(move)
+        return [children[move_id] for move_id in move_ids]
+
     # study methods
+    @staticmethod
+    def _side_to_move(color):
+        """
+        returns the side to move after the book moves of color, 'w', 'b',
+        'white' or 'black', None for any other color
+        """
+        if color not in COLOR_CHOICES:
+            return None
+        # a book move for white leaves black to move, and vice versa
+        return 'b' if color[0] == 'w' else 'w'
+
     @classmethod
-    def get_move_by_next_review(cls, user_id):
-        """get the next book move to be reviewed"""
+    def get_move_by_next_review(cls, user_id, color=None):
+        """get the next book move to be reviewed
 
-        # get all book moves for this user
-        moves = cls.query \
+        candidates are book moves with at least one child which are due
+        (or have never been reviewed). the database picks them in one
+        indexed query, or the user's cached tree when the repertoire cache
+        is enabled; if nothing is due yet the moves due soonest are used.
+        with STUDY_QUEUE_ENABLED, moves of both colors come from the
+        user's study queue, see StudyQueue.
+
+        params:
+            color: optional, 'w', 'b', 'white' or 'black' to only study
+                that color's book moves
+        """
+        side_to_move = cls._side_to_move(color)
+        if side_to_move is None \
+                and current_app.config.get('STUDY_QUEUE_ENABLED', False):
+            position = StudyQueue.pop(user_id)
+            if position is not None:
+                return position
+        if repertoire_cache.enabled:
+            tree = repertoire_cache.get(user_id, cls.load_tree)
+            return cls._study_position(
+                tree.due_moves(STUDY_CANDIDATES, side_to_move),
+                tree.first_moves,
+                lambda move_id: (tree.node(move_id), tree.children(move_id))
+            )
+
+        child = db.aliased(cls)
+        has_children = db.exists().where(child.parent_id == cls.id)
+        query = cls.query \
+                    .filter_by(user_id=user_id) \
+                    .filter_by(book_move=True)
+        if side_to_move:
+            query = query.filter_by(side_to_move=side_to_move)
+        candidates = query \
+                    .filter(has_children) \
+                    .order_by(cls.next_review.asc().nullsfirst(), cls.id) \
+                    .limit(STUDY_CANDIDATES) \
+                    .all()
+
+        def first_moves(perspective):
+            return cls.query \
                         .filter_by(user_id=user_id) \
-                        .filter_by(book_move=True) \
+                        .filter_by(perspective=perspective) \
+                        .filter_by(parent_id=None) \
+                        .all()
+
+        def position(move_id):
+            # the move along with its children, in a single query
+            moves = cls.query \
+                        .filter(db.or_(cls.id == move_id,
+                                       cls.parent_id == move_id)) \
+                        .order_by(cls.id) \
                         .all()
+            return (next(m for m in moves if m.id == move_id),
+                    [m for m in moves if m.id != move_id])
+
+        return cls._study_position(candidates, first_moves, position)
+
+    @classmethod
+    def get_study_deck(cls, user_id, color=None, size=STUDY_DECK_SIZE,
+                       cursor=None):
         """
-        # if color, find all moves where the opposite color is to move
-        if color in COLOR_CHOICES:
-            color = choice(COLOR_CHOICES)
-            moves = [m for m in moves if color[0] != m.fen.split()[1]]
+        returns the next due positions to study, most urgent first, as a
+        dict with keys cards and cursor
 
+        due moves are found with one keyset query ordered like
+        get_move_by_next_review, never reviewed moves first; the
+        positions before them with one more query. each card is a dict
+        with keys goal_id, move and next, a position holding several due
+        moves is only returned once per deck
+
+        params:
+            color: optional, 'w', 'b', 'white' or 'black' to only study
+                that color's book moves
+            size: number of due moves to fetch
+            cursor: the cursor of the previous deck, to fetch the next one.
+                the cursor is None once no due moves are left
         """
-        if not moves:
+        query = cls.query \
+                    .filter_by(user_id=user_id) \
+                    .filter_by(book_move=True) \
+                    .filter(cls.child_count > 0) \
+                    .filter(db.or_(cls.next_review.is_(None),
+                                   cls.next_review <= datetime.now()))
+        side_to_move = cls._side_to_move(color)
+        if side_to_move:
+            query = query.filter_by(side_to_move=side_to_move)
+        if cursor:
+            after_id = int(cursor['id'])
+            if cursor.get('next_review') is None:
+                query = query.filter(db.or_(
+                    cls.next_review.isnot(None),
+                    cls.id > after_id
+                ))
+            else:
+                after_review = datetime.fromisoformat(cursor['next_review'])
+                query = query.filter(db.or_(
+                    cls.next_review > after_review,
+                    db.and_(cls.next_review == after_review, cls.id > after_id)
+                ))
+        goals = query \
+                    .order_by(cls.next_review.asc().nullsfirst(), cls.id) \
+                    .limit(size) \
+                    .all()
+        if not goals:
+            return {'cards': [], 'cursor': None}
+
+        # parents of the goals and all their children, with the first
+        # moves for goals without a parent
+        parent_ids = {m.parent_id for m in goals if m.parent_id is not None}
+        root_perspectives = {m.perspective for m in goals if m.parent_id is None}
+        conditions = [cls.id.in_(parent_ids), cls.parent_id.in_(parent_ids)]
+        if root_perspectives:
+            conditions.append(db.and_(
+                cls.user_id == user_id,
+                cls.parent_id.is_(None),
+                cls.perspective.in_(root_perspectives)
+            ))
+        moves = cls.query \
+                    .filter(db.or_(*conditions)) \
+                    .order_by(cls.id) \
+                    .all()
+        by_id = {m.id: m for m in moves}
+        children = {}
+        for m in moves:
+            key = m.parent_id if m.parent_id is not None else m.perspective
+            children.setdefault(key, []).append(m)
+
+        cards = []
+        seen = set()
+        for goal in goals:
+            key = goal.parent_id if goal.parent_id is not None \
+                else goal.perspective
+            if key in seen:
+                continue
+            seen.add(key)
+            parent = by_id.get(goal.parent_id)
+            cards.append({
+                'goal_id': goal.id,
+                'move': parent.to_json() if parent else FIRST_MOVE,
+                'next': [m.to_json() for m in children.get(key, [])]
+            })
+        last = goals[-1]
+        return {
+            'cards': cards,
+            'cursor': {
+                'next_review': last.next_review.isoformat()
+                    if last.next_review else None,
+                'id': last.id
+            } if len(goals) == size else None
+        }
+
+    @classmethod
+    def get_review_forecast(cls, user_id, days=FORECAST_DAYS, color=None):
+        """
+        returns the number of book moves falling due on each of the next
+        days, as a dict with keys start (today's date), days (a list of
+        counts, the first for today), overdue, later and new (moves never
+        reviewed). counted with one GROUP BY query, and cached until the
+        user's next write
+
+        params:
+            days: length of the forecast
+            color: optional, 'w', 'b', 'white' or 'black' to only count
+                that color's book moves
+        """
+        today = date.today()
+        side_to_move = cls._side_to_move(color)
+
+        def forecast():
+            day = db.func.date(cls.next_review)
+            query = db.session.query(day, db.func.count()) \
+                        .filter(cls.user_id == user_id) \
+                        .filter(cls.book_move == True)
+            if side_to_move:
+                query = query.filter(cls.side_to_move == side_to_move)
+            counts = [0] * days
+            result = {'start': today.isoformat(), 'days': counts,
+                      'overdue': 0, 'later': 0, 'new': 0}
+            for due, count in query.group_by(day):
+                if due is None:
+                    result['new'] += count
+                    continue
+                # sqlite returns dates as text
+                if isinstance(due, str):
+                    due = date.fromisoformat(due)
+                offset = (due - today).days
+                if offset < 0:
+                    result['overdue'] += count
+                elif offset < days:
+                    counts[offset] += count
+                else:
+                    result['later'] += count
+            return result
+
+        if not forecast_cache.enabled:
+            return forecast()
+        return forecast_cache.get(
+            user_id, (today, days, side_to_move), forecast)
+
+    @staticmethod
+    def _study_position(candidates, first_moves, position):
+        """
+        picks one of the candidates to study, and returns the position
+        before it as a dict with keys move and next
+
+        params:
+            candidates: moves as returned by get_move_by_next_review's query
+            first_moves: function of a perspective returning the first moves
+            position: function of a move id returning the move and its children
+        """
+        if not candidates:
             return NO_MOVES_ERROR
 
-        # get the move due for review soonest
-        moves.sort(key=sort_by_date)
-        print(f'there are {moves} moves available')
-        # making this random for now
-        # first filter out any moves without children
-        moves = [m for m in moves if m.children]
-        goal_move = choice(moves)
-        move = cls.query.filter_by(id=goal_move.parent_id).first()
-        if not move:
-            move = FIRST_MOVE
-            children = cls.query.filter_by(parent_id=None).all()
-            return {'move': move, 'next': [m.to_json() for m in children]}
+        # making this random for now, among the moves that are due
+        now = datetime.now()
+        due = [m for m in candidates
+               if m.next_review is None or m.next_review <= now]
+        goal_move = choice(due or candidates[:1])
+
+        # fetch the position before the goal move along with all its options
+        if goal_move.parent_id is None:
+            children = first_moves(goal_move.perspective)
+            return {'move': FIRST_MOVE, 'next': [m.to_json() for m in children]}
+        move, children = position(goal_move.parent_id)
         return {
             'move': move.to_json(),
-            'next': [m.to_json() for m in move.children]
+            'next': [m.to_json() for m in children]
         }
-        
 
 
+    @staticmethod
+    def _new_move_values(user_id, parent_id, fen, san, perspective):
+        """returns the column values of a new move"""
+        side_to_move = fen.split(' ')[1]
+        return {
+            'user_id': user_id,
+            'parent_id': parent_id,
+            'fen': fen,
+            'san': san,
+            'perspective': perspective[0],
+            'side_to_move': side_to_move,
+            'position_key': signed(position_key(fen)),
+            # is it our move? then it's a book move, else not
+            'book_move': side_to_move != perspective[0],
+        }
+
     @classmethod
+    @sqlite_performance.write_transaction
     def create_move(cls, user_id, parent_id, fen, san, perspective):
-
-        # is it our move? then it's a book move, else not
-        if fen.split(' ')[1] != perspective:
-            book_move = True
-        else:
-            book_move = False
-
-        new_move = cls(
-            user_id=user_id,
-            parent_id=parent_id,
-            fen=fen,
-            san=san,
-            perspective=perspective[0],
-            book_move=book_move
+        values = cls._new_move_values(
+            user_id,
+            parent_id,
+            fen,
+            san,
+            perspective
         )
+        new_move = cls(**values)
         db.session.add(new_move)
+        cls._update_child_aggregates(parent_id, children=1)
+        User.bump_repertoire_version(user_id)
+        db.session.commit()
+        new_move_id = new_move.id
+        forecast_cache.invalidate(user_id)
+        repertoire_cache.update(
+            user_id, lambda tree: tree.add(id=new_move_id, **values))
+        return new_move_id
+
+    @classmethod
+    def _child_ids(cls, user_id, perspective, parent_ids):
+        """
+        maps (parent_id, san) to move id for all children of parent_ids,
+        parent_id None standing for the first moves of the book
+        """
+        queries = []
+        if None in parent_ids:
+            queries.append(db.session.query(cls.id, cls.parent_id, cls.san)
+                            .filter_by(user_id=user_id)
+                            .filter_by(perspective=perspective)
+                            .filter_by(parent_id=None))
+        for chunk in chunked(parent_ids - {None}, BULK_CHUNK_SIZE):
+            queries.append(db.session.query(cls.id, cls.parent_id, cls.san)
+                            .filter(cls.parent_id.in_(chunk)))
+        return {
+            (row.parent_id, row.san): row.id
+            for query in queries for row in query
+        }
+
+    @staticmethod
+    def check_tree(moves):
+        """
+        raises ValueError unless moves is a list of dicts with a san, a
+        fen and optionally a list of children, the same dicts
+        """
+        if not isinstance(moves, list):
+            raise ValueError('moves must be a list')
+        stack = list(moves)
+        while stack:
+            node = stack.pop()
+            if not isinstance(node, dict):
+                raise ValueError('every move must be an object')
+            san, fen = node.get('san'), node.get('fen')
+            if not isinstance(san, str) or not san:
+                raise ValueError('every move needs a san')
+            if not isinstance(fen, str) or len(fen.split(' ')) < 4 \
+                    or fen.split(' ')[1] not in ('w', 'b'):
+                raise ValueError(f'invalid fen for {san}: {fen!r}')
+            try:
+                position_key(fen)
+            except (KeyError, ValueError):
+                raise ValueError(f'invalid fen for {san}: {fen!r}')
+            children = node.get('children', [])
+            if not isinstance(children, list):
+                raise ValueError(f'children of {san} must be a list')
+            stack.extend(children)
+
+    @classmethod
+    @sqlite_performance.write_transaction
+    def import_tree(cls, user_id, perspective, moves, parent_id=None):
+        """
+        adds a whole tree of moves to a user's book in one transaction
+
+        the tree is walked one ply at a time: moves already in the book
+        (same san under the same parent) are reused, the others are
+        inserted with chunked bulk statements
+
+        params:
+            perspective: 'w' or 'b', ignored when grafting onto parent_id
+            moves: list of dicts with keys san, fen and children, the
+                children being a list of the same dicts
+            parent_id: optional move to add the tree under
+
+        returns a dict with the number of moves created, and the number
+        of moves which were already in the book. raises ValueError for a
+        malformed tree, before writing anything, and MoveNotFoundError
+        when parent_id isn't one of the user's moves
+        """
+        cls.check_tree(moves)
+        if parent_id is not None:
+            parent = cls.query.filter_by(id=parent_id).first()
+            if not parent or parent.user_id != user_id:
+                raise MoveNotFoundError(parent_id)
+            perspective = parent.perspective
+        else:
+            perspective = perspective[0]
+
+        table = cls.__table__
+        created = existing = 0
+        # moves created by this import, which can't have children in the book
+        new_ids = set()
+        level = [(parent_id, moves)]
+        while level:
+            # merge repeated moves, eg. the same line coming from two games
+            siblings = {}
+            for parent, nodes in level:
+                for node in nodes:
+                    move = siblings.setdefault(
+                        (parent, node['san']),
+                        {'fen': node['fen'], 'children': []}
+                    )
+                    move['children'].extend(node.get('children', []))
+
+            parents = {parent for parent, _ in siblings}
+            ids = cls._child_ids(user_id, perspective, parents - new_ids)
+            rows = []
+            for (parent, san), move in siblings.items():
+                if (parent, san) in ids:
+                    existing += 1
+                    continue
+                values = cls._new_move_values(
+                    user_id, parent, move['fen'], san, perspective)
+                values['child_count'] = len({m['san'] for m in move['children']})
+                rows.append(values)
+
+            if rows:
+                for chunk in chunked(rows, BULK_CHUNK_SIZE):
+                    db.session.execute(table.insert(), chunk)
+                ids = cls._child_ids(user_id, perspective, parents)
+                new_ids.update(ids[(r['parent_id'], r['san'])] for r in rows)
+                # the new moves' parents in the book gain children
+                new_children = {}
+                for row in rows:
+                    if row['parent_id'] is not None \
+                            and row['parent_id'] not in new_ids:
+                        new_children[row['parent_id']] = \
+                            new_children.get(row['parent_id'], 0) + 1
+                if new_children:
+                    db.session.execute(
+                        table.update()
+                            .where(table.c.id == db.bindparam('b_parent'))
+                            .values(child_count=table.c.child_count
+                                    + db.bindparam('b_children')),
+                        [
+                            {'b_parent': parent, 'b_children': children}
+                            for parent, children in new_children.items()
+                        ]
+                    )
+                created += len(rows)
+
+            level = [
+                (ids[key], move['children'])
+                for key, move in siblings.items() if move['children']
+            ]
+        if created:
+            User.bump_repertoire_version(user_id)
         db.session.commit()
-        return new_move.id
+        repertoire_cache.invalidate(user_id)
+        forecast_cache.invalidate(user_id)
+        return {'created': created, 'existing': existing}
 
     @classmethod
+    @sqlite_performance.write_transaction
     def delete_move(cls, user_id, move_id):
         move = cls.query.filter_by(id=move_id).first()
         if not move:
@@ -281,6 +1286,218 @@ class Move(db.Model):
             raise Exception("User id doesnt match move\'s user id")
         if move.children:
             raise Exception("Can't delete a move with descendents")
-        print(f'deleting move {move.san}')
+        logger.debug('deleting move %s - %s', move.id, move.san)
+        cls._update_child_aggregates(
+            move.parent_id,
+            children=-1,
+            easiness=-(move.easiness or 0.0),
+            rated=-int(move.easiness is not None)
+        )
         db.session.delete(move)
+        User.bump_repertoire_version(user_id)
+        db.session.commit()
+        forecast_cache.invalidate(user_id)
+        repertoire_cache.update(user_id, lambda tree: tree.remove(move_id))
+
+    @classmethod
+    @sqlite_performance.write_transaction
+    def delete_subtree(cls, user_id, move_id):
+        """
+        deletes a move along with all of its descendants in one statement,
+        the descendants being found with a recursive query
+
+        returns the number of moves deleted
+        """
+        move = db.session.query(cls.user_id, cls.parent_id, cls.easiness) \
+                    .filter_by(id=move_id) \
+                    .first()
+        if not move:
+            raise Exception("Move not found")
+        # descendants always belong to the owner of the move
+        if not move.user_id == user_id:
+            raise Exception("User id doesnt match move\'s user id")
+
+        # pysqlite only begins a transaction before INSERT, UPDATE and
+        # DELETE statements, the delete starting with WITH would commit on
+        # its own: the updates go first, opening the transaction
+        User.bump_repertoire_version(user_id)
+        # only the parent of the move keeps aggregates over deleted moves
+        cls._update_child_aggregates(
+            move.parent_id,
+            children=-1,
+            easiness=-(move.easiness or 0.0),
+            rated=-int(move.easiness is not None)
+        )
+        table = cls.__table__
+        children = table.alias('children')
+        subtree = db.select([table.c.id]) \
+                    .where(table.c.id == move_id) \
+                    .cte('subtree', recursive=True)
+        subtree = subtree.union_all(
+            db.select([children.c.id])
+                .where(children.c.parent_id == subtree.c.id)
+        )
+        # counted beforehand, drivers don't all report the rows deleted by
+        # a statement starting with WITH
+        deleted = db.session.execute(
+            db.select([db.func.count()]).select_from(subtree)
+        ).scalar()
+        db.session.execute(
+            table.delete().where(table.c.id.in_(db.select([subtree.c.id]))))
+        logger.debug('deleted move %s and %s descendents', move_id, deleted - 1)
         db.session.commit()
+        forecast_cache.invalidate(user_id)
+        repertoire_cache.update(
+            user_id, lambda tree: tree.remove_subtree(move_id))
+        return deleted
+
+
+# a queued move id and its parent id, 0 for the first moves of a book
+QUEUE_ENTRY = struct.Struct('<II')
+
+
+class StudyQueue(db.Model):
+    """
+    The book moves a user has to study on a day, most urgent first, as
+    packed QUEUE_ENTRY pairs. head is the next entry to study: taking a
+    move from the queue is a lookup of the entry at head. built ahead of
+    the day by flask build-study-queues, or when first needed
+    """
+    __tablename__ = 'study_queues'
+    user_id = db.Column(db.Integer, db.ForeignKey(User.id), primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    # repertoire version of the user the queue was built from
+    version = db.Column(db.Integer, nullable=False)
+    entries = db.Column(db.LargeBinary, nullable=False)
+    head = db.Column(db.Integer, nullable=False, default=0)
+    # set by reschedule, which moves reviews around. scores needn't: an
+    # interval is at least a day, a scored move is skipped at the head
+    stale = db.Column(db.Boolean, nullable=False, default=False)
+
+    def __len__(self):
+        return len(self.entries) // QUEUE_ENTRY.size
+
+    @staticmethod
+    def compute(user_id, day):
+        """
+        returns the column values of the user's queue for day: book moves
+        with at least one child which are due by the end of the day, in
+        the order of get_move_by_next_review
+        """
+        end = datetime.combine(day + timedelta(days=1), time())
+        version = User.get_repertoire_version(user_id)
+        rows = db.session.query(Move.id, Move.parent_id) \
+                    .filter_by(user_id=user_id) \
+                    .filter_by(book_move=True) \
+                    .filter(Move.child_count > 0) \
+                    .filter(db.or_(Move.next_review.is_(None),
+                                   Move.next_review < end)) \
+                    .order_by(Move.next_review.asc().nullsfirst(), Move.id) \
+                    .all()
+        return {
+            'user_id': user_id,
+            'day': day,
+            'version': version,
+            'entries': b''.join(
+                QUEUE_ENTRY.pack(row.id, row.parent_id or 0) for row in rows),
+            'head': 0,
+            'stale': False,
+        }
+
+    @classmethod
+    @sqlite_performance.write_transaction
+    def store(cls, queues):
+        """replaces the queues of their users with queues, in one transaction"""
+        table = cls.__table__
+        for chunk in chunked(queues, BULK_CHUNK_SIZE):
+            db.session.execute(table.delete().where(
+                table.c.user_id.in_([queue['user_id'] for queue in chunk])))
+            db.session.execute(table.insert(), chunk)
+        db.session.commit()
+
+    @classmethod
+    @sqlite_performance.write_transaction
+    def pop(cls, user_id):
+        """
+        takes the next move which is still due from the user's queue and
+        returns the position before it as a dict with keys move and next,
+        or None when no move is due today
+
+        the queue is built again when it is from another day or another
+        version of the repertoire, when it is stale, used up, or when too
+        many of its moves were studied elsewhere, at most once per call
+        """
+        today = date.today()
+        end = datetime.combine(today + timedelta(days=1), time())
+        row = db.session.query(cls, User.repertoire_version) \
+                    .join(User, User.id == cls.user_id) \
+                    .filter(cls.user_id == user_id) \
+                    .first()
+        queue, version = row if row else (None, None)
+        rebuilt = False
+        if queue is None or queue.stale or queue.day != today \
+                or queue.version != version:
+            queue = cls._rebuild(user_id, today, queue)
+            rebuilt = True
+
+        skipped = 0
+        position = None
+        while position is None:
+            if queue.head >= len(queue) \
+                    or skipped >= STUDY_QUEUE_MAX_SKIPS:
+                if rebuilt:
+                    break
+                queue = cls._rebuild(user_id, today, queue)
+                rebuilt = True
+                continue
+            move_id, parent_id = QUEUE_ENTRY.unpack_from(
+                queue.entries, queue.head * QUEUE_ENTRY.size)
+            queue.head += 1
+            position = cls._position(user_id, move_id, parent_id, end)
+            skipped += 1
+        db.session.commit()
+        return position
+
+    @classmethod
+    def _rebuild(cls, user_id, day, queue=None):
+        values = cls.compute(user_id, day)
+        if queue is None:
+            queue = cls(**values)
+            db.session.add(queue)
+        else:
+            for key, value in values.items():
+                setattr(queue, key, value)
+        return queue
+
+    @staticmethod
+    def _position(user_id, move_id, parent_id, end):
+        """
+        returns the position before move_id like _study_position, in one
+        query, or None when the move is gone or no longer due before end
+        """
+        if parent_id:
+            moves = Move.query \
+                        .filter(db.or_(Move.id == parent_id,
+                                       Move.parent_id == parent_id)) \
+                        .order_by(Move.id) \
+                        .all()
+        else:
+            moves = Move.query \
+                        .filter_by(user_id=user_id) \
+                        .filter_by(parent_id=None) \
+                        .order_by(Move.id) \
+                        .all()
+        goal = next((m for m in moves if m.id == move_id), None)
+        if goal is None or not goal.book_move \
+                or (goal.next_review is not None and goal.next_review >= end):
+            return None
+        if not parent_id:
+            return {
+                'move': FIRST_MOVE,
+                'next': [m.to_json() for m in moves
+                         if m.perspective == goal.perspective]
+            }
+        return {
+            'move': next(m for m in moves if m.id == parent_id).to_json(),
+            'next': [m.to_json() for m in moves if m.id != parent_id]
+        }
@@ -0,0 +1,179 @@
+"""
+Rate limit storage in a SQLite file, shared by all workers of a host.
+
+Registers the sqlite:// scheme with limits, use it by setting, e.g.
+
+    RATELIMIT_STORAGE_URL = 'sqlite:////var/run/openingbook/limits.sqlite'
+    RATELIMIT_STRATEGY = 'moving-window'
+
+Every hit runs in a single write transaction, so counts are exact across
+processes. The file is opened in WAL mode without syncing: limits only
+need to survive as long as the workers, not a power loss.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+from limits.storage import Storage
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS counters (
+    key TEXT PRIMARY KEY,
+    count INTEGER NOT NULL,
+    expiry REAL NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS events (
+    key TEXT NOT NULL,
+    time REAL NOT NULL,
+    expiry REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_events_key_time ON events (key, time);
+"""
+
+INCR = """
+INSERT INTO counters (key, count, expiry) VALUES (:key, 1, :expiry)
+ON CONFLICT (key) DO UPDATE SET
+    count = CASE WHEN expiry <= :now THEN 1 ELSE count + 1 END,
+    expiry = CASE WHEN expiry <= :now OR :elastic THEN :expiry ELSE expiry END
+"""
+
+# expired counters and events are deleted once every so many hits
+PURGE_EVERY = 1000
+
+
+class SQLiteStorage(Storage):
+    """
+    Fixed window counters and moving window events in a SQLite file.
+    Each thread of each process has its own connection to it.
+    """
+    STORAGE_SCHEME = ['sqlite']
+
+    def __init__(self, uri=None, busy_timeout=5000, **options):
+        # sqlite:///relative/path or sqlite:////absolute/path, as SQLAlchemy
+        self.path = uri[len('sqlite:///'):]
+        if not self.path:
+            raise ValueError('sqlite rate limit storage needs a file path')
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._hits = 0
+        super().__init__(uri, **options)
+        self._connection.executescript(SCHEMA)
+
+    @property
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        # connections can't be shared with a forked process
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(
+                self.path, isolation_level=None, check_same_thread=False)
+            connection.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout)}')
+            connection.execute('PRAGMA journal_mode = wal')
+            connection.execute('PRAGMA synchronous = off')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _transaction(self):
+        return _Transaction(self._connection)
+
+    def incr(self, key, expiry, elastic_expiry=False):
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute(INCR, {
+                'key': key,
+                'expiry': now + expiry,
+                'now': now,
+                'elastic': int(elastic_expiry),
+            })
+            count = connection.execute(
+                'SELECT count FROM counters WHERE key = ?', (key,)
+            ).fetchone()[0]
+            self._purge(connection, now)
+        return count
+
+    def get(self, key):
+        row = self._connection.execute(
+            'SELECT count FROM counters WHERE key = ? AND expiry > ?',
+            (key, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        row = self._connection.execute(
+            'SELECT expiry FROM counters WHERE key = ?', (key,)
+        ).fetchone()
+        return int(row[0]) if row else -1
+
+    def acquire_entry(self, key, limit, expiry, no_add=False):
+        """
+        adds an event to the moving window of key, unless limit events
+        happened in the last expiry seconds. returns whether it could
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            # events which left the window are no longer needed
+            connection.execute(
+                'DELETE FROM events WHERE key = ? AND time < ?',
+                (key, now - expiry))
+            count = connection.execute(
+                'SELECT count(*) FROM events WHERE key = ?', (key,)
+            ).fetchone()[0]
+            if count >= limit:
+                return False
+            if not no_add:
+                connection.execute(
+                    'INSERT INTO events (key, time, expiry) VALUES (?, ?, ?)',
+                    (key, now, now + expiry))
+                self._purge(connection, now)
+        return True
+
+    def _purge(self, connection, now):
+        self._hits += 1
+        if self._hits % PURGE_EVERY == 0:
+            connection.execute('DELETE FROM counters WHERE expiry <= ?', (now,))
+            connection.execute('DELETE FROM events WHERE expiry <= ?', (now,))
+
+    def get_moving_window(self, key, limit, expiry):
+        """returns the start of the moving window, and its number of events"""
+        now = time.time()
+        oldest, count = self._connection.execute(
+            'SELECT min(time), count(*) FROM events WHERE key = ? AND time >= ?',
+            (key, now - expiry)
+        ).fetchone()
+        return int(oldest if oldest is not None else now), count
+
+    def check(self):
+        try:
+            self._connection.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        with self._transaction() as connection:
+            count = connection.execute(
+                'SELECT (SELECT count(*) FROM counters) '
+                '+ (SELECT count(DISTINCT key) FROM events)').fetchone()[0]
+            connection.execute('DELETE FROM counters')
+            connection.execute('DELETE FROM events')
+        return count
+
+    def clear(self, key):
+        with self._transaction() as connection:
+            connection.execute('DELETE FROM counters WHERE key = ?', (key,))
+            connection.execute('DELETE FROM events WHERE key = ?', (key,))
+
+
+class _Transaction:
+    """takes the write lock up front, so concurrent hits queue on it"""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+        return self.connection
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.connection.execute('ROLLBACK' if exc_type else 'COMMIT')
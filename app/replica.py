@@ -0,0 +1,89 @@
+"""
+Read queries on a replica database, writes on the primary.
+
+With a 'replica' entry in SQLALCHEMY_BINDS, e.g. from
+
+    REPLICA_DATABASE_URL = 'sqlite:////var/lib/openingbook/replica.sqlite'
+
+selects of models without a bind key of their own run on the replica,
+everything else on the primary. A session sticks to the primary once it
+has written, or once a write transaction started, so a request reads its
+own writes; requests after it may read the replica before it caught up.
+
+`flask replicate` keeps a SQLite replica in sync with a SQLite primary,
+for running the setup locally.
+"""
+import sqlite3
+from time import sleep
+
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import orm
+from sqlalchemy.sql import Select
+
+REPLICA_BIND = 'replica'
+# key of session.info set once the session must stay on the primary
+PRIMARY = 'primary'
+
+
+def use_primary(session):
+    """sends the session's queries to the primary from now on"""
+    session.info[PRIMARY] = True
+
+
+class RoutingSession(SignallingSession):
+    """Runs selects on the replica until the session writes"""
+
+    def __init__(self, db, **options):
+        super().__init__(db, **options)
+        self.replica = REPLICA_BIND in (self.app.config.get('SQLALCHEMY_BINDS') or {})
+        self.db = db
+
+    def get_bind(self, mapper=None, clause=None):
+        if self.replica and not self.info.get(PRIMARY) and not self._flushing \
+                and isinstance(clause, Select) and not self._bind_key(mapper):
+            return self.db.get_engine(self.app, bind=REPLICA_BIND)
+        # flushes, updates, deletes and anything else but a select
+        if clause is None or not isinstance(clause, Select):
+            use_primary(self)
+        return super().get_bind(mapper, clause)
+
+    @staticmethod
+    def _bind_key(mapper):
+        if mapper is None:
+            return None
+        return getattr(mapper.persist_selectable, 'info', {}).get('bind_key')
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def sqlite_path(engine):
+    if engine.dialect.name != 'sqlite' \
+            or engine.url.database in (None, '', ':memory:'):
+        raise ValueError(f'{engine.url} is not a SQLite file')
+    return engine.url.database
+
+
+def replicate(db, app, interval=None, pages=1024):
+    """
+    copies the primary SQLite database into the replica with the backup
+    API, once or every interval seconds. the replica is only locked while
+    a copy is written, readers see either the old or the new copy
+
+    returns the number of copies made
+    """
+    source = sqlite_path(db.get_engine(app))
+    target = sqlite_path(db.get_engine(app, bind=REPLICA_BIND))
+    copies = 0
+    while True:
+        with sqlite3.connect(source) as primary, \
+                sqlite3.connect(target) as replica:
+            primary.backup(replica, pages=pages)
+        primary.close()
+        replica.close()
+        copies += 1
+        if interval is None:
+            return copies
+        sleep(interval)
@@ -0,0 +1,99 @@
+"""
+SQLite settings for serving several users at once.
+
+With SQLITE_PERFORMANCE_MODE on, each new connection to a SQLite file
+switches to a write ahead log, so readers never wait for a writer, and
+waits up to SQLITE_BUSY_TIMEOUT for the write lock instead of failing.
+SQLite still allows a single writer: writes of a worker are queued on a
+lock, and a write that loses the lock to another worker is retried.
+"""
+from functools import wraps
+from threading import RLock, local
+from time import sleep
+
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+
+from .replica import use_primary
+
+# sqlite error messages of a write which may succeed when retried
+BUSY_ERRORS = ('database is locked', 'database table is locked')
+
+
+def is_busy(error):
+    return any(message in str(error.orig) for message in BUSY_ERRORS)
+
+
+class SQLitePerformance:
+    """Sets the pragmas of SQLite connections and serializes writes"""
+
+    def __init__(self, app=None, db=None):
+        self.enabled = False
+        self.retries = 0
+        self.retry_delay = 0.0
+        self.pragmas = {}
+        self.db = None
+        self._lock = RLock()
+        self._local = local()
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        self.db = db
+        self.enabled = app.config.get('SQLITE_PERFORMANCE_MODE', False)
+        self.retries = app.config.get('SQLITE_WRITE_RETRIES', 5)
+        self.retry_delay = app.config.get('SQLITE_WRITE_RETRY_DELAY', 0.05)
+        self.pragmas = {
+            'journal_mode': app.config.get('SQLITE_JOURNAL_MODE', 'wal'),
+            'synchronous': app.config.get('SQLITE_SYNCHRONOUS', 'normal'),
+            'busy_timeout': app.config.get('SQLITE_BUSY_TIMEOUT', 5000),
+            'mmap_size': app.config.get('SQLITE_MMAP_SIZE', 0),
+        }
+        if not self.enabled:
+            return
+        binds = [None] + list(app.config.get('SQLALCHEMY_BINDS') or {})
+        for bind in binds:
+            engine = db.get_engine(app, bind)
+            if engine.dialect.name != 'sqlite' \
+                    or engine.url.database in (None, '', ':memory:'):
+                continue
+            event.listen(engine, 'connect', self._set_pragmas)
+
+    def _set_pragmas(self, dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in self.pragmas.items():
+            if value is not None:
+                cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+
+    def write_transaction(self, f):
+        """
+        decorates a function which writes and commits, so that it runs
+        while holding this worker's write lock, and runs again after a
+        rollback when the database was locked by another worker. the
+        function must be safe to run again from the start. calls nested
+        in a write transaction run as part of it. its reads go to the
+        primary database, not to a replica which may lag behind
+        """
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if self.db is not None:
+                use_primary(self.db.session)
+            if not self.enabled or getattr(self._local, 'writing', False):
+                return f(*args, **kwargs)
+            attempt = 0
+            while True:
+                with self._lock:
+                    self._local.writing = True
+                    try:
+                        return f(*args, **kwargs)
+                    except OperationalError as e:
+                        self.db.session.rollback()
+                        if not is_busy(e) or attempt >= self.retries:
+                            raise
+                    finally:
+                        self._local.writing = False
+                # back off outside of the lock, doubling the delay each time
+                sleep(self.retry_delay * 2 ** attempt)
+                attempt += 1
+        return wrapper
@@ -0,0 +1,10 @@
+def chunked(items, size):
+    """Split a list into lists of at most size items
+    args:
+    items -- list to split
+    size -- int, largest chunk to return
+
+    keeps IN clauses and executemany batches below the database limits
+    """
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
@@ -3,6 +3,25 @@
 STARTING_POSITION_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
 FIRST_MOVE = {'id': '', 'fen': STARTING_POSITION_FEN, 'san': ''}
 COLOR_CHOICES = ['w', 'b', 'black', 'white']
+# longest interval in days between two reviews of a move
+MAX_INTERVAL = 365
+# rows per statement when writing many moves at once
+BULK_CHUNK_SIZE = 500
+# largest subtree /explore returns at once
+EXPLORE_MAX_DEPTH = 40
+EXPLORE_MAX_NODES = 2000
+# largest number of moves in a line planned by /play
+PLAY_LINE_MAX_NODES = 1000
+# how many of the most urgent moves /study picks from at random
+STUDY_CANDIDATES = 10
+# positions returned by /study-deck per request, by default and at most
+STUDY_DECK_SIZE = 20
+STUDY_DECK_MAX_SIZE = 100
+# moves of a study queue studied elsewhere, skipped before it is rebuilt
+STUDY_QUEUE_MAX_SKIPS = 5
+# days covered by /forecast, by default and at most
+FORECAST_DAYS = 365
+FORECAST_MAX_DAYS = 3 * 365
 
 # error messages
 NO_MOVES_ERROR = {'error_message': 'No moves to display'}
\ No newline at end of file
@@ -0,0 +1,79 @@
+import json
+from .constants import STARTING_POSITION_FEN
+
+SM_TWO_FIELDS = ['last_review', 'next_review', 'repetitions', 'easiness', 'interval']
+
+def moves_to_ndjson(rows, sm2=False):
+    """Generate one json line per move
+    args:
+    rows -- rows from Move.export_moves
+    sm2 -- bool, include the supermemo two values, eg. for a backup
+    """
+    for row in rows:
+        move = {
+            'id': row.id,
+            'parent_id': row.parent_id,
+            'fen': row.fen,
+            'san': row.san,
+            'perspective': row.perspective,
+            'book_move': row.book_move,
+        }
+        if sm2:
+            for field in SM_TWO_FIELDS:
+                value = getattr(row, field)
+                if field.endswith('review') and value is not None:
+                    value = value.isoformat()
+                move[field] = value
+        yield json.dumps(move) + '\n'
+
+def moves_to_pgn(rows, fen=STARTING_POSITION_FEN, width=79):
+    """Generate a PGN game, with variations, one line at a time
+    args:
+    rows -- rows from Move.export_moves
+    fen -- position before the first move
+    width -- longest line to generate
+    """
+    yield '[Event "Opening Book"]\n'
+    if fen != STARTING_POSITION_FEN:
+        yield '[SetUp "1"]\n'
+        yield f'[FEN "{fen}"]\n'
+    yield '[Result "*"]\n\n'
+
+    line = ''
+    for token in _pgn_tokens(rows):
+        # no space before the closing parenthesis of a variation
+        separator = '' if token == ')' else ' '
+        if line and len(line) + len(separator) + len(token) > width:
+            yield line + '\n'
+            line = token
+        else:
+            line = f'{line}{separator}{token}' if line else token
+    yield f'{line} *\n' if line else '*\n'
+
+def _pgn_tokens(rows):
+    """Generate the movetext tokens of rows sorted by their key"""
+    # key prefixes of the variations currently open
+    variations = []
+    needs_number = True
+    for row in rows:
+        while variations and not row.key.startswith(variations[-1]):
+            variations.pop()
+            yield ')'
+            needs_number = True
+        opening = ''
+        if row.rank > 1:
+            variations.append(row.key[:-6])
+            opening = '('
+            needs_number = True
+
+        # the fen is the position after the move
+        _, side_to_move, _, _, _, fullmove = row.fen.split(' ')
+        if side_to_move == 'b':
+            yield f'{opening}{fullmove}. {row.san}'
+        elif needs_number:
+            yield f'{opening}{int(fullmove) - 1}... {row.san}'
+        else:
+            yield row.san
+        needs_number = False
+    for _ in variations:
+        yield ')'
@@ -0,0 +1,289 @@
+"""
+Builds the masters index from PGN files, see app.masters.
+
+Games are read in chunks and counted by a pool of worker processes, each
+chunk giving a run: a file of records sorted by position key and move.
+The runs of a PGN file are merged into one run per file, and the file
+runs into the index, so memory only depends on the chunk size. Finished
+files are recorded in a state file, an interrupted build starts again
+after the last finished file.
+"""
+import heapq
+import io
+import json
+import os
+import shutil
+from collections import deque
+from functools import partial
+from multiprocessing import Pool
+from time import perf_counter
+
+import chess.pgn
+
+from ..masters import RECORD, MAX_COUNT, encode_move, write_index
+from .zobrist import (
+    BLACK_TO_MOVE_KEY,
+    CASTLING_KEYS,
+    EN_PASSANT_KEYS,
+    PIECE_KEYS
+)
+
+RESULTS = {'1-0': 0, '1/2-1/2': 1, '0-1': 2}
+# number of runs merged at once, below the usual limit on open files
+MERGE_FAN_IN = 64
+# records read from a run at a time
+READ_RECORDS = 4096
+# zobrist keys by python-chess color, piece type and square
+_PIECE_KEYS = {
+    (color, piece_type): [
+        PIECE_KEYS[(chess.Piece(piece_type, color).symbol(), square)]
+        for square in chess.SQUARES
+    ]
+    for color in chess.COLORS for piece_type in chess.PIECE_TYPES
+}
+_CASTLING = [
+    (chess.BB_H1, 'K'), (chess.BB_A1, 'Q'), (chess.BB_H8, 'k'), (chess.BB_A8, 'q')
+]
+
+
+class _MainlineVisitor(chess.pgn.BaseVisitor):
+    """
+    collects the result of a game and, for its first max_plies mainline
+    moves, the key of the position and the encoded move
+    """
+
+    def __init__(self, max_plies):
+        self.max_plies = max_plies
+
+    def begin_game(self):
+        self.outcome = None
+        self.moves = []
+
+    def visit_header(self, tagname, tagvalue):
+        if tagname == 'Result':
+            self.outcome = RESULTS.get(tagvalue)
+
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def visit_move(self, board, move):
+        if len(self.moves) < self.max_plies:
+            self.moves.append((board_key(board), encode_move(move)))
+
+    def handle_error(self, error):
+        # a game with an illegal move is skipped
+        self.outcome = None
+
+    def result(self):
+        return self
+
+
+def read_chunks(path, chunk_games):
+    """yields lists of up to chunk_games game texts from a PGN file"""
+    chunk, game, in_moves = [], [], False
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            if line.startswith('[') and in_moves:
+                chunk.append(''.join(game))
+                game, in_moves = [], False
+                if len(chunk) == chunk_games:
+                    yield chunk
+                    chunk = []
+            elif line.strip() and not line.startswith('['):
+                in_moves = True
+            game.append(line)
+    if in_moves:
+        chunk.append(''.join(game))
+    if chunk:
+        yield chunk
+
+
+def board_key(board):
+    """
+    same as zobrist.position_key(board.fen()), without writing the fen
+    which takes most of the time of counting a game
+    """
+    key = 0
+    for (color, piece_type), keys in _PIECE_KEYS.items():
+        for square in chess.scan_forward(board.pieces_mask(piece_type, color)):
+            key ^= keys[square]
+    if board.turn == chess.BLACK:
+        key ^= BLACK_TO_MOVE_KEY
+    rights = board.clean_castling_rights()
+    for mask, right in _CASTLING:
+        if rights & mask:
+            key ^= CASTLING_KEYS[right]
+    # board.fen() only writes the square when the capture is legal
+    if board.has_legal_en_passant():
+        key ^= EN_PASSANT_KEYS[chess.FILE_NAMES[chess.square_file(board.ep_square)]]
+    return key
+
+
+def count_games(games, max_plies):
+    """
+    returns a dict of (position key, move) to [white, draws, black] for
+    the first max_plies moves of each game, and the number of games
+    counted. games without a result are skipped
+    """
+    counts = {}
+    counted = 0
+    visitor = partial(_MainlineVisitor, max_plies)
+    for text in games:
+        game = chess.pgn.read_game(io.StringIO(text), Visitor=visitor)
+        if game is None or game.outcome is None:
+            continue
+        counted += 1
+        for key in game.moves:
+            results = counts.get(key)
+            if results is None:
+                results = counts[key] = [0, 0, 0]
+            results[game.outcome] += 1
+    return counts, counted
+
+
+def _count_chunk(task):
+    """worker: counts a chunk of games into a run at path"""
+    games, max_plies, path = task
+    counts, counted = count_games(games, max_plies)
+    write_index(path, (
+        (key, move, *results)
+        for (key, move), results in sorted(counts.items())
+    ))
+    return counted
+
+
+def read_run(path):
+    """yields the records of a run"""
+    size = RECORD.size * READ_RECORDS
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(size)
+            if not data:
+                return
+            yield from RECORD.iter_unpack(data)
+
+
+def merge_records(runs):
+    """merges sorted iterables of records, summing the counts of a move"""
+    current = None
+    for record in heapq.merge(*runs):
+        if current is not None and record[:2] == tuple(current[:2]):
+            current[2:] = [min(a + b, MAX_COUNT)
+                           for a, b in zip(current[2:], record[2:])]
+            continue
+        if current is not None:
+            yield tuple(current)
+        current = list(record)
+    if current is not None:
+        yield tuple(current)
+
+
+def merge_runs(paths, output, work=None, remove=True):
+    """
+    merges runs into the run at output, MERGE_FAN_IN at a time. runs of
+    the intermediate rounds are written to work, next to output by
+    default. paths are removed unless remove is false, the intermediate
+    runs always are
+    """
+    paths = list(paths)
+    prefix = os.path.join(work, os.path.basename(output)) if work else output
+    keep = set() if remove else set(paths)
+    round_ = 0
+    while len(paths) > MERGE_FAN_IN:
+        merged = []
+        for i in range(0, len(paths), MERGE_FAN_IN):
+            path = f'{prefix}.{round_}.{i}'
+            write_index(path, merge_records(
+                [read_run(p) for p in paths[i:i + MERGE_FAN_IN]]))
+            merged.append(path)
+        for path in paths:
+            if path not in keep:
+                os.remove(path)
+        paths = merged
+        round_ += 1
+    write_index(output, merge_records([read_run(p) for p in paths]))
+    for path in paths:
+        if path not in keep:
+            os.remove(path)
+
+
+class IndexBuilder:
+    """
+    Builds the masters index at output from PGN files, keeping its
+    runs and state in the directory work
+    """
+
+    def __init__(self, output, work=None, processes=None, chunk_games=1000,
+                 max_plies=40, report=print):
+        self.output = output
+        self.work = work or output + '.parts'
+        self.processes = processes or os.cpu_count()
+        self.chunk_games = chunk_games
+        self.max_plies = max_plies
+        self.report = report
+        self.state_path = os.path.join(self.work, 'state.json')
+
+    def _load_state(self):
+        if not os.path.exists(self.state_path):
+            return {'files': {}}
+        with open(self.state_path) as f:
+            return json.load(f)
+
+    def _save_state(self, state):
+        with open(self.state_path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(self.state_path + '.tmp', self.state_path)
+
+    def build(self, paths):
+        """counts the games of paths and writes the index, returns its size"""
+        os.makedirs(self.work, exist_ok=True)
+        state = self._load_state()
+        finished = state['files']
+        # runs of a file that was interrupted are counted again
+        for name in os.listdir(self.work):
+            if name.startswith('chunk-'):
+                os.remove(os.path.join(self.work, name))
+
+        with Pool(self.processes) as pool:
+            for path in paths:
+                path = os.path.abspath(path)
+                if path in finished:
+                    self.report(f'{path}: already counted, skipping')
+                    continue
+                run = f'file-{len(finished)}.run'
+                games, seconds = self._count_file(pool, path, run)
+                finished[path] = {'run': run, 'games': games}
+                self._save_state(state)
+                self.report(f'{path}: {games} games in {seconds:.1f}s, '
+                            f'{games / max(seconds, 1e-9):.0f} games/sec')
+
+        start = perf_counter()
+        # the file runs go along with the state, a build interrupted while
+        # merging them starts the merge again
+        merge_runs(
+            [os.path.join(self.work, f['run']) for f in finished.values()],
+            self.output, work=self.work, remove=False)
+        size = os.path.getsize(self.output) // RECORD.size
+        self.report(f'wrote {size} records to {self.output} '
+                    f'in {perf_counter() - start:.1f}s')
+        shutil.rmtree(self.work)
+        return size
+
+    def _count_file(self, pool, path, run):
+        """counts a PGN file into the run named run, chunks in parallel"""
+        start = perf_counter()
+        chunk_runs = []
+        pending = deque()
+        games = 0
+        # a bounded number of chunks in flight keeps memory bounded
+        for n, chunk in enumerate(read_chunks(path, self.chunk_games)):
+            if len(pending) >= 2 * self.processes:
+                games += pending.popleft().get()
+            chunk_path = os.path.join(self.work, f'chunk-{n}.run')
+            chunk_runs.append(chunk_path)
+            pending.append(pool.apply_async(
+                _count_chunk, ((chunk, self.max_plies, chunk_path),)))
+        while pending:
+            games += pending.popleft().get()
+        merge_runs(chunk_runs, os.path.join(self.work, run))
+        return games, perf_counter() - start
@@ -0,0 +1,47 @@
+import io
+import chess
+import chess.pgn
+
+def pgn_to_tree(pgn, fen=None):
+    """Parse PGN text, variations included, into a tree of moves
+    args:
+    pgn -- str, one or more games
+    fen -- optional starting position for games without a FEN header,
+        defaults to the normal starting position
+
+    returns a list of dicts with keys san, fen and children, children
+    being a list of the same dicts, as taken by Move.import_tree.
+    Lines repeated across games are merged by Move.import_tree.
+    """
+    class GameBuilder(chess.pgn.GameBuilder):
+        def begin_headers(self):
+            headers = super().begin_headers()
+            if fen:
+                # a FEN header of the game itself replaces this one
+                headers['FEN'] = fen
+            return headers
+
+    roots = []
+    stream = io.StringIO(pgn)
+    while True:
+        game = chess.pgn.read_game(stream, Visitor=GameBuilder)
+        if game is None:
+            return roots
+        if game.errors:
+            raise ValueError(f'Invalid PGN: {game.errors[0]}')
+        board = game.board()
+
+        # walk the game depth first, keeping a single board in sync
+        stack = [(variation, roots) for variation in reversed(game.variations)]
+        while stack:
+            node, siblings = stack.pop()
+            if node is None:
+                board.pop()
+                continue
+            san = board.san(node.move)
+            board.push(node.move)
+            move = {'san': san, 'fen': board.fen(), 'children': []}
+            siblings.append(move)
+            stack.append((None, None))
+            stack.extend((variation, move['children'])
+                         for variation in reversed(node.variations))
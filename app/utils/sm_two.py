@@ -0,0 +1,104 @@
+from datetime import date, datetime, time, timedelta
+import numpy as np
+from supermemo2 import SMTwo
+from .constants import MAX_INTERVAL
+
+def next_sm_two(quality, interval=None, repetitions=None, easiness=None,
+                max_interval=MAX_INTERVAL):
+    """Get the supermemo two values of a move after a study session
+    args:
+    quality -- int between 0 and 5 (inclusive)
+    interval, repetitions, easiness -- current values of the move,
+        easiness is None if the move was never studied
+    max_interval -- longest interval in days, the next review is at most
+        that far away
+
+    returns a dict with keys interval, repetitions, easiness,
+    next_review and last_review, named like the Move columns
+    """
+    # SMTwo's default last_review is the day it was imported, not today
+    if easiness == None:
+        sm_two = SMTwo(quality=quality, first_visit=True,
+                       last_review=date.today())
+    else:
+        sm_two = SMTwo(
+            quality=quality,
+            interval=interval,
+            repetitions=repetitions,
+            easiness=easiness,
+            last_review=date.today()
+        )
+    sm_two.new_sm_two()
+    # seems like a hack, but have to avoid interval getting too large
+    interval = min(sm_two.new_interval, max_interval)
+    return {
+        'interval': interval,
+        'repetitions': sm_two.new_repetitions,
+        'easiness': sm_two.new_easiness,
+        # SMTwo's next_review would ignore the cap
+        'next_review': datetime.combine(
+            date.today() + timedelta(days=interval), time()),
+        'last_review': datetime.now(),
+    }
+
+def sm_two_arrays(quality, interval, repetitions, easiness,
+                  max_interval=MAX_INTERVAL):
+    """Vectorized supermemo two, gives the same values as next_sm_two
+    args:
+    quality -- ints between 0 and 5 (inclusive)
+    interval, repetitions, easiness -- current values of the moves,
+        easiness is nan for moves that were never studied
+    max_interval -- longest interval in days
+
+    returns a tuple of arrays (interval, repetitions, easiness), interval
+    being capped at max_interval. the next reviews are given by
+    next_reviews(today, interval, max_interval)
+    """
+    quality = np.asarray(quality, dtype=np.int64)
+    easiness = np.asarray(easiness, dtype=np.float64)
+    # first visits start from the supermemo two defaults
+    first_visit = np.isnan(easiness)
+    easiness = np.where(first_visit, 2.5, easiness)
+    interval = np.where(first_visit, 0, interval).astype(np.int64)
+    repetitions = np.where(first_visit, 1, repetitions).astype(np.int64)
+
+    passed = quality >= 3
+    # np.rint rounds half to even, just like python's round
+    days = np.where(repetitions == 1, 1,
+                    np.where(repetitions == 2, 6,
+                             np.rint(interval * easiness))).astype(np.int64)
+    days = np.where(passed, days, 1)
+    new_repetitions = np.where(passed, repetitions + 1, 1)
+    new_easiness = np.where(
+        passed,
+        easiness - 0.8 + 0.28 * quality - 0.02 * quality**2,
+        easiness
+    )
+    new_easiness = np.maximum(new_easiness, 1.3)
+    return (
+        np.minimum(days, max_interval),
+        new_repetitions,
+        new_easiness
+    )
+
+def review_dates(start, days):
+    """Add days to dates
+    args:
+    start -- a date, or an array of datetime64 dates
+    days -- array of ints
+
+    returns a list of datetimes at midnight, ready to store as next_review
+    """
+    start = np.asarray(start, dtype='datetime64[D]')
+    dates = start + np.asarray(days, dtype='timedelta64[D]')
+    return dates.astype('datetime64[us]').tolist()
+
+def next_reviews(last_review, interval, max_interval=MAX_INTERVAL):
+    """Review dates of moves, as set by next_sm_two
+    args:
+    last_review -- a date, or an array of datetime64 dates
+    interval -- array of ints, capped at max_interval
+
+    returns a list of datetimes at midnight, ready to store as next_review
+    """
+    return review_dates(last_review, np.minimum(interval, max_interval))
@@ -4,13 +4,15 @@ def average_descendent_easiness(move):
     """Get the average easiness of children of move object
     args:
     move -- Move class object
+
+    Uses the child aggregates stored on the move, so the children
+    themselves are never loaded. Unrated children count as zero.
     """
     # if no children, prefer lines with continuations while also
     # preventing division by zero by returning arbitrary number > 5
-    if not move.children:
+    if not move.child_count:
         return 10
-    return sum(m.easiness for m in move.children if m.easiness != None) \
-                / len(move.children)
+    return move.child_easiness_sum / move.child_count
 
 def sort_by_date(move):
     """Returns move.next_review, unless None, then returns datetime.now()"""
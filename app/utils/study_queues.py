@@ -0,0 +1,73 @@
+"""
+Builds the study queues of all active users for a day, see StudyQueue.
+
+Users are split in chunks, the queues of a chunk being computed by a
+pool of worker processes, each with its own app and connections. The
+queues are written by the calling process as chunks come back, so that
+SQLite never has more than one writer.
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+from time import perf_counter
+
+from .chunks import chunked
+
+# the app of a worker process
+_app = None
+
+
+def _init_worker(config_name):
+    global _app
+    from .. import create_app
+    _app = create_app(config_name)
+
+
+def _compute_queues(user_ids, day):
+    from .. import db
+    from ..models import StudyQueue
+    with _app.app_context():
+        try:
+            return [StudyQueue.compute(user_id, day) for user_id in user_ids]
+        finally:
+            db.session.remove()
+
+
+class QueueBuilder:
+    """Computes study queues in processes created with config_name"""
+
+    def __init__(self, config_name, processes=None, chunk_users=100,
+                 report=print):
+        self.config_name = config_name
+        self.processes = processes
+        self.chunk_users = chunk_users
+        self.report = report
+
+    def build(self, user_ids=None, day=None):
+        """
+        builds the queues of user_ids, of every active user by default,
+        for day, today by default. returns the number of queues built
+        """
+        from .. import db
+        from ..models import StudyQueue, User
+
+        day = day or date.today()
+        if user_ids is None:
+            user_ids = [row.id for row in db.session.query(User.id)
+                            .filter_by(is_active=True)
+                            .order_by(User.id)]
+        start = perf_counter()
+        built = 0
+        with ProcessPoolExecutor(self.processes, initializer=_init_worker,
+                                 initargs=(self.config_name,)) as pool:
+            futures = [
+                pool.submit(_compute_queues, chunk, day)
+                for chunk in chunked(user_ids, self.chunk_users)
+            ]
+            for future in as_completed(futures):
+                queues = future.result()
+                StudyQueue.store(queues)
+                built += len(queues)
+        seconds = perf_counter() - start
+        self.report(f'built {built} study queues for {day} in {seconds:.1f}s, '
+                    f'{built / max(seconds, 1e-9):.0f} users/sec')
+        return built
@@ -0,0 +1,269 @@
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from math import isnan
+import numpy as np
+
+NO_MOVE = -1
+# parent of a move removed from the tree
+REMOVED = -2
+
+
+class MoveView:
+    """A move of a RepertoireTree, read from the tree's columns on access"""
+    __slots__ = ('tree', 'index')
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+    @property
+    def id(self):
+        return self.tree.ids[self.index]
+
+    @property
+    def fen(self):
+        return self.tree._text(self.index)[0]
+
+    @property
+    def san(self):
+        return self.tree._text(self.index)[1]
+
+    @property
+    def perspective(self):
+        return chr(self.tree.perspective[self.index])
+
+    @property
+    def book_move(self):
+        return bool(self.tree.book_move[self.index])
+
+    @property
+    def parent_id(self):
+        parent = self.tree.parent[self.index]
+        return None if parent == NO_MOVE else self.tree.ids[parent]
+
+    @property
+    def easiness(self):
+        easiness = self.tree.easiness[self.index]
+        return None if isnan(easiness) else easiness
+
+    @property
+    def next_review(self):
+        review = self.tree.next_review[self.index]
+        return None if isnan(review) else datetime.fromtimestamp(review)
+
+    @property
+    def children(self):
+        return [MoveView(self.tree, i) for i in self.tree._children(self.index)]
+
+    def to_json(self):
+        """returns dict with keys id, fen, and san, like Move.to_json"""
+        fen, san = self.tree._text(self.index)
+        return {
+            "id": self.id,
+            "fen": fen,
+            "san": san,
+        }
+
+
+class RepertoireTree:
+    """
+    All moves of one user, held in memory to answer play and study
+    requests without querying the database. Built from the rows of one
+    query, sorted by id, then kept in step with the database by the
+    write methods of Move.
+
+    Moves are stored column-wise in flat arrays, linked to their parent,
+    first child and next sibling by index, with fens and sans packed in
+    a single buffer. A move costs about 130 bytes, a tenth of a
+    Move instance.
+
+    Readers don't take the cache's lock: add appends a move in one go
+    once it is validated, and numpy reads copy the columns, as a view
+    would make a concurrent append raise BufferError.
+    """
+
+    def __init__(self, rows=()):
+        self.ids = array('q')
+        self.parent = array('i')
+        self.first_child = array('i')
+        self.next_sibling = array('i')
+        self.easiness = array('d')
+        # next review as a timestamp, nan if never reviewed
+        self.next_review = array('d')
+        self.book_move = bytearray()
+        self.perspective = bytearray()
+        self.side_to_move = bytearray()
+        # fen and san of every move, separated by a space
+        self.text = bytearray()
+        self.text_start = array('q')
+        self.roots = {'w': [], 'b': []}
+        self._removed = 0
+        # the last child of each move, so children stay in id order
+        self._last_child = array('i')
+        for row in rows:
+            self.add(**row._asdict())
+
+    def __len__(self):
+        return len(self.ids) - self._removed
+
+    def __contains__(self, move_id):
+        return self._index(move_id) is not None
+
+    def _index(self, move_id):
+        i = bisect_left(self.ids, move_id)
+        if i < len(self.ids) and self.ids[i] == move_id \
+                and self.parent[i] != REMOVED:
+            return i
+        return None
+
+    def _text(self, index):
+        end = self.text_start[index + 1] if index + 1 < len(self.text_start) \
+            else len(self.text)
+        fen, san = bytes(self.text[self.text_start[index]:end]) \
+            .decode().rsplit(' ', 1)
+        return fen, san
+
+    def _children(self, index):
+        child = self.first_child[index]
+        while child != NO_MOVE:
+            yield child
+            child = self.next_sibling[child]
+
+    def node(self, move_id):
+        index = self._index(move_id)
+        if index is None:
+            raise KeyError(move_id)
+        return MoveView(self, index)
+
+    def children(self, move_id):
+        return self.node(move_id).children
+
+    def first_moves(self, perspective):
+        return [MoveView(self, i) for i in self.roots[perspective]]
+
+    def descendent_easiness(self, node):
+        """same as utils.sort_funcs.average_descendent_easiness"""
+        total = 0.0
+        count = 0
+        for child in self._children(node.index):
+            easiness = self.easiness[child]
+            if not isnan(easiness):
+                total += easiness
+            count += 1
+        if not count:
+            return 10
+        return total / count
+
+    def due_moves(self, limit, side_to_move=None):
+        """
+        returns up to limit book moves with children, those never reviewed
+        first and then by next review, like Move.get_move_by_next_review
+        """
+        # side_to_move is appended last of these columns, moves added
+        # while copying are left out
+        count = len(self.side_to_move)
+        parent = self._column(self.parent, count)
+        candidates = (self._column(self.book_move, count) == 1) \
+            & (self._column(self.first_child, count) != NO_MOVE) \
+            & (parent != REMOVED)
+        if side_to_move is not None:
+            candidates &= self._column(self.side_to_move, count) \
+                == ord(side_to_move)
+        indexes = np.flatnonzero(candidates)
+        if not len(indexes):
+            return []
+        review = self._column(self.next_review, count)[indexes]
+        review = np.where(np.isnan(review), -np.inf, review)
+        if len(indexes) > limit:
+            # keep everything up to the limit-th review, ties included
+            cutoff = np.partition(review, limit - 1)[limit - 1]
+            indexes, review = indexes[review <= cutoff], review[review <= cutoff]
+        # indexes follow ids, so sorting is by review and then by id
+        order = np.lexsort((indexes, review))[:limit]
+        return [MoveView(self, int(i)) for i in indexes[order]]
+
+    @staticmethod
+    def _column(column, count):
+        # slicing copies while holding the GIL, np.array(column) may let
+        # an append in while it reads the buffer
+        dtype = np.uint8 if isinstance(column, bytearray) else column.typecode
+        return np.frombuffer(column[:count], dtype=dtype)
+
+    def add(self, id, parent_id, fen, san, perspective, book_move,
+            side_to_move, easiness=None, next_review=None, **_):
+        if len(self.ids) and id <= self.ids[-1]:
+            raise ValueError('moves must be added in id order')
+        parent = NO_MOVE
+        if parent_id is not None:
+            parent = self._index(parent_id)
+            if parent is None:
+                raise KeyError(parent_id)
+        # everything which can fail comes before the first append, so
+        # the columns never get out of step
+        easiness = float('nan') if easiness is None else float(easiness)
+        review = float('nan') if next_review is None \
+            else next_review.timestamp()
+        codes = ord(perspective), ord(side_to_move)
+        text = f'{fen} {san}'.encode()
+        index = len(self.ids)
+        self.ids.append(id)
+        self.parent.append(parent)
+        self.first_child.append(NO_MOVE)
+        self.next_sibling.append(NO_MOVE)
+        self._last_child.append(NO_MOVE)
+        self.easiness.append(easiness)
+        self.next_review.append(review)
+        self.book_move.append(int(bool(book_move)))
+        self.perspective.append(codes[0])
+        self.side_to_move.append(codes[1])
+        self.text_start.append(len(self.text))
+        self.text.extend(text)
+
+        if parent == NO_MOVE:
+            self.roots[perspective].append(index)
+        elif self.first_child[parent] == NO_MOVE:
+            self.first_child[parent] = index
+            self._last_child[parent] = index
+        else:
+            self.next_sibling[self._last_child[parent]] = index
+            self._last_child[parent] = index
+
+    def remove(self, move_id):
+        """removes a move without children, its slot is left unused"""
+        index = self.node(move_id).index
+        if self.first_child[index] != NO_MOVE:
+            raise ValueError('move has children')
+        parent = self.parent[index]
+        if parent == NO_MOVE:
+            self.roots[chr(self.perspective[index])].remove(index)
+        else:
+            siblings = list(self._children(parent))
+            position = siblings.index(index)
+            following = self.next_sibling[index]
+            if position == 0:
+                self.first_child[parent] = following
+            else:
+                self.next_sibling[siblings[position - 1]] = following
+            if self._last_child[parent] == index:
+                self._last_child[parent] = siblings[position - 1] \
+                    if position else NO_MOVE
+        self.parent[index] = REMOVED
+        self.next_sibling[index] = NO_MOVE
+        self._removed += 1
+
+    def remove_subtree(self, move_id):
+        """removes a move along with all of its descendants"""
+        order = [self.node(move_id).index]
+        for index in order:
+            order.extend(self._children(index))
+        # children go before their parents
+        for index in reversed(order):
+            self.remove(self.ids[index])
+
+    def update(self, move_id, easiness=None, next_review=None):
+        """sets the supermemo two values of a move"""
+        index = self.node(move_id).index
+        self.easiness[index] = float('nan') if easiness is None else easiness
+        self.next_review[index] = float('nan') if next_review is None \
+            else next_review.timestamp()
@@ -0,0 +1,58 @@
+from random import Random
+
+import chess
+
+# the keys must never change, positions are stored and indexed by them
+_random = Random(20201216)
+PIECE_KEYS = {
+    (piece, square): _random.getrandbits(64)
+    for piece in 'PNBRQKpnbrqk' for square in range(64)
+}
+CASTLING_KEYS = {right: _random.getrandbits(64) for right in 'KQkq'}
+EN_PASSANT_KEYS = {file: _random.getrandbits(64) for file in 'abcdefgh'}
+BLACK_TO_MOVE_KEY = _random.getrandbits(64)
+
+def position_key(fen):
+    """Get the zobrist hash of a position, as an unsigned 64 bit int
+    args:
+    fen -- str, only pieces, side to move, castling and en passant count
+
+    Move counters are ignored, so a position reached by different move
+    orders gets the same key. The en passant square only counts when the
+    capture is legal, like in python-chess fens and ingest.board_key, so
+    fens from different libraries agree.
+    """
+    placement, side_to_move, castling, en_passant = fen.split(' ')[:4]
+    key = 0
+    board = {}
+    # fen lists ranks from 8 down to 1, squares are numbered from a1
+    for rank, row in enumerate(reversed(placement.split('/'))):
+        file = 0
+        for char in row:
+            if char.isdigit():
+                file += int(char)
+                continue
+            board[rank * 8 + file] = char
+            key ^= PIECE_KEYS[(char, rank * 8 + file)]
+            file += 1
+
+    if side_to_move == 'b':
+        key ^= BLACK_TO_MOVE_KEY
+    for right in castling:
+        if right in CASTLING_KEYS:
+            key ^= CASTLING_KEYS[right]
+    if en_passant != '-':
+        file = 'abcdefgh'.index(en_passant[0])
+        # the capturing pawn stands next to the pawn that just moved
+        pawn, rank = ('P', 4) if side_to_move == 'w' else ('p', 3)
+        # a pawn next to the square is cheap to check, whether it is
+        # pinned or leaves its king in check is left to python-chess
+        if any(board.get(rank * 8 + f) == pawn
+               for f in (file - 1, file + 1) if 0 <= f < 8) \
+                and chess.Board(fen).has_legal_en_passant():
+            key ^= EN_PASSANT_KEYS[en_passant[0]]
+    return key
+
+def signed(key):
+    """Convert an unsigned 64 bit key to the signed int the database stores"""
+    return key - (1 << 64) if key >= (1 << 63) else key
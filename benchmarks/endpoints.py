@@ -0,0 +1,183 @@
+"""
+Latency and throughput of /play, /study, /explore and /forecast by
+repertoire size.
+
+    python benchmarks/endpoints.py [--sizes 100 1000 10000 100000]
+        [--requests 200] [--output results.json] [--compare baseline.json]
+
+For each size a synthetic user and repertoire are written into a fresh
+SQLite file, then every endpoint is called through the Flask test client
+with a JWT minted by guard. Results are written as JSON, along with the
+commit they were measured on; --compare prints the change of each p50
+and p95 against an earlier results file.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config, TestingConfig  # noqa: E402
+from app import create_app, db, forecast_cache, guard, repertoire_cache  # noqa: E402
+from app.models import Move  # noqa: E402
+from synthetic import add_repertoire, create_user  # noqa: E402
+
+SIZES = (100, 1000, 10000, 100000)
+
+
+def make_app(path, cache):
+    name = f'bench-endpoints-{cache}'
+    config[name] = type(name, (TestingConfig,), {
+        'TESTING': False,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path,
+        'RATELIMIT_ENABLED': False,
+        'REPERTOIRE_CACHE_ENABLED': cache,
+        'FORECAST_CACHE_ENABLED': cache,
+        'LOG_LEVEL': 'ERROR',
+    })
+    return create_app(name)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+def scenarios(rng, moves):
+    """returns functions giving the url and json of a request, by name"""
+    inner = [m for m in moves if m.child_count]
+    book = [m for m in inner if m.book_move]
+    return {
+        'play_first_move': lambda: ('/play', {
+            'first_move': True, 'color': rng.choice(['white', 'black'])}),
+        'play_score': lambda: ('/play', {
+            'last_move_id': [rng.choice(inner).id],
+            'score': rng.randint(0, 5)}),
+        'study': lambda: ('/study', {}),
+        'study_score': lambda: ('/study', {
+            'last_move_id': [rng.choice(book).id],
+            'score': rng.randint(0, 5)}),
+        'explore': lambda: ('/explore', {
+            'last_move_id': rng.choice(inner).id}),
+        'explore_depth': lambda: ('/explore', {
+            'color': rng.choice(['w', 'b']), 'depth': 4}),
+        'study_deck': lambda: ('/study-deck', {'size': 20}),
+        'forecast': lambda: ('/forecast', {}),
+    }
+
+
+def run_size(size, requests, cache, options):
+    with tempfile.TemporaryDirectory() as directory:
+        app = make_app(os.path.join(directory, 'bench.sqlite'), cache)
+        with app.app_context():
+            db.create_all()
+            user = create_user('bench')
+            start = perf_counter()
+            moves = add_repertoire(user.id, size, **options)
+            setup = perf_counter() - start
+            headers = {'Authorization': 'Bearer ' + guard.encode_jwt_token(user)}
+            sample = Move.query.with_entities(
+                Move.id, Move.child_count, Move.book_move).all()
+            client = app.test_client()
+            rng = random.Random(size)
+            results = {'moves': moves, 'setup_seconds': round(setup, 2)}
+            for name, make_request in scenarios(rng, sample).items():
+                repertoire_cache.clear()
+                forecast_cache.clear()
+                latencies = []
+                # the first requests warm up caches and the query planner
+                for i in range(requests + 10):
+                    url, body = make_request()
+                    start = perf_counter()
+                    response = client.post('/api' + url, json=body,
+                                           headers=headers)
+                    response.get_data()
+                    if i >= 10:
+                        latencies.append(perf_counter() - start)
+                    if response.status_code >= 400:
+                        raise RuntimeError(f'{url} {body}: {response.status}')
+                results[name] = {
+                    'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+                    'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+                    'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+                    'per_second': round(len(latencies) / sum(latencies), 1),
+                }
+            db.session.remove()
+        return results
+
+
+def compare(results, baseline):
+    for size, endpoints in results['sizes'].items():
+        for name, stats in endpoints.items():
+            old = baseline['sizes'].get(size, {}).get(name)
+            if not isinstance(stats, dict) or not old:
+                continue
+            changes = ', '.join(
+                f"{key} {old[key]:.2f} -> {stats[key]:.2f} "
+                f"({(stats[key] - old[key]) / old[key]:+.0%})"
+                for key in ('p50_ms', 'p95_ms') if old[key]
+            )
+            print(f'{size:>7} {name:<16} {changes}')
+
+
+def commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES))
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per endpoint and size')
+    parser.add_argument('--cache', action='store_true',
+                        help='enable the repertoire cache')
+    parser.add_argument('--depth', type=int, default=30)
+    parser.add_argument('--branching', type=int, default=3)
+    parser.add_argument('--reviewed', type=float, default=0.5,
+                        help='share of moves with a supermemo two state')
+    parser.add_argument('--due', type=float, default=0.3,
+                        help='share of reviewed moves due for review')
+    parser.add_argument('--output', help='write the results to this file')
+    parser.add_argument('--compare', help='results file to compare with')
+    args = parser.parse_args()
+
+    options = {'depth': args.depth, 'branching': args.branching,
+               'reviewed': args.reviewed, 'due': args.due}
+    results = {
+        'commit': commit(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'requests': args.requests,
+        'cache': args.cache,
+        'options': options,
+        'sizes': {},
+    }
+    for size in args.sizes:
+        results['sizes'][str(size)] = run_size(
+            size, args.requests, args.cache, options)
+        print(f'{size} moves done', file=sys.stderr)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Cost of a rate limit hit with each storage, and whether the limit holds
+exactly when several processes hit the same key.
+
+    python benchmarks/rate_limits.py [--hits 20000] [--processes 4]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+from multiprocessing import Process, Queue
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from limits import parse  # noqa: E402
+from limits.storage import storage_from_string  # noqa: E402
+from limits.strategies import (  # noqa: E402
+    FixedWindowRateLimiter,
+    MovingWindowRateLimiter
+)
+
+import app.ratelimit  # noqa: E402,F401 registers sqlite://
+
+STRATEGIES = {
+    'fixed-window': FixedWindowRateLimiter,
+    'moving-window': MovingWindowRateLimiter,
+}
+
+
+def time_hits(uri, strategy, hits):
+    """returns microseconds per hit, over as many keys as hits / 10"""
+    # strategies only keep a weak reference to their storage
+    storage = storage_from_string(uri)
+    limiter = STRATEGIES[strategy](storage)
+    limit = parse(f'{hits} per hour')
+    start = perf_counter()
+    for i in range(hits):
+        limiter.hit(limit, f'client-{i % (hits // 10 or 1)}')
+    return (perf_counter() - start) / hits * 1e6
+
+
+def hit_until_limited(uri, strategy, attempts, results):
+    storage = storage_from_string(uri)
+    limiter = STRATEGIES[strategy](storage)
+    limit = parse('100 per hour')
+    results.put(sum(limiter.hit(limit, 'shared') for _ in range(attempts)))
+
+
+def allowed_across_processes(uri, strategy, processes):
+    """returns the hits allowed of a limit of 100, over all processes"""
+    results = Queue()
+    workers = [Process(target=hit_until_limited,
+                       args=(uri, strategy, 100, results))
+               for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    allowed = sum(results.get() for _ in workers)
+    for worker in workers:
+        worker.join()
+    return allowed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--hits', type=int, default=20000)
+    parser.add_argument('--processes', type=int, default=4)
+    args = parser.parse_args()
+
+    report = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for strategy in STRATEGIES:
+            for name, uri in (
+                ('memory', 'memory://'),
+                ('sqlite', 'sqlite:///' + os.path.join(directory, f'{strategy}.sqlite')),
+            ):
+                report[f'{name} {strategy}'] = {
+                    'us_per_hit': round(time_hits(uri, strategy, args.hits), 1),
+                    # a limit of 100 per hour, expected to allow exactly 100
+                    'allowed_of_100': allowed_across_processes(
+                        uri.replace('.sqlite', '-shared.sqlite'),
+                        strategy, args.processes),
+                }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
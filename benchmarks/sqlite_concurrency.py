@@ -0,0 +1,121 @@
+"""
+Measures reads and study writes of concurrent workers sharing one SQLite
+file, with SQLITE_PERFORMANCE_MODE off and on.
+
+    python benchmarks/sqlite_concurrency.py [--readers 4] [--writers 2]
+
+Readers fetch the children of random moves like /explore, writers score
+random moves like /study, each in its own process with its own app.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+from multiprocessing import Process, Queue
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config, TestingConfig  # noqa: E402
+from app import create_app, db  # noqa: E402
+from app.models import Move, User  # noqa: E402
+from synthetic import add_repertoire, create_user  # noqa: E402
+
+
+def make_app(path, performance):
+    name = f'bench-{performance}'
+    config[name] = type(name, (TestingConfig,), {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path,
+        'SQLITE_PERFORMANCE_MODE': performance,
+    })
+    return create_app(name)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+def worker(path, performance, role, seconds, seed, results):
+    app = make_app(path, performance)
+    rng = random.Random(seed)
+    latencies, errors = [], 0
+    with app.app_context():
+        user_id = User.query.first().id
+        ids = [m.id for m in db.session.query(Move.id)]
+        end = perf_counter() + seconds
+        while perf_counter() < end:
+            start = perf_counter()
+            try:
+                if role == 'read':
+                    Move.get_descendent_moves(rng.choice(ids))
+                else:
+                    Move.add_study_sessions(
+                        user_id, [(rng.choice(ids), rng.randint(0, 5))])
+            except Exception:
+                db.session.rollback()
+                errors += 1
+                continue
+            latencies.append(perf_counter() - start)
+            # reads hold no transaction open between requests
+            db.session.remove()
+    results.put((role, latencies, errors))
+
+
+def run(path, performance, readers, writers, seconds):
+    results = Queue()
+    roles = ['read'] * readers + ['write'] * writers
+    processes = [
+        Process(target=worker,
+                args=(path, performance, role, seconds, n, results))
+        for n, role in enumerate(roles)
+    ]
+    for p in processes:
+        p.start()
+    stats = {role: {'latencies': [], 'errors': 0} for role in ('read', 'write')}
+    for _ in processes:
+        role, latencies, errors = results.get()
+        stats[role]['latencies'] += latencies
+        stats[role]['errors'] += errors
+    for p in processes:
+        p.join()
+    report = {}
+    for role, s in stats.items():
+        report[role] = {
+            'per_second': round(len(s['latencies']) / seconds, 1),
+            'p50_ms': round(percentile(s['latencies'], 50) * 1000, 2),
+            'p99_ms': round(percentile(s['latencies'], 99) * 1000, 2),
+            'max_ms': round(max(s['latencies'], default=0) * 1000, 2),
+            'errors': s['errors'],
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--moves', type=int, default=5000)
+    args = parser.parse_args()
+
+    report = {}
+    for performance in (False, True):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bench.sqlite')
+            app = make_app(path, performance)
+            with app.app_context():
+                db.create_all()
+                user = create_user('bench')
+                add_repertoire(user.id, args.moves)
+            report['performance' if performance else 'default'] = run(
+                path, performance, args.readers, args.writers, args.seconds)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+Synthetic users and repertoires, written straight into the database.
+
+Trees are grown one ply at a time from legal moves: positions where the
+opponent is to move get up to `branching` replies, positions where the
+user is to move get `book_branching` book moves, until the tree has
+`size` moves or reaches `depth` plies. A share of the moves is given a
+supermemo two state, some of those being due for review.
+"""
+import random
+from datetime import datetime, timedelta
+
+import chess
+
+from app import db
+from app.models import Move, User
+from app.utils.chunks import chunked
+from app.utils.constants import BULK_CHUNK_SIZE
+from app.utils.zobrist import position_key, signed
+
+
+def generate_repertoire(user_id, size, perspective='w', depth=30, branching=3,
+                        book_branching=1, reviewed=0.5, due=0.3, seed=0,
+                        first_id=1):
+    """
+    returns rows of the moves table for a tree of up to size moves,
+    with ids from first_id, parents before their children
+
+    params:
+        reviewed: share of the moves with a supermemo two state
+        due: share of the reviewed moves due for review now
+    """
+    rng = random.Random(seed)
+    now = datetime.now()
+    rows = []
+    by_id = {}
+    level = [(chess.Board(), None)]
+    for _ in range(depth):
+        next_level = []
+        for board, parent_id in level:
+            if len(rows) == size:
+                break
+            ours = (board.turn == chess.WHITE) == (perspective == 'w')
+            legal = list(board.legal_moves)
+            count = book_branching if ours else rng.randint(1, branching)
+            for move in rng.sample(legal, min(count, len(legal))):
+                if len(rows) == size:
+                    break
+                san = board.san(move)
+                board.push(move)
+                fen = board.fen()
+                row = {
+                    'id': first_id + len(rows),
+                    'user_id': user_id,
+                    'parent_id': parent_id,
+                    'fen': fen,
+                    'san': san,
+                    'perspective': perspective,
+                    'side_to_move': 'w' if board.turn == chess.WHITE else 'b',
+                    'position_key': signed(position_key(fen)),
+                    'book_move': ours,
+                    'last_review': None,
+                    'next_review': None,
+                    'repetitions': None,
+                    'easiness': None,
+                    'interval': None,
+                    'child_count': 0,
+                    'child_easiness_sum': 0.0,
+                    'rated_child_count': 0,
+                }
+                if rng.random() < reviewed:
+                    _review(row, rng, now, rng.random() < due)
+                rows.append(row)
+                by_id[row['id']] = row
+                next_level.append((board.copy(stack=False), row['id']))
+                board.pop()
+        level = next_level
+        if not level or len(rows) == size:
+            break
+
+    for row in rows:
+        parent = by_id.get(row['parent_id'])
+        if parent is not None:
+            parent['child_count'] += 1
+            if row['easiness'] is not None:
+                parent['child_easiness_sum'] += row['easiness']
+                parent['rated_child_count'] += 1
+    return rows
+
+
+def _review(row, rng, now, is_due):
+    repetitions = rng.randint(1, 6)
+    interval = min(int(6 * 2.5 ** (repetitions - 2)), 365) if repetitions > 1 \
+        else 1
+    if is_due:
+        next_review = now - timedelta(days=rng.uniform(0, interval))
+    else:
+        next_review = now + timedelta(days=rng.uniform(0.1, interval))
+    row.update(
+        repetitions=repetitions,
+        easiness=round(rng.uniform(1.3, 2.8), 2),
+        interval=interval,
+        last_review=next_review - timedelta(days=interval),
+        next_review=next_review,
+    )
+
+
+def create_user(username):
+    user = User(username=username, password='', roles='')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def insert_repertoire(rows):
+    """inserts generated rows in chunked bulk statements"""
+    table = Move.__table__
+    for chunk in chunked(rows, BULK_CHUNK_SIZE):
+        db.session.execute(table.insert(), chunk)
+    db.session.commit()
+
+
+def add_repertoire(user_id, size, **options):
+    """generates and inserts a repertoire for each color, of size moves in all"""
+    first_id = (db.session.query(db.func.max(Move.id)).scalar() or 0) + 1
+    white = generate_repertoire(user_id, size - size // 2, 'w',
+                                first_id=first_id, **options)
+    black = generate_repertoire(user_id, size // 2, 'b',
+                                first_id=first_id + len(white), **options)
+    insert_repertoire(white + black)
+    return len(white) + len(black)
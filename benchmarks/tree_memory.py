@@ -0,0 +1,53 @@
+"""
+Compares the memory used by a user's repertoire loaded as Move instances
+with the same repertoire loaded as a RepertoireTree.
+
+    python benchmarks/tree_memory.py [--sizes 10000 100000]
+
+Synthetic repertoires are written into an in-memory database, and
+measured with tracemalloc.
+"""
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db  # noqa: E402
+from app.models import Move  # noqa: E402
+from synthetic import add_repertoire, create_user  # noqa: E402
+
+
+def measure(load):
+    gc.collect()
+    tracemalloc.start()
+    result = load()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    db.session.expunge_all()
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    args = parser.parse_args()
+
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        print(f'{"moves":>8} {"orm bytes/move":>15} {"tree bytes/move":>16} {"ratio":>6}')
+        for n, size in enumerate(args.sizes):
+            user = create_user(f'bench{n}')
+            size = add_repertoire(user.id, size)
+            orm = measure(lambda: Move.query.filter_by(user_id=user.id).all())
+            tree = measure(lambda: Move.load_tree(user.id))
+            print(f'{size:>8} {orm / size:>15.0f} {tree / size:>16.0f} '
+                  f'{orm / tree:>6.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -13,12 +13,61 @@ class Config:
     APP_ADMIN_MAIL = os.environ.get('APP_ADMIN_MAIL')
     SSL_REDIRECT = False
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    SQLALCHEMY_RECORD_QUERIES = True
-    SLOW_DB_QUERY_TIME = 0.5
+    # queries are counted and timed by app/metrics.py, this keeps a copy
+    # of each for get_debug_queries()
+    SQLALCHEMY_RECORD_QUERIES = os.environ.get('SQLALCHEMY_RECORD_QUERIES', 'false').lower() in ['true', 'on', '1']
+    # queries taking longer, in seconds, are logged
+    SLOW_DB_QUERY_TIME = float(os.environ.get('SLOW_DB_QUERY_TIME', '0.5'))
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() in ['true', 'on', '1']
+    # DEBUG, INFO, WARNING, ERROR, CRITICAL or OFF
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+    # read only queries go to this database when set, see app/replica.py
+    REPLICA_DATABASE_URL = os.environ.get('REPLICA_DATABASE_URL')
+    SQLALCHEMY_BINDS = {'replica': REPLICA_DATABASE_URL} \
+        if REPLICA_DATABASE_URL else {}
     JWT_ACCESS_LIFESPAN = {"hours": 24}
     JWT_REFRESH_LIFESPAN = {"days": 30}
     # default rate limits on routes
     RATELIMIT_DEFAULT = '100 per minute'
+    # memory:// counts per worker, sqlite:////path/to/limits.sqlite counts
+    # across the workers of a host, see app/ratelimit.py
+    RATELIMIT_STORAGE_URL = os.environ.get('RATELIMIT_STORAGE_URL', 'memory://')
+    # fixed-window, or moving-window to count hits over a sliding window
+    RATELIMIT_STRATEGY = os.environ.get('RATELIMIT_STRATEGY', 'fixed-window')
+    # longest interval in days between two reviews of a move, read by
+    # scores and by flask reschedule
+    SM_TWO_MAX_INTERVAL = int(os.environ.get('SM_TWO_MAX_INTERVAL', '365'))
+    # in-process cache of the trees of active users, used by play mode
+    REPERTOIRE_CACHE_ENABLED = os.environ.get('REPERTOIRE_CACHE_ENABLED', 'false').lower() in ['true', 'on', '1']
+    REPERTOIRE_CACHE_MAX_NODES = int(os.environ.get('REPERTOIRE_CACHE_MAX_NODES', '200000'))
+    # seconds before a cached tree is reloaded, bounds staleness across workers
+    REPERTOIRE_CACHE_TTL = float(os.environ['REPERTOIRE_CACHE_TTL']) \
+        if os.environ.get('REPERTOIRE_CACHE_TTL') else None
+    # in-process cache of the users authenticated requests belong to. a
+    # deactivated user is only dropped from other workers after the TTL
+    IDENTITY_CACHE_ENABLED = os.environ.get('IDENTITY_CACHE_ENABLED', 'true').lower() in ['true', 'on', '1']
+    IDENTITY_CACHE_MAX_USERS = int(os.environ.get('IDENTITY_CACHE_MAX_USERS', '10000'))
+    IDENTITY_CACHE_TTL = float(os.environ.get('IDENTITY_CACHE_TTL', '60'))
+    # in-process cache of review forecasts, dropped by the user's next write.
+    # other workers keep serving their copy until the TTL
+    FORECAST_CACHE_ENABLED = os.environ.get('FORECAST_CACHE_ENABLED', 'false').lower() in ['true', 'on', '1']
+    FORECAST_CACHE_MAX_USERS = int(os.environ.get('FORECAST_CACHE_MAX_USERS', '10000'))
+    # seconds before a cached forecast is recomputed, bounds staleness across workers
+    FORECAST_CACHE_TTL = float(os.environ.get('FORECAST_CACHE_TTL', '60'))
+    # /study takes moves from queues built ahead of the day, see StudyQueue
+    STUDY_QUEUE_ENABLED = os.environ.get('STUDY_QUEUE_ENABLED', 'false').lower() in ['true', 'on', '1']
+    # sqlite settings for concurrent users, see app/sqlite.py
+    SQLITE_PERFORMANCE_MODE = os.environ.get('SQLITE_PERFORMANCE_MODE', 'false').lower() in ['true', 'on', '1']
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'wal')
+    # normal is safe with wal, a crash only loses the last commits
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'normal')
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', '5000'))
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+    SQLITE_WRITE_RETRIES = int(os.environ.get('SQLITE_WRITE_RETRIES', '5'))
+    SQLITE_WRITE_RETRY_DELAY = float(os.environ.get('SQLITE_WRITE_RETRY_DELAY', '0.05'))
+    # position statistics of masters games, built by flask build-masters-index
+    MASTERS_INDEX_PATH = os.environ.get('MASTERS_INDEX_PATH') or \
+        os.path.join(basedir, 'masters.idx')
 
 
     @staticmethod
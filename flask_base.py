@@ -1,6 +1,7 @@
 import os
+import click
 from app import create_app, db
-from app.models import User, Move
+from app.models import User, Move, StudyQueue
 from dotenv import load_dotenv
 
 dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
@@ -9,7 +10,8 @@ if os.path.exists(dotenv_path):
 else:
     print('Unable to load environmental variables')
 
-app = create_app(os.getenv('FLASK_CONFIG') or 'default')
+config_name = os.getenv('FLASK_CONFIG') or 'default'
+app = create_app(config_name)
 
 @app.cli.command()
 def test():
@@ -19,8 +21,131 @@ def test():
     unittest.TextTestRunner(verbosity=2).run(tests)
 
 
+@app.cli.command()
+@click.option('--user', 'username', default=None,
+              help='Only reschedule this user\'s moves.')
+@click.option('--chunk-size', default=10000, show_default=True,
+              help='Number of moves updated per transaction.')
+def reschedule(username, chunk_size):
+    """Recompute review dates of studied moves with SM_TWO_MAX_INTERVAL"""
+    user_id = None
+    if username:
+        user = User.lookup(username)
+        if not user:
+            raise click.BadParameter(f'no user named {username}')
+        user_id = user.id
+    count = Move.reschedule(user_id, chunk_size)
+    click.echo(f'Rescheduled {count} moves')
+
+
+@app.cli.command('import-moves')
+@click.argument('username')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--perspective', type=click.Choice(['white', 'black']),
+              default='white', show_default=True)
+@click.option('--parent-id', default=None, type=int,
+              help='Add the moves under this move.')
+def import_moves(username, path, perspective, parent_id):
+    """Import a PGN file, or a JSON tree of moves, into a user's book"""
+    import json
+    from time import perf_counter
+    from app.utils.pgn import pgn_to_tree
+
+    user = User.lookup(username)
+    if not user:
+        raise click.BadParameter(f'no user named {username}')
+    parent = None
+    if parent_id is not None:
+        parent = Move.query.filter_by(id=parent_id, user_id=user.id).first()
+        if not parent:
+            raise click.BadParameter(f'{username} has no move {parent_id}')
+    start = perf_counter()
+    with open(path) as f:
+        try:
+            if path.endswith('.json'):
+                moves = json.load(f)
+            else:
+                moves = pgn_to_tree(f.read(), parent.fen if parent else None)
+            counts = Move.import_tree(user.id, perspective, moves, parent_id)
+        except ValueError as e:
+            raise click.ClickException(f'{path}: {e}')
+    click.echo(f"Created {counts['created']} moves, "
+               f"{counts['existing']} already in the book, "
+               f"in {perf_counter() - start:.2f}s")
+
+
+@app.cli.command('deactivate-user')
+@click.argument('username')
+def deactivate_user(username):
+    """Stop a user from logging in"""
+    user = User.lookup(username)
+    if not user:
+        raise click.BadParameter(f'no user named {username}')
+    user.deactivate()
+    click.echo(f'Deactivated {username}')
+
+
+@app.cli.command('build-masters-index')
+@click.argument('paths', nargs=-1, required=True,
+                type=click.Path(exists=True, dir_okay=False))
+@click.option('--output', default=None,
+              help='Index file, MASTERS_INDEX_PATH by default.')
+@click.option('--processes', default=None, type=int,
+              help='Worker processes, one per cpu by default.')
+@click.option('--chunk-games', default=1000, show_default=True,
+              help='Number of games counted per task.')
+@click.option('--max-plies', default=40, show_default=True,
+              help='Number of plies counted per game.')
+def build_masters_index(paths, output, processes, chunk_games, max_plies):
+    """Count the games of PGN files into the masters index"""
+    from app.utils.ingest import IndexBuilder
+
+    builder = IndexBuilder(
+        output or app.config['MASTERS_INDEX_PATH'],
+        processes=processes,
+        chunk_games=chunk_games,
+        max_plies=max_plies,
+        report=click.echo
+    )
+    builder.build(paths)
+
+
+@app.cli.command('build-study-queues')
+@click.option('--processes', default=None, type=int,
+              help='Worker processes, one per cpu by default.')
+@click.option('--chunk-users', default=100, show_default=True,
+              help='Number of users computed per task.')
+def build_study_queues(processes, chunk_users):
+    """Compute today's study queue of every active user"""
+    from app.utils.study_queues import QueueBuilder
+
+    builder = QueueBuilder(
+        config_name,
+        processes=processes,
+        chunk_users=chunk_users,
+        report=click.echo
+    )
+    builder.build()
+
+
+@app.cli.command()
+@click.option('--interval', default=None, type=float,
+              help='Copy again every so many seconds, instead of once.')
+def replicate(interval):
+    """Copy the SQLite database into its replica"""
+    from app.replica import REPLICA_BIND, replicate
+
+    if REPLICA_BIND not in app.config['SQLALCHEMY_BINDS']:
+        raise click.UsageError('REPLICA_DATABASE_URL is not set')
+    try:
+        replicate(db, app, interval)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    click.echo('Replica up to date')
+
+
 @app.shell_context_processor
 def make_shell_context():
     return dict(
-        db=db, User=User, Move=Move
+        db=db, User=User, Move=Move, StudyQueue=StudyQueue
     )
\ No newline at end of file
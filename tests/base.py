@@ -0,0 +1,150 @@
+import random
+import unittest
+from contextlib import contextmanager
+
+import chess
+from sqlalchemy import event
+
+from app import (
+    create_app,
+    db,
+    forecast_cache,
+    guard,
+    identity_cache,
+    limiter,
+    repertoire_cache
+)
+from app.models import User, Move
+
+# repertoire sizes tests with query budgets run on, a budget which holds
+# for all of them doesn't grow with the number of moves
+REPERTOIRE_SIZES = (10, 100, 1000)
+
+_repertoires = {}
+
+
+def synthetic_repertoire(size, branching=3, seed=0):
+    """
+    returns a tree of size legal moves for Move.import_tree, the same
+    tree for the same arguments
+    """
+    key = (size, branching, seed)
+    if key in _repertoires:
+        return _repertoires[key]
+    rng = random.Random(seed)
+    roots = []
+    level = [(chess.Board(), roots)]
+    count = 0
+    while level and count < size:
+        next_level = []
+        for board, children in level:
+            legal = list(board.legal_moves)
+            for move in rng.sample(legal, min(branching, len(legal))):
+                if count == size:
+                    break
+                san = board.san(move)
+                board.push(move)
+                child = {'san': san, 'fen': board.fen(), 'children': []}
+                next_level.append((board.copy(stack=False), child['children']))
+                board.pop()
+                children.append(child)
+                count += 1
+        level = next_level
+    _repertoires[key] = roots
+    return roots
+
+
+class QueryCounter:
+    """statements run on an engine while counting"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._count)
+
+    def __len__(self):
+        return len(self.statements)
+
+
+class BaseTestCase(unittest.TestCase):
+    """An app on an empty in-memory database, with one user"""
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        limiter.enabled = False
+        db.create_all()
+        self.user = User(username='test', password=guard.hash_password('test'))
+        db.session.add(self.user)
+        db.session.commit()
+        self.token = guard.encode_jwt_token(self.user)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        repertoire_cache.clear()
+        identity_cache.clear()
+        forecast_cache.clear()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def post(self, url, json):
+        return self.client.post('/api' + url, json=json, headers={
+            'Authorization': 'Bearer ' + self.token
+        })
+
+    def get(self, url):
+        return self.client.get('/api' + url, headers={
+            'Authorization': 'Bearer ' + self.token
+        })
+
+    def add_repertoire(self, size, perspective='w'):
+        Move.import_tree(self.user.id, perspective, synthetic_repertoire(size))
+
+    def reset_database(self):
+        """drops all moves, keeping the user"""
+        repertoire_cache.clear()
+        forecast_cache.clear()
+        Move.query.delete()
+        db.session.commit()
+
+    @contextmanager
+    def assertMaxQueries(self, budget):
+        """fails if the block runs more than budget SQL statements"""
+        # a session left open would lazy load objects of the last request
+        db.session.expire_all()
+        with QueryCounter(db.engine) as counter:
+            yield counter
+        if len(counter) > budget:
+            self.fail(f'{len(counter)} queries, budget is {budget}, the first:\n'
+                      + '\n'.join(counter.statements[:budget + 5]))
+
+    def assertQueryBudget(self, budget, request, setup=None):
+        """
+        checks that request() runs within budget queries on repertoires
+        of every size in REPERTOIRE_SIZES. setup(), if given, runs
+        before counting and its result is passed to request
+        """
+        for size in REPERTOIRE_SIZES:
+            with self.subTest(size=size):
+                self.reset_database()
+                self.add_repertoire(size, 'w')
+                self.add_repertoire(size, 'b')
+                args = (setup(),) if setup else ()
+                # the current user is resolved from the identity cache
+                User.identify(self.user.id)
+                with self.assertMaxQueries(budget):
+                    response = request(*args)
+                    # streamed responses run their queries while read
+                    response.get_data()
+                self.assertLess(response.status_code, 400, response.data)
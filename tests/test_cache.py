@@ -0,0 +1,121 @@
+import unittest
+from datetime import datetime
+from threading import Event, Thread
+
+from app.cache import ForecastCache, IdentityCache, RepertoireCache
+from app.utils.tree import RepertoireTree
+
+
+class Tree(list):
+    pass
+
+
+class CacheFillTestCase(unittest.TestCase):
+    """A value loaded while the key was written isn't stored"""
+
+    def setUp(self):
+        self.repertoires = RepertoireCache()
+        self.repertoires.max_nodes = 100
+        self.identities = IdentityCache()
+        self.identities.max_users = 100
+        self.identities.ttl = 60
+        self.forecasts = ForecastCache()
+        self.forecasts.max_users = 100
+
+    def test_repertoire_write_while_loading(self):
+        for write in (lambda: self.repertoires.invalidate(1),
+                      lambda: self.repertoires.update(1, lambda tree: None),
+                      self.repertoires.clear):
+            with self.subTest(write=write):
+                def loader(user_id):
+                    write()
+                    return Tree(['stale'])
+                self.assertEqual(self.repertoires.get(1, loader), ['stale'])
+                tree = self.repertoires.get(1, lambda user_id: Tree(['fresh']))
+                self.assertEqual(tree, ['fresh'])
+                self.repertoires.clear()
+
+    def test_repertoire_other_user_written(self):
+        def loader(user_id):
+            self.repertoires.invalidate(2)
+            return Tree(['tree'])
+        self.repertoires.get(1, loader)
+        self.assertEqual(self.repertoires.get(1, None), ['tree'])
+
+    def test_identity_invalidated_while_loading(self):
+        def loader(identity):
+            self.identities.invalidate(1)
+            return 'active'
+        self.assertEqual(self.identities.get(1, loader), 'active')
+        self.assertEqual(self.identities.get(1, lambda i: 'inactive'),
+                         'inactive')
+
+    def test_forecast_invalidated_while_loading(self):
+        def loader():
+            self.forecasts.invalidate(1)
+            return 'stale'
+        self.assertEqual(self.forecasts.get(1, 'key', loader), 'stale')
+        self.assertEqual(self.forecasts.get(1, 'key', lambda: 'fresh'),
+                         'fresh')
+        self.assertEqual(self.forecasts.get(1, 'key', None), 'fresh')
+
+
+class TreeWriteTestCase(unittest.TestCase):
+    """Cached trees stay consistent while read and written"""
+
+    def setUp(self):
+        self.tree = RepertoireTree()
+        for i in range(1, 11):
+            self.add(i, parent_id=i - 1 or None)
+
+    def add(self, id, parent_id=None, perspective='w'):
+        self.tree.add(id=id, parent_id=parent_id, fen=f'fen{id}', san='e4',
+                      perspective=perspective, book_move=True,
+                      side_to_move='b', next_review=datetime(2020, 1, 1))
+
+    def assertColumnsAligned(self):
+        tree = self.tree
+        lengths = {len(column) for column in (
+            tree.ids, tree.parent, tree.first_child, tree.next_sibling,
+            tree.easiness, tree.next_review, tree.book_move,
+            tree.perspective, tree.side_to_move, tree.text_start,
+            tree._last_child)}
+        self.assertEqual(len(lengths), 1)
+
+    def test_add_fails_whole(self):
+        with self.assertRaises(TypeError):
+            self.add(11, parent_id=10, perspective=None)
+        self.assertColumnsAligned()
+        self.add(11, parent_id=10)
+        self.assertEqual(self.tree.node(11).fen, 'fen11')
+
+    def test_failed_update_drops_tree(self):
+        cache = RepertoireCache()
+        cache.max_nodes = 100
+        cache.get(1, lambda user_id: self.tree)
+        cache.update(1, lambda tree: self.add(11, parent_id=10,
+                                              perspective=None))
+        self.assertEqual(cache.stats()['users'], 0)
+
+    def test_read_while_adding(self):
+        errors = []
+        done = Event()
+
+        def read():
+            while not done.is_set():
+                try:
+                    self.tree.due_moves(5)
+                except Exception as e:
+                    errors.append(e)
+                    return
+
+        reader = Thread(target=read)
+        reader.start()
+        try:
+            for i in range(11, 20000):
+                self.add(i, parent_id=i - 1)
+        finally:
+            done.set()
+            reader.join()
+        self.assertEqual(errors, [])
+        self.assertColumnsAligned()
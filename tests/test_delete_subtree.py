@@ -0,0 +1,114 @@
+from unittest import mock
+
+from app import db, repertoire_cache
+from app.models import Move, User
+from base import BaseTestCase
+
+
+class DeleteSubtreeTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.add_repertoire(300, 'w')
+        self.add_repertoire(300, 'b')
+
+    def subtree(self, move_id):
+        ids = [move_id]
+        for i in ids:
+            ids.extend(m.id for m in Move.query.filter_by(parent_id=i))
+        return set(ids)
+
+    def inner_move(self):
+        """a move of the second ply with descendants"""
+        return Move.query \
+                    .filter_by(user_id=self.user.id, perspective='w') \
+                    .filter(Move.parent_id.isnot(None)) \
+                    .filter(Move.child_count > 0) \
+                    .order_by(Move.id) \
+                    .first()
+
+    def test_deletes_descendants(self):
+        move = self.inner_move()
+        parent_id = move.parent_id
+        subtree = self.subtree(move.id)
+        self.assertGreater(len(subtree), 10)
+        count = Move.query.count()
+        r = self.post('/del-move', {'move_id': move.id, 'recursive': True})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.get_json()['deleted'], len(subtree))
+        self.assertEqual(Move.query.count(), count - len(subtree))
+        self.assertEqual(
+            Move.query.filter(Move.id.in_(subtree)).count(), 0)
+
+        parent = Move.query.get(parent_id)
+        children = parent.children
+        self.assertEqual(parent.child_count, len(children))
+        self.assertEqual(parent.rated_child_count,
+                         sum(m.easiness is not None for m in children))
+
+    def test_parent_easiness(self):
+        move = self.inner_move()
+        sibling_scores = [[m.id, 4] for m in move.parent.children]
+        self.post('/scores', {'scores': sibling_scores})
+        parent_id = move.parent_id
+        self.post('/del-move', {'move_id': move.id, 'recursive': True})
+        parent = Move.query.get(parent_id)
+        self.assertAlmostEqual(parent.child_easiness_sum,
+                               sum(m.easiness for m in parent.children))
+        self.assertEqual(parent.rated_child_count, len(parent.children))
+
+    def test_cached_tree(self):
+        repertoire_cache.enabled = True
+        self.addCleanup(setattr, repertoire_cache, 'enabled', False)
+        tree = repertoire_cache.get(self.user.id, Move.load_tree)
+        move = self.inner_move()
+        move_id, parent_id = move.id, move.parent_id
+        subtree = self.subtree(move_id)
+        Move.delete_subtree(self.user.id, move_id)
+        self.assertIs(repertoire_cache.get(self.user.id, Move.load_tree), tree)
+        self.assertEqual(len(tree), Move.query.count())
+        for move_id in subtree:
+            self.assertNotIn(move_id, tree)
+        self.assertEqual(
+            [m.id for m in tree.children(parent_id)],
+            [m.id for m in Move.query.get(parent_id).children])
+
+    def test_first_move(self):
+        root = Move.query \
+                    .filter_by(user_id=self.user.id, perspective='b') \
+                    .filter_by(parent_id=None) \
+                    .first()
+        version = User.get_repertoire_version(self.user.id)
+        deleted = Move.delete_subtree(self.user.id, root.id)
+        self.assertEqual(deleted, 300 - Move.query.filter_by(perspective='b').count())
+        self.assertEqual(User.get_repertoire_version(self.user.id), version + 1)
+
+    def test_other_user(self):
+        other = User(username='other', password='')
+        db.session.add(other)
+        db.session.commit()
+        move = self.inner_move()
+        count = Move.query.count()
+        with self.assertRaises(Exception):
+            Move.delete_subtree(other.id, move.id)
+        self.assertEqual(Move.query.count(), count)
+
+    def test_failure_after_delete(self):
+        move = self.inner_move()
+        move_id, parent_id = move.id, move.parent_id
+        count = Move.query.count()
+        parent = Move.query.get(parent_id)
+        aggregates = (parent.child_count, parent.rated_child_count)
+        version = User.get_repertoire_version(self.user.id)
+        db.session.commit()
+        # the debug log runs right after the delete statement
+        with mock.patch('app.models.logger.debug',
+                        side_effect=RuntimeError('injected')):
+            with self.assertRaises(RuntimeError):
+                Move.delete_subtree(self.user.id, move_id)
+        db.session.rollback()
+        self.assertEqual(Move.query.count(), count)
+        parent = Move.query.get(parent_id)
+        self.assertEqual((parent.child_count, parent.rated_child_count),
+                         aggregates)
+        self.assertEqual(User.get_repertoire_version(self.user.id), version)
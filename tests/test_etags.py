@@ -0,0 +1,86 @@
+from app.models import Move, User
+from base import BaseTestCase
+
+
+class ExploreETagTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.add_repertoire(50, 'w')
+        self.leaf = Move.query \
+                        .filter_by(user_id=self.user.id, child_count=0) \
+                        .first()
+
+    def explore(self, etag=None, query='color=w'):
+        headers = {'Authorization': 'Bearer ' + self.token}
+        if etag:
+            headers['If-None-Match'] = etag
+        return self.client.get('/api/explore?' + query, headers=headers)
+
+    def test_get_matches_post(self):
+        for query, body in (
+                ('color=w', {'color': 'w'}),
+                ('color=w&depth=3', {'color': 'w', 'depth': 3}),
+                (f'last_move_id={self.leaf.parent_id}',
+                    {'last_move_id': self.leaf.parent_id})):
+            r = self.explore(query=query)
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(r.get_json(),
+                             self.post('/explore', body).get_json())
+
+    def test_malformed_parameters(self):
+        for query in ('color=w&depth=x', 'color=w&depth=2&max_nodes=x',
+                      'last_move_id=x', 'color=w&depth=1.5'):
+            with self.subTest(query=query):
+                self.assertEqual(self.explore(query=query).status_code, 400)
+        self.assertEqual(
+            self.post('/explore', {'last_move_id': [1]}).status_code, 400)
+
+    def test_max_nodes_lower_bound(self):
+        for max_nodes in (0, -5):
+            with self.subTest(max_nodes=max_nodes):
+                r = self.explore(
+                    query=f'color=w&depth=3&max_nodes={max_nodes}')
+                self.assertEqual(r.status_code, 200)
+                # the first ply is always whole, deeper ones don't fit
+                for move in r.get_json():
+                    if move['child_count']:
+                        self.assertNotIn('children', move)
+
+    def test_not_modified(self):
+        r = self.explore()
+        etag = r.headers['ETag']
+        self.assertIn('no-cache', r.headers['Cache-Control'])
+        r = self.explore(etag)
+        self.assertEqual(r.status_code, 304)
+        self.assertEqual(r.headers['ETag'], etag)
+        self.assertEqual(r.get_data(), b'')
+
+    def test_scores_keep_etag(self):
+        etag = self.explore().headers['ETag']
+        self.post('/scores', {'scores': [[self.leaf.id, 4]]})
+        self.assertEqual(self.explore(etag).status_code, 304)
+
+    def test_writes_change_etag(self):
+        version = User.get_repertoire_version(self.user.id)
+        etag = self.explore().headers['ETag']
+        r = self.post('/add-move', {
+            'parent_id': self.leaf.id, 'fen': self.leaf.fen, 'san': 'Ke2',
+            'perspective': 'w'})
+        self.assertEqual(r.status_code, 200)
+        r = self.explore(etag)
+        self.assertEqual(r.status_code, 200)
+        etag = r.headers['ETag']
+
+        new_move = Move.query.order_by(Move.id.desc()).first()
+        self.post('/del-move', {'move_id': new_move.id})
+        self.assertEqual(self.explore(etag).status_code, 200)
+        self.assertEqual(User.get_repertoire_version(self.user.id), version + 2)
+
+    def test_import_changes_etag(self):
+        etag = self.explore().headers['ETag']
+        # moves already in the book don't change it
+        self.add_repertoire(50, 'w')
+        self.assertEqual(self.explore(etag).status_code, 304)
+        self.add_repertoire(50, 'b')
+        self.assertEqual(self.explore(etag).status_code, 200)
@@ -0,0 +1,39 @@
+from app.models import Move
+from base import BaseTestCase
+
+
+class ExportTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.add_repertoire(300, 'w')
+        self.add_repertoire(300, 'b')
+
+    def test_subtree(self):
+        move = Move.query \
+                    .filter_by(user_id=self.user.id, perspective='w') \
+                    .filter(Move.parent_id.isnot(None)) \
+                    .filter(Move.child_count > 0) \
+                    .order_by(Move.id.desc()) \
+                    .first()
+        rows = list(Move.export_moves(self.user.id, move.id))
+        self.assertEqual(rows[0].id, move.id)
+        self.assertEqual(rows[0].rank, 1)
+        seen = {move.id}
+        for row in rows[1:]:
+            # parents come first, siblings are ranked by id
+            self.assertIn(row.parent_id, seen)
+            seen.add(row.id)
+            siblings = [m.id for m in Move.query
+                        .filter_by(parent_id=row.parent_id)
+                        .order_by(Move.id)]
+            self.assertEqual(row.rank, siblings.index(row.id) + 1)
+        descendants = [move.id]
+        for move_id in descendants:
+            descendants.extend(
+                m.id for m in Move.query.filter_by(parent_id=move_id))
+        self.assertEqual(seen, set(descendants))
+
+    def test_other_users_subtree(self):
+        move = Move.query.filter_by(user_id=self.user.id).first()
+        self.assertEqual(list(Move.export_moves(self.user.id + 1, move.id)), [])
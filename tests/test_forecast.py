@@ -0,0 +1,55 @@
+from datetime import date, datetime, timedelta
+
+from app import db, forecast_cache
+from app.models import Move, User
+from base import BaseTestCase
+
+
+class ForecastTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.add_repertoire(100, 'w')
+        self.book = [m.id for m in Move.query
+                        .filter_by(user_id=self.user.id, book_move=True)
+                        .order_by(Move.id)]
+
+    def schedule(self, days):
+        """gives the first book moves a next review in days from now"""
+        now = datetime.now()
+        for move_id, offset in zip(self.book, days):
+            Move.query.get(move_id).next_review = now + timedelta(days=offset)
+        db.session.commit()
+        forecast_cache.clear()
+
+    def forecast(self, **options):
+        r = self.post('/forecast', options)
+        self.assertEqual(r.status_code, 200)
+        return r.get_json()
+
+    def test_buckets(self):
+        self.schedule([-3, -1, 0, 1, 1, 6, 40])
+        forecast = self.forecast(days=7)
+        self.assertEqual(forecast['start'], date.today().isoformat())
+        self.assertEqual(forecast['days'], [1, 2, 0, 0, 0, 0, 1])
+        self.assertEqual(forecast['overdue'], 2)
+        self.assertEqual(forecast['later'], 1)
+        self.assertEqual(forecast['new'], len(self.book) - 7)
+
+    def test_color(self):
+        self.assertEqual(self.forecast(color='white')['new'], len(self.book))
+        self.assertEqual(self.forecast(color='black')['new'], 0)
+
+    def test_cached_until_scores(self):
+        forecast_cache.enabled = True
+        self.addCleanup(setattr, forecast_cache, 'enabled', False)
+        # the current user comes from the identity cache
+        User.identify(self.user.id)
+        with self.assertMaxQueries(1):
+            first = self.forecast()
+        with self.assertMaxQueries(0):
+            self.assertEqual(self.forecast(), first)
+        self.post('/scores', {'scores': [[self.book[0], 4]]})
+        forecast = self.forecast()
+        self.assertEqual(forecast['new'], first['new'] - 1)
+        self.assertEqual(sum(forecast['days']), 1)
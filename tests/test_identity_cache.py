@@ -0,0 +1,43 @@
+import pendulum
+from flask_praetorian.exceptions import InvalidUserError
+
+from app import guard, identity_cache
+from app.models import User
+from base import BaseTestCase
+
+
+class IdentityCacheTestCase(BaseTestCase):
+
+    def count_queries(self):
+        with self.assertMaxQueries(100) as counter:
+            response = self.post('/explore', {'color': 'w'})
+        self.assertEqual(response.status_code, 200)
+        return len(counter)
+
+    def test_cache_removes_user_query(self):
+        identity_cache.enabled = False
+        self.addCleanup(setattr, identity_cache, 'enabled', True)
+        uncached = self.count_queries()
+        identity_cache.enabled = True
+        self.count_queries()
+        hits = identity_cache.hits
+        self.assertEqual(self.count_queries(), uncached - 1)
+        self.assertEqual(identity_cache.hits, hits + 1)
+
+    def test_identity(self):
+        identity = User.identify(self.user.id)
+        self.assertEqual(identity.id, self.user.id)
+        self.assertEqual(identity.identity, self.user.id)
+        self.assertEqual(identity.rolenames, [])
+        self.assertTrue(identity.is_valid())
+        self.assertIsNone(User.identify(self.user.id + 1))
+
+    def test_deactivate_invalidates(self):
+        # an expired access token, which may be refreshed
+        token = guard.encode_jwt_token(
+            self.user, override_access_lifespan=pendulum.duration(seconds=-1))
+        self.assertTrue(User.identify(self.user.id).is_valid())
+        self.user.deactivate()
+        self.assertFalse(User.identify(self.user.id).is_valid())
+        with self.assertRaises(InvalidUserError):
+            guard.refresh_jwt_token(token)
@@ -0,0 +1,51 @@
+from app import db
+from app.models import Move, User
+from base import BaseTestCase
+
+E4 = 'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1'
+E5 = 'rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2'
+
+
+class ImportValidationTestCase(BaseTestCase):
+    """Malformed trees and foreign parents are refused before writing"""
+
+    def import_moves(self, **body):
+        return self.post('/import', dict({'perspective': 'w'}, **body))
+
+    def test_malformed_trees(self):
+        good = {'san': 'e5', 'fen': E5}
+        for moves in (
+                {'san': 'e4', 'fen': E4},
+                [{'san': 'e4'}],
+                [{'fen': E4}],
+                [{'san': 'e4', 'fen': 'rnbqkbnr/pppppppp/8/8/4P3/8 b'}],
+                [{'san': 'e4', 'fen': 'xxx b KQkq -'}],
+                [{'san': 4, 'fen': E4}],
+                ['e4'],
+                [{'san': 'e4', 'fen': E4, 'children': good}],
+                [{'san': 'e4', 'fen': E4, 'children': [good, None]}]):
+            with self.subTest(moves=moves):
+                r = self.import_moves(moves=moves)
+                self.assertEqual(r.status_code, 400)
+                self.assertEqual(Move.query.count(), 0)
+
+    def test_parent(self):
+        other = User(username='other', password='')
+        db.session.add(other)
+        db.session.commit()
+        Move.import_tree(other.id, 'w', [{'san': 'e4', 'fen': E4}])
+        foreign_id = Move.query.first().id
+        for parent_id in (foreign_id, foreign_id + 100):
+            with self.subTest(parent_id=parent_id):
+                r = self.import_moves(parent_id=parent_id,
+                                      moves=[{'san': 'e5', 'fen': E5}])
+                self.assertEqual(r.status_code, 404)
+                r = self.import_moves(parent_id=parent_id, pgn='1... e5')
+                self.assertEqual(r.status_code, 404)
+        self.assertEqual(Move.query.count(), 1)
+
+    def test_valid_tree(self):
+        r = self.import_moves(moves=[
+            {'san': 'e4', 'fen': E4, 'children': [{'san': 'e5', 'fen': E5}]}])
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.get_json()['created'], 2)
@@ -0,0 +1,67 @@
+import os
+import random
+import tempfile
+import unittest
+
+import chess
+
+from app.masters import write_index
+from app.utils import ingest
+from app.utils.ingest import board_key, merge_runs, read_run
+from app.utils.zobrist import position_key
+
+
+class BoardKeyTestCase(unittest.TestCase):
+    """board_key agrees with position_key of the board's fen"""
+
+    def test_random_games(self):
+        rng = random.Random(0)
+        for _ in range(100):
+            board = chess.Board()
+            while not board.is_game_over() and board.ply() < 80:
+                # whether the fen writes every en passant square or only
+                # the legal ones
+                for en_passant in ('legal', 'fen'):
+                    fen = board.fen(en_passant=en_passant)
+                    self.assertEqual(board_key(board), position_key(fen), fen)
+                # pawn pushes make more en passant squares
+                moves = list(board.legal_moves)
+                pushes = [m for m in moves
+                          if board.piece_type_at(m.from_square) == chess.PAWN]
+                board.push(rng.choice(pushes if pushes and rng.random() < 0.5
+                                      else moves))
+
+    def test_pinned_en_passant(self):
+        # exd6 would leave the white king in check from the rook
+        board = chess.Board('8/8/8/K2pP2r/8/8/8/7k w - d6 0 2')
+        self.assertIsNotNone(board.ep_square)
+        self.assertFalse(board.has_legal_en_passant())
+        self.assertEqual(board_key(board), position_key(board.fen()))
+        self.assertEqual(board_key(board),
+                         position_key(board.fen(en_passant='fen')))
+
+
+class MergeRunsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.work = directory.name
+        self.paths = []
+        for i in range(10):
+            path = os.path.join(self.work, f'{i}.run')
+            write_index(path, [(key, 1, 1, 0, i) for key in range(i, 20)])
+            self.paths.append(path)
+
+    def test_fan_in(self):
+        fan_in = ingest.MERGE_FAN_IN
+        ingest.MERGE_FAN_IN = 3
+        self.addCleanup(setattr, ingest, 'MERGE_FAN_IN', fan_in)
+        output = os.path.join(self.work, 'index')
+        merge_runs(self.paths, output, work=self.work, remove=False)
+        records = list(read_run(output))
+        self.assertEqual([r[0] for r in records], list(range(20)))
+        self.assertEqual(records[9][2:], (10, 0, 45))
+        # the inputs are kept, intermediate runs are gone
+        self.assertEqual(sorted(os.listdir(self.work)),
+                         sorted(['index'] + [f'{i}.run' for i in range(10)]))
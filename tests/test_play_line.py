@@ -0,0 +1,54 @@
+import random
+
+from app import db, repertoire_cache
+from app.models import Move
+from base import BaseTestCase, QueryCounter
+
+
+class PlayLineTestCase(BaseTestCase):
+    """Lines planned from the database match those of the cached tree"""
+
+    def setUp(self):
+        super().setUp()
+        self.add_repertoire(300, 'w')
+        self.add_repertoire(300, 'b')
+        rng = random.Random(0)
+        moves = [m.id for m in Move.query.filter_by(user_id=self.user.id)]
+        Move.add_study_sessions(
+            self.user.id, [(move_id, rng.randint(0, 5))
+                           for move_id in rng.sample(moves, 200)])
+        self.starts = [m.id for m in Move.query
+                           .filter_by(user_id=self.user.id)
+                           .filter(Move.child_count > 0)
+                           .order_by(Move.id)
+                           .limit(5)]
+
+    def lines(self, max_nodes):
+        return [Move.get_line(self.user.id, color=color, max_nodes=max_nodes)
+                for color in ('white', 'black')] + \
+            [Move.get_line(self.user.id, move_id=move_id, max_nodes=max_nodes)
+             for move_id in self.starts]
+
+    def test_matches_cached_tree(self):
+        for max_nodes in (1000, 40, 5, 1):
+            with self.subTest(max_nodes=max_nodes):
+                uncached = self.lines(max_nodes)
+                repertoire_cache.enabled = True
+                try:
+                    cached = self.lines(max_nodes)
+                finally:
+                    repertoire_cache.enabled = False
+                    repertoire_cache.clear()
+                self.assertEqual(uncached, cached)
+
+    def test_loads_only_the_plan(self):
+        self.add_repertoire(1000, 'w')
+        user_id = self.user.id
+        with QueryCounter(db.engine) as counter:
+            line = Move.get_line(user_id, color='white', max_nodes=10)
+        self.assertTrue(line['truncated'])
+        # first moves, then replies and the options after each reply for
+        # two plies, never the whole repertoire
+        self.assertEqual(len(counter), 5)
+        for statement in counter.statements:
+            self.assertIn('moves.parent_id I', statement)
@@ -0,0 +1,208 @@
+from datetime import date
+
+from app import repertoire_cache
+from app.models import Move, StudyQueue
+from base import BaseTestCase
+
+
+class QueryBudgetTestCase(BaseTestCase):
+    """
+    Endpoints run a fixed number of queries, whatever the size of the
+    repertoire. The current user comes from the identity cache.
+    """
+
+    def move_with_children(self):
+        return Move.query \
+                    .filter_by(user_id=self.user.id, perspective='w') \
+                    .filter(Move.child_count > 0) \
+                    .order_by(Move.id.desc()) \
+                    .first()
+
+    def leaf_move(self):
+        return Move.query \
+                    .filter_by(user_id=self.user.id, perspective='w') \
+                    .filter_by(child_count=0) \
+                    .order_by(Move.id.desc()) \
+                    .first()
+
+    def test_play_first_move(self):
+        self.assertQueryBudget(1, lambda: self.post(
+            '/play', {'first_move': True, 'color': 'white'}))
+        self.assertQueryBudget(2, lambda: self.post(
+            '/play', {'first_move': True, 'color': 'black'}))
+
+    def test_play_score(self):
+        self.assertQueryBudget(
+            7,
+            lambda move_id: self.post(
+                '/play', {'last_move_id': [move_id], 'score': 4}),
+            setup=lambda: self.move_with_children().id
+        )
+
+    def test_play_score_siblings(self):
+        def siblings():
+            parent_id = self.move_with_children().parent_id
+            return [m.id for m in Move.query.filter_by(parent_id=parent_id)]
+        self.assertQueryBudget(
+            7,
+            lambda move_ids: self.post(
+                '/play', {'last_move_id': move_ids, 'score': 1}),
+            setup=siblings
+        )
+
+    def test_play_line(self):
+        # two queries per ply of the plan, the largest repertoire has 7
+        self.assertQueryBudget(15, lambda: self.post(
+            '/play', {'first_move': True, 'color': 'black', 'line': True}))
+        self.assertQueryBudget(
+            20,
+            lambda move_id: self.post('/play', {
+                'last_move_id': [move_id], 'score': 4, 'line': True}),
+            setup=lambda: self.move_with_children().id
+        )
+
+    def test_play_cached(self):
+        repertoire_cache.enabled = True
+        self.addCleanup(setattr, repertoire_cache, 'enabled', False)
+
+        def warm_cache():
+            move_id = self.move_with_children().id
+            self.post('/play', {'last_move_id': [move_id]})
+            return move_id
+        self.assertQueryBudget(
+            5,
+            lambda move_id: self.post(
+                '/play', {'last_move_id': [move_id], 'score': 4}),
+            setup=warm_cache
+        )
+
+    def test_study(self):
+        self.assertQueryBudget(2, lambda: self.post('/study', {}))
+        self.assertQueryBudget(
+            6,
+            lambda move_id: self.post('/study', {
+                'last_move_id': [move_id], 'score': 3, 'color': 'white'}),
+            setup=lambda: self.move_with_children().id
+        )
+
+    def test_study_queue(self):
+        self.app.config['STUDY_QUEUE_ENABLED'] = True
+
+        def build_queue():
+            StudyQueue.store([StudyQueue.compute(self.user.id, date.today())])
+        # the queue, the position and the new head
+        self.assertQueryBudget(
+            3, lambda _: self.post('/study', {}), setup=build_queue)
+
+    def test_study_deck(self):
+        # the due moves, then their positions
+        self.assertQueryBudget(2, lambda: self.post('/study-deck', {'size': 50}))
+
+        def cursor():
+            return self.post('/study-deck', {'size': 5}).get_json()['cursor']
+        self.assertQueryBudget(
+            2,
+            lambda cursor: self.post(
+                '/study-deck', {'size': 50, 'cursor': cursor}),
+            setup=cursor
+        )
+
+    def test_forecast(self):
+        self.assertQueryBudget(1, lambda: self.post('/forecast', {}))
+        self.assertQueryBudget(1, lambda: self.post(
+            '/forecast', {'days': 30, 'color': 'black'}))
+
+    def test_scores(self):
+        self.assertQueryBudget(
+            4,
+            lambda scores: self.post('/scores', {'scores': scores}),
+            setup=lambda: [[m.id, 3] for m in Move.query.limit(20)]
+        )
+
+    def test_explore(self):
+        self.assertQueryBudget(1, lambda: self.post('/explore', {'color': 'w'}))
+        self.assertQueryBudget(
+            3,
+            lambda move_id: self.post('/explore', {'last_move_id': move_id}),
+            setup=lambda: self.move_with_children().id
+        )
+
+    def test_explore_not_modified(self):
+        # only the repertoire version is loaded
+        def etag():
+            return self.get('/explore?color=w&depth=4').headers['ETag']
+        self.assertQueryBudget(
+            1,
+            lambda etag: self.client.get(
+                '/api/explore?color=w&depth=4', headers={
+                    'Authorization': 'Bearer ' + self.token,
+                    'If-None-Match': etag,
+                }),
+            setup=etag
+        )
+
+    def test_explore_depth(self):
+        # one query per ply
+        self.assertQueryBudget(4, lambda: self.post(
+            '/explore', {'color': 'w', 'depth': 4}))
+
+    def test_explore_max_nodes(self):
+        self.add_repertoire(1000, 'w')
+        user_id = self.user.id
+
+        def size(nodes):
+            return sum(1 + size(n.get('children', [])) for n in nodes)
+
+        with self.assertMaxQueries(10) as counter:
+            tree = Move.get_subtree(user_id, color='w', depth=10,
+                                    max_nodes=20)
+        # whole plies of three moves per position, the third doesn't fit
+        self.assertEqual(size(tree), 3 + 9)
+        # plies after the first stop fetching one row past max_nodes
+        self.assertEqual(len(counter), 3)
+        self.assertTrue(all('LIMIT' in statement
+                            for statement in counter.statements[1:]))
+
+    def test_add_and_delete_move(self):
+        # one of which bumps the user's repertoire version
+        self.assertQueryBudget(
+            6,
+            lambda move: self.post('/add-move', {
+                'parent_id': move.id, 'fen': move.fen, 'san': 'Ke2',
+                'perspective': 'w'}),
+            setup=self.leaf_move
+        )
+        self.assertQueryBudget(
+            6,
+            lambda move_id: self.post('/del-move', {'move_id': move_id}),
+            setup=lambda: self.leaf_move().id
+        )
+
+    def test_delete_subtree(self):
+        def first_move():
+            return Move.query \
+                        .filter_by(user_id=self.user.id, parent_id=None) \
+                        .first().id
+        self.assertQueryBudget(
+            5,
+            lambda move_id: self.post(
+                '/del-move', {'move_id': move_id, 'recursive': True}),
+            setup=first_move
+        )
+
+    def test_export(self):
+        self.assertQueryBudget(1, lambda: self.post('/export', {'color': 'w'}))
+        self.assertQueryBudget(1, lambda: self.post(
+            '/export', {'color': 'b', 'format': 'pgn'}))
+
+    def test_position_and_transpositions(self):
+        self.assertQueryBudget(
+            3,
+            lambda fen: self.post('/position', {'fen': fen}),
+            setup=lambda: self.move_with_children().fen
+        )
+        self.assertQueryBudget(
+            4,
+            lambda move_id: self.post('/transpositions', {'move_id': move_id}),
+            setup=lambda: self.move_with_children().id
+        )
@@ -0,0 +1,55 @@
+import os
+import tempfile
+import unittest
+
+from limits import parse
+from limits.storage import storage_from_string
+from limits.strategies import FixedWindowRateLimiter, MovingWindowRateLimiter
+
+from app.ratelimit import SQLiteStorage
+
+
+class SQLiteStorageTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.uri = 'sqlite:///' + os.path.join(self.directory.name, 'limits.sqlite')
+        self.storage = storage_from_string(self.uri)
+
+    def test_scheme(self):
+        self.assertIsInstance(self.storage, SQLiteStorage)
+        self.assertTrue(self.storage.check())
+
+    def test_fixed_window(self):
+        limiter = FixedWindowRateLimiter(self.storage)
+        limit = parse('3 per minute')
+        self.assertEqual([limiter.hit(limit, 'a') for _ in range(4)],
+                         [True, True, True, False])
+        self.assertTrue(limiter.hit(limit, 'b'))
+        self.assertEqual(self.storage.get(limit.key_for('a')), 4)
+        self.assertGreater(self.storage.get_expiry(limit.key_for('a')), 0)
+        limiter.clear(limit, 'a')
+        self.assertTrue(limiter.hit(limit, 'a'))
+
+    def test_fixed_window_expires(self):
+        self.assertEqual(self.storage.incr('key', 0), 1)
+        # the window of zero seconds is over, counting starts again
+        self.assertEqual(self.storage.incr('key', 60), 1)
+        self.assertEqual(self.storage.incr('key', 60), 2)
+
+    def test_moving_window(self):
+        limiter = MovingWindowRateLimiter(self.storage)
+        limit = parse('2 per minute')
+        self.assertTrue(limiter.test(limit, 'a'))
+        self.assertEqual([limiter.hit(limit, 'a') for _ in range(3)],
+                         [True, True, False])
+        self.assertEqual(limiter.get_window_stats(limit, 'a')[1], 0)
+        self.assertTrue(limiter.hit(limit, 'b'))
+
+    def test_shared_between_storages(self):
+        other = storage_from_string(self.uri)
+        self.storage.incr('key', 60)
+        self.assertEqual(other.incr('key', 60), 2)
+        self.assertEqual(other.reset(), 1)
+        self.assertEqual(self.storage.get('key'), 0)
@@ -0,0 +1,107 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from config import config, TestingConfig
+from app import create_app, db, guard, limiter
+from app.models import Move, User
+from app.replica import PRIMARY, replicate
+
+E4 = 'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1'
+E5 = 'rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2'
+
+
+class ReplicaTestCase(unittest.TestCase):
+    """Two SQLite files, the replica only updated by replicate()"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.primary = os.path.join(directory.name, 'primary.sqlite')
+        self.replica = os.path.join(directory.name, 'replica.sqlite')
+        config['testing-replica'] = type('ReplicaConfig', (TestingConfig,), {
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + self.primary,
+            'SQLALCHEMY_BINDS': {'replica': 'sqlite:///' + self.replica},
+        })
+        self.app = create_app('testing-replica')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(username='test', password='')
+        db.session.add(self.user)
+        db.session.commit()
+        self.user_id = self.user.id
+        self.move_id = Move.create_move(self.user_id, None, E4, 'e4', 'w')
+        replicate(db, self.app)
+        db.session.remove()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def count(self, path):
+        with sqlite3.connect(path) as connection:
+            return connection.execute('SELECT count(*) FROM moves').fetchone()[0]
+
+    def test_reads_use_replica(self):
+        with sqlite3.connect(self.primary) as connection:
+            connection.execute('DELETE FROM moves')
+        self.assertEqual(Move.query.count(), 1)
+        self.assertFalse(db.session.info.get(PRIMARY))
+        db.session.remove()
+        replicate(db, self.app)
+        self.assertEqual(Move.query.count(), 0)
+
+    def test_read_your_writes(self):
+        self.assertEqual(Move.query.count(), 1)
+        Move.create_move(self.user_id, self.move_id, E5, 'e5', 'w')
+        self.assertTrue(db.session.info[PRIMARY])
+        self.assertEqual(Move.query.count(), 2)
+        self.assertEqual(self.count(self.replica), 1)
+        # a later request reads the replica again
+        db.session.remove()
+        self.assertEqual(Move.query.count(), 1)
+
+    def test_bulk_update(self):
+        Move.query.filter_by(id=self.move_id).update({'san': 'd4'})
+        db.session.commit()
+        self.assertEqual(Move.query.get(self.move_id).san, 'd4')
+
+    def test_write_transaction_reads_primary(self):
+        with sqlite3.connect(self.primary) as connection:
+            connection.execute('DELETE FROM moves')
+        self.assertIsNotNone(Move.query.get(self.move_id))
+        db.session.remove()
+        # the move is looked up on the primary, not on the lagging replica
+        with self.assertRaisesRegex(Exception, 'Move not found'):
+            Move.add_study_sessions(self.user_id, [(self.move_id, 4)])
+
+    def test_play_scores_on_primary(self):
+        Move.create_move(self.user_id, self.move_id, E5, 'e5', 'w')
+        replicate(db, self.app)
+        limiter.enabled = False
+        headers = {'Authorization': 'Bearer '
+                   + guard.encode_jwt_token(User.query.get(self.user_id))}
+        client = self.app.test_client()
+        intervals = []
+        for _ in range(2):
+            r = client.post('/api/play', headers=headers, json={
+                'last_move_id': [self.move_id], 'score': 5})
+            self.assertEqual(r.status_code, 200, r.data)
+            db.session.remove()
+            with sqlite3.connect(self.primary) as connection:
+                intervals.append(connection.execute(
+                    'SELECT interval FROM moves WHERE id = ?',
+                    (self.move_id,)).fetchone()[0])
+        # the second score builds on the first, which the replica never saw
+        self.assertEqual(intervals, [1, 6])
+        self.assertEqual(self.count(self.replica), 2)
+
+    def test_replicate_without_replica(self):
+        config['testing-no-replica'] = type('NoReplica', (TestingConfig,), {
+            'SQLALCHEMY_BINDS': {'replica': 'sqlite://'}})
+        app = create_app('testing-no-replica')
+        with self.assertRaises(ValueError):
+            replicate(db, app)
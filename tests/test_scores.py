@@ -0,0 +1,57 @@
+from app import db
+from app.models import Move, User
+from base import BaseTestCase
+
+
+class ScoreValidationTestCase(BaseTestCase):
+    """Scores of /play, /study and /scores are checked the same way"""
+
+    def setUp(self):
+        super().setUp()
+        self.add_repertoire(50, 'w')
+        other = User(username='other', password='')
+        db.session.add(other)
+        db.session.commit()
+        Move.import_tree(other.id, 'w', [{'san': 'e4', 'fen':
+            'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1'}])
+        self.foreign_id = Move.query.filter_by(user_id=other.id).first().id
+        self.move_id = Move.query \
+                            .filter_by(user_id=self.user.id) \
+                            .filter(Move.child_count > 0) \
+                            .first().id
+
+    def assertUnchanged(self, move_id):
+        move = Move.query.get(move_id)
+        self.assertIsNone(move.easiness)
+        self.assertIsNone(move.next_review)
+
+    def test_foreign_move(self):
+        for url, body in (
+                ('/play', {'last_move_id': [self.foreign_id], 'score': 4}),
+                ('/play', {'last_move_id': [self.foreign_id], 'score': 4,
+                           'line': True}),
+                ('/study', {'last_move_id': [self.foreign_id], 'score': 4}),
+                ('/scores', {'scores': [[self.foreign_id, 4]]})):
+            with self.subTest(url=url, body=body):
+                r = self.post(url, body)
+                self.assertEqual(r.status_code, 404)
+                db.session.expire_all()
+                self.assertUnchanged(self.foreign_id)
+
+    def test_score_out_of_range(self):
+        for url, score in (('/play', 7), ('/study', 7), ('/play', -1),
+                           ('/play', 'x'), ('/study', 'x')):
+            with self.subTest(url=url, score=score):
+                r = self.post(url, {'last_move_id': [self.move_id],
+                                    'score': score})
+                self.assertEqual(r.status_code, 400)
+                self.assertUnchanged(self.move_id)
+
+    def test_zero_is_a_score(self):
+        r = self.post('/play', {'last_move_id': [self.move_id], 'score': 0})
+        self.assertEqual(r.status_code, 200)
+        self.assertIsNotNone(Move.query.get(self.move_id).easiness)
+
+    def test_kernel_rejects_out_of_range(self):
+        with self.assertRaises(ValueError):
+            Move.add_study_sessions(self.user.id, [(self.move_id, 6)])
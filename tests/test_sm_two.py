@@ -0,0 +1,74 @@
+import random
+from datetime import date, datetime, timedelta
+
+from app.models import Move
+from app.utils.sm_two import next_sm_two, sm_two_arrays, next_reviews
+from base import BaseTestCase
+
+
+class SmTwoTestCase(BaseTestCase):
+    """Scores, batches of scores and reschedule agree on intervals"""
+
+    def setUp(self):
+        super().setUp()
+        self.add_repertoire(30, 'w')
+        self.move_ids = [m.id for m in
+                         Move.query.filter_by(user_id=self.user.id)]
+
+    def schedules(self):
+        return {m.id: (m.interval, m.repetitions, m.easiness, m.next_review)
+                for m in Move.query.filter_by(user_id=self.user.id)}
+
+    def test_kernel_matches_scalar(self):
+        rng = random.Random(0)
+        rows = []
+        for _ in range(500):
+            studied = rng.random() < 0.8
+            rows.append((
+                rng.randint(0, 5),
+                rng.randint(1, 400) if studied else 0,
+                rng.randint(1, 12) if studied else 1,
+                round(rng.uniform(1.3, 3.0), 2) if studied else None
+            ))
+        for cap in (365, 30):
+            with self.subTest(cap=cap):
+                interval, repetitions, easiness = sm_two_arrays(
+                    [r[0] for r in rows],
+                    [r[1] for r in rows],
+                    [r[2] for r in rows],
+                    [float('nan') if r[3] is None else r[3] for r in rows],
+                    cap
+                )
+                reviews = next_reviews(date.today(), interval, cap)
+                for i, (quality, *state) in enumerate(rows):
+                    expected = next_sm_two(
+                        quality, *(state if state[2] is not None else ()),
+                        max_interval=cap)
+                    self.assertEqual(interval[i], expected['interval'])
+                    self.assertEqual(repetitions[i], expected['repetitions'])
+                    self.assertAlmostEqual(easiness[i], expected['easiness'])
+                    self.assertEqual(reviews[i], expected['next_review'])
+                    self.assertLessEqual(interval[i], cap)
+
+    def test_default_reschedule_is_noop(self):
+        Move.add_study_sessions(
+            self.user.id, [(move_id, 5) for move_id in self.move_ids])
+        for _ in range(8):
+            Move.add_study_sessions(self.user.id, [(self.move_ids[0], 5)])
+        before = self.schedules()
+        self.assertEqual(before[self.move_ids[0]][0], 365)
+        Move.reschedule(self.user.id)
+        self.assertEqual(self.schedules(), before)
+
+    def test_lowered_cap_survives_scores(self):
+        for _ in range(8):
+            Move.add_study_sessions(self.user.id, [(self.move_ids[0], 5)])
+        self.app.config['SM_TWO_MAX_INTERVAL'] = 30
+        Move.reschedule(self.user.id)
+        interval, *_, next_review = self.schedules()[self.move_ids[0]]
+        self.assertEqual(interval, 30)
+        Move.add_study_sessions(self.user.id, [(self.move_ids[0], 5)])
+        interval, *_, next_review = self.schedules()[self.move_ids[0]]
+        self.assertEqual(interval, 30)
+        self.assertEqual(next_review, datetime.combine(
+            date.today() + timedelta(days=30), datetime.min.time()))
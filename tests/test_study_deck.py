@@ -0,0 +1,144 @@
+from datetime import datetime, timedelta
+
+from app import db
+from app.models import Move, User
+from app.utils.constants import FIRST_MOVE
+from base import BaseTestCase, synthetic_repertoire
+
+
+class StudyDeckTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.add_repertoire(100, 'w')
+        self.add_repertoire(100, 'b')
+
+    def due_goals(self, side_to_move=None):
+        query = Move.query \
+                    .filter_by(user_id=self.user.id, book_move=True) \
+                    .filter(Move.child_count > 0)
+        if side_to_move:
+            query = query.filter_by(side_to_move=side_to_move)
+        return {m.id for m in query}
+
+    def walk(self, size, color=None):
+        """returns the goal ids of every deck, following the cursors"""
+        goals, cursor = [], None
+        for _ in range(len(self.due_goals()) + 1):
+            r = self.post('/study-deck', {
+                'size': size, 'cursor': cursor, 'color': color})
+            self.assertEqual(r.status_code, 200)
+            deck = r.get_json()
+            goals += [card['goal_id'] for card in deck['cards']]
+            cursor = deck['cursor']
+            if cursor is None:
+                return goals
+        self.fail('the cursor never reached the last deck')
+
+    def test_cards_are_study_positions(self):
+        deck = self.post('/study-deck', {'size': 100}).get_json()
+        for card in deck['cards']:
+            goal = Move.query.get(card['goal_id'])
+            next_ids = [m['id'] for m in card['next']]
+            self.assertIn(goal.id, next_ids)
+            if goal.parent_id is None:
+                self.assertEqual(card['move'], FIRST_MOVE)
+            else:
+                self.assertEqual(card['move']['id'], goal.parent_id)
+                self.assertEqual(len(next_ids),
+                                 goal.parent.child_count)
+
+    def test_pages_cover_due_moves(self):
+        # positions are shown once per deck, so every due move is in a
+        # card of its own or shares the position of one
+        goals = self.walk(7)
+        self.assertEqual(len(goals), len(set(goals)))
+        covered = set()
+        for goal_id in goals:
+            goal = Move.query.get(goal_id)
+            covered |= {m.id for m in Move.query.filter_by(
+                user_id=self.user.id, parent_id=goal.parent_id,
+                perspective=goal.perspective, book_move=True)
+                if m.child_count}
+        self.assertEqual(covered, self.due_goals())
+
+    def test_priority_order(self):
+        now = datetime.now()
+        goals = sorted(self.due_goals())
+        # two reviewed moves, the oldest due first, and one not yet due
+        for move_id, days in ((goals[0], -1), (goals[1], -3), (goals[2], 2)):
+            Move.query.get(move_id).next_review = now + timedelta(days=days)
+        db.session.commit()
+        order = self.walk(1)
+        self.assertEqual(order[-2:], [goals[1], goals[0]])
+        self.assertNotIn(goals[2], order)
+        # never reviewed moves come first, by id
+        self.assertEqual(order[:-2], sorted(order[:-2]))
+
+    def schedule_ties(self):
+        """
+        gives the due moves a next review from few values, a third none,
+        and returns them in deck order
+        """
+        now = datetime.now()
+        reviews = [None, now - timedelta(days=2), now - timedelta(hours=1)]
+        goals = sorted(self.due_goals())
+        for i, move_id in enumerate(goals):
+            Move.query.get(move_id).next_review = reviews[i % 3]
+        db.session.commit()
+        return sorted(goals, key=lambda move_id: (
+            reviews[goals.index(move_id) % 3] is not None,
+            reviews[goals.index(move_id) % 3] or now,
+            move_id))
+
+    def test_pages_with_ties(self):
+        expected = self.schedule_ties()
+        # one due move per deck, every deck a card
+        self.assertEqual(self.walk(1), expected)
+        for size in (2, 5, 13):
+            with self.subTest(size=size):
+                goals = self.walk(size)
+                positions = [expected.index(goal_id) for goal_id in goals]
+                # decks follow each other without overlapping
+                self.assertEqual(positions, sorted(set(positions)))
+
+    def test_other_users_excluded(self):
+        other = User(username='other', password='')
+        db.session.add(other)
+        db.session.commit()
+        Move.import_tree(other.id, 'w', synthetic_repertoire(100))
+        now = datetime.now()
+        for move in Move.query.filter_by(book_move=True):
+            move.next_review = now - timedelta(days=1)
+        db.session.commit()
+        goals = self.walk(3)
+        self.assertTrue(goals)
+        self.assertEqual(
+            {Move.query.get(goal_id).user_id for goal_id in goals},
+            {self.user.id})
+
+    def test_cursor_round_trip(self):
+        self.schedule_ties()
+        cursor = None
+        for _ in range(len(self.due_goals())):
+            expected = Move.get_study_deck(self.user.id, size=4, cursor=cursor)
+            r = self.post('/study-deck', {'size': 4, 'cursor': cursor})
+            # the cursor comes back through json as it went out
+            self.assertEqual(r.get_json(), expected)
+            cursor = r.get_json()['cursor']
+            if cursor is None:
+                break
+        self.assertIsNone(cursor)
+
+    def test_color(self):
+        white = self.walk(10, 'white')
+        self.assertTrue(white)
+        for goal_id in white:
+            self.assertEqual(Move.query.get(goal_id).side_to_move, 'b')
+
+    def test_invalid_cursor(self):
+        r = self.post('/study-deck', {'cursor': {'id': 'x'}})
+        self.assertEqual(r.status_code, 400)
+        r = self.post('/study-deck', {
+            'cursor': {'next_review': 'tomorrow', 'id': 1}})
+        self.assertEqual(r.status_code, 400)
@@ -0,0 +1,125 @@
+import os
+import tempfile
+from datetime import date, datetime, timedelta
+
+from config import config, TestingConfig
+from app import create_app, db
+from app.models import QUEUE_ENTRY, Move, StudyQueue, User
+from app.utils.study_queues import QueueBuilder
+from base import BaseTestCase, synthetic_repertoire
+
+
+class StudyQueueTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.app.config['STUDY_QUEUE_ENABLED'] = True
+        self.add_repertoire(100, 'w')
+        self.add_repertoire(100, 'b')
+
+    def entries(self):
+        queue = StudyQueue.query.get(self.user.id)
+        return [QUEUE_ENTRY.unpack_from(queue.entries, i * QUEUE_ENTRY.size)
+                for i in range(len(queue))]
+
+    def study(self, body=None):
+        r = self.post('/study', body or {})
+        self.assertEqual(r.status_code, 200)
+        return r.get_json()
+
+    def test_pops_in_order(self):
+        now = datetime.now()
+        book = Move.query \
+                    .filter_by(user_id=self.user.id, book_move=True) \
+                    .filter(Move.child_count > 0) \
+                    .order_by(Move.id) \
+                    .all()
+        # reviewed moves come after the new ones, the latest not being due
+        book[0].next_review = now - timedelta(days=2)
+        book[1].next_review = now + timedelta(days=3)
+        db.session.commit()
+
+        first = self.study()
+        entries = self.entries()
+        self.assertEqual(StudyQueue.query.get(self.user.id).head, 1)
+        self.assertEqual(len(entries), len(book) - 1)
+        self.assertEqual(entries[-1][0], book[0].id)
+        self.assertNotIn(book[1].id, [move_id for move_id, _ in entries])
+
+        positions = [first] + [self.study() for _ in range(len(entries) - 1)]
+        self.assertEqual(
+            [p['move']['id'] for p in positions],
+            [parent_id or '' for _, parent_id in entries])
+        for (move_id, _), position in zip(entries, positions):
+            self.assertIn(move_id, [m['id'] for m in position['next']])
+
+    def test_skips_moves_studied_elsewhere(self):
+        self.study()
+        entries = self.entries()
+        self.post('/scores', {'scores': [[entries[1][0], 4]]})
+        position = self.study()
+        self.assertEqual(position['move']['id'], entries[2][1] or '')
+        self.assertEqual(StudyQueue.query.get(self.user.id).head, 3)
+
+    def test_rebuilt_after_new_moves(self):
+        self.study()
+        self.study()
+        leaf = Move.query.filter_by(user_id=self.user.id, child_count=0).first()
+        Move.create_move(self.user.id, leaf.id, leaf.fen, 'Ke2', 'w')
+        self.study()
+        self.assertEqual(StudyQueue.query.get(self.user.id).head, 1)
+
+    def test_rebuilt_when_stale(self):
+        self.study()
+        db.session.query(StudyQueue).update({'stale': True})
+        db.session.commit()
+        self.study()
+        queue = StudyQueue.query.get(self.user.id)
+        self.assertEqual(queue.head, 1)
+        self.assertFalse(queue.stale)
+
+    def test_nothing_due(self):
+        Move.query.update({'next_review': datetime.now() + timedelta(days=5)})
+        db.session.commit()
+        # the moves due soonest are studied, as without a queue
+        self.assertIn('next', self.study())
+        self.assertEqual(len(StudyQueue.query.get(self.user.id)), 0)
+
+    def test_color_skips_queue(self):
+        self.study({'color': 'white'})
+        self.assertIsNone(StudyQueue.query.get(self.user.id))
+
+
+class QueueBuilderTestCase(BaseTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        config['testing-queues'] = type('QueuesConfig', (TestingConfig,), {
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(
+                directory.name, 'queues.sqlite'),
+        })
+        self.app = create_app('testing-queues')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user_ids = []
+        for n in range(5):
+            user = User(username=f'user-{n}', password='')
+            db.session.add(user)
+            db.session.commit()
+            Move.import_tree(user.id, 'w', synthetic_repertoire(50, seed=n))
+            self.user_ids.append(user.id)
+
+    def test_build(self):
+        reports = []
+        builder = QueueBuilder('testing-queues', processes=2, chunk_users=2,
+                               report=reports.append)
+        self.assertEqual(builder.build(), 5)
+        self.assertIn('users/sec', reports[-1])
+        for user_id in self.user_ids:
+            queue = StudyQueue.query.get(user_id)
+            self.assertEqual(queue.day, date.today())
+            expected = StudyQueue.compute(user_id, date.today())
+            self.assertEqual(queue.entries, expected['entries'])
+            self.assertGreater(len(queue), 0)